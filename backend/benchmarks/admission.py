@@ -0,0 +1,101 @@
+"""
+Admission control: a login flood from one IP with rate limits off and on, timing the logins of another
+client meanwhile, the async_stack workload on cheap routes with them off and on, and one bucket check.
+
+    python -m benchmarks.admission
+"""
+
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from passlib.hash import argon2
+
+from dating.admission import TokenBuckets
+from dating.chats.crud import RAMChatCrud
+from dating.main.api import create_app
+from dating.main.config import Settings, RATE_LIMIT_BUCKETS
+from dating.users.crud import RAMUserCrud
+from dating.users.schema import UserIn
+
+from .async_stack import USERS, drive
+from .utils import ns_per_call, percentiles, print_table
+
+
+FLOOD = 500
+FLOOD_CONCURRENCY = 64
+LOGINS = 10
+
+
+def count(statuses: dict[int, int], status_code: int) -> None:
+    statuses[status_code] = statuses.get(status_code, 0) + 1
+
+
+def format_statuses(statuses: dict[int, int]) -> str:
+    return " ".join(f"{status_code}:{number}" for status_code, number in sorted(statuses.items()))
+
+
+async def flood(app: FastAPI) -> tuple[float, dict[int, int], dict[int, int], dict[str, float]]:
+    attack_statuses: dict[int, int] = {}
+    login_statuses: dict[int, int] = {}
+    latencies: list[float] = []
+
+    attacker = httpx.AsyncClient(transport=httpx.ASGITransport(app, client=("10.0.0.1", 1)), base_url="http://bench")
+    user = httpx.AsyncClient(transport=httpx.ASGITransport(app, client=("10.0.0.2", 1)), base_url="http://bench")
+
+    async def attack(worker_id: int) -> None:
+        for i in range(worker_id, FLOOD, FLOOD_CONCURRENCY):
+            response = await attacker.post("/users/login", json={"username": f"user{i % USERS}", "password": "wrong"})
+            count(attack_statuses, response.status_code)
+
+    async def log_in() -> None:
+        for i in range(LOGINS):
+            start = time.perf_counter()
+            login_data = {"username": f"user{USERS - 1 - i}", "password": "password"}
+            response = await user.post("/users/login", json=login_data)
+            latencies.append(time.perf_counter() - start)
+            count(login_statuses, response.status_code)
+
+    async with attacker, user:
+        start = time.perf_counter()
+        attacks = asyncio.gather(*(attack(worker_id) for worker_id in range(FLOOD_CONCURRENCY)))
+        await log_in()
+        await attacks
+        elapsed = time.perf_counter() - start
+
+    return elapsed, attack_statuses, login_statuses, percentiles([latency * 1000 for latency in latencies])
+
+
+def main() -> None:
+    users, chats = RAMUserCrud(), RAMChatCrud()
+    hashed_password = argon2.hash("password")
+    for i in range(USERS):
+        users.create_user(UserIn(username=f"user{i}", hashed_password=hashed_password))
+    for i in range(1, USERS):
+        chats.create_chat([i, i + 1])
+
+    rows = []
+    for rate_limits in (False, True):
+        settings = Settings(metrics=False, rate_limits=rate_limits)
+        elapsed, attack_statuses, login_statuses, latency = asyncio.run(flood(create_app(settings)))
+        rps, _ = asyncio.run(drive(create_app(settings)))
+        rows.append((
+            "on" if rate_limits else "off", elapsed, format_statuses(attack_statuses),
+            format_statuses(login_statuses), latency["p50"], latency["p99"], rps,
+        ))
+
+    print_table(
+        ("rate limits", "flood, s", "flood", "other logins", "login p50, ms", "login p99, ms", "cheap requests/s"),
+        rows,
+    )
+
+    buckets = TokenBuckets(rate=1, burst=20, max_size=RATE_LIMIT_BUCKETS)
+    keys = [f"10.0.{i // 256}.{i % 256}" for i in range(RATE_LIMIT_BUCKETS * 2)]
+    next_key = iter(keys * 10).__next__
+    check = ns_per_call(lambda: buckets.acquire(next_key()))
+    print(f"bucket check, {RATE_LIMIT_BUCKETS} buckets evicting: {check:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Requests/sec and latency of the async service stack with RAM backends running on the event loop,
+against the same backends behind the thread offload adapters, which is how every route ran when
+routes and services were sync.
+
+    python -m benchmarks.async_stack
+"""
+
+import asyncio
+import time
+from typing import AsyncGenerator
+
+import httpx
+from fastapi import FastAPI
+from passlib.hash import argon2
+
+from dating.chats.crud import RAMChatCrud, RAMMessageCrud
+from dating.chats.service import ChatService, CrudChatServiceImp, OffloadedChatServiceImp
+from dating.main.api import create_app
+from dating.main.config import Settings, MESSAGES_SEGMENT_SIZE
+from dating.users.crud import RAMUserCrud
+from dating.users.schema import UserIn
+from dating.users.service import UserService, CrudUserServiceImp, OffloadedUserServiceImp
+
+from .utils import percentiles, print_table
+
+
+USERS = 10_000
+REQUESTS = 5_000
+CONCURRENCY = 32
+
+
+def offloaded(app: FastAPI) -> FastAPI:
+    async def create_user_service() -> AsyncGenerator[UserService, None]:
+        yield UserService(OffloadedUserServiceImp(CrudUserServiceImp(RAMUserCrud())))
+
+    async def create_chat_service() -> AsyncGenerator[ChatService, None]:
+        imp = OffloadedChatServiceImp(CrudChatServiceImp(RAMChatCrud(), RAMMessageCrud(MESSAGES_SEGMENT_SIZE)))
+        yield ChatService(imp, UserService(OffloadedUserServiceImp(CrudUserServiceImp(RAMUserCrud()))))
+
+    app.dependency_overrides[UserService] = create_user_service
+    app.dependency_overrides[ChatService] = create_chat_service
+    return app
+
+
+async def drive(app: FastAPI) -> tuple[float, dict[str, float]]:
+    latencies: list[float] = []
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/users/login", json={"username": "user0", "password": "password"})
+        for _ in range(200):
+            await client.get("/users/me")
+
+        async def worker(worker_id: int) -> None:
+            for i in range(worker_id, REQUESTS, CONCURRENCY):
+                url = "/users/me" if i % 2 else f"/chats/user/{i % USERS + 1}"
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(worker_id) for worker_id in range(CONCURRENCY)))
+        elapsed = time.perf_counter() - start
+
+    return REQUESTS / elapsed, percentiles([latency * 1000 for latency in latencies])
+
+
+def main() -> None:
+    users, chats = RAMUserCrud(), RAMChatCrud()
+    hashed_password = argon2.hash("password")
+    for i in range(USERS):
+        users.create_user(UserIn(username=f"user{i}", hashed_password=hashed_password))
+    for i in range(1, USERS):
+        chats.create_chat([i, i + 1])
+
+    rows = []
+    for name, app in (("native", create_app(Settings())), ("offloaded", offloaded(create_app(Settings())))):
+        rps, latency = asyncio.run(drive(app))
+        rows.append((name, rps, latency["p50"], latency["p99"]))
+
+    print_table(("services", "requests/s", "p50, ms", "p99, ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
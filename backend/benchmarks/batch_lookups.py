@@ -0,0 +1,100 @@
+"""
+A client showing a user's chats with their members: GET /chats/user/{id} then GET /users/{id} for every
+member, against a single GET /chats/user/{id}/with-users, on RAM and SQLite storage.
+
+    python -m benchmarks.batch_lookups
+"""
+
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from dating.chats.crud import CHATS_DB, RAMChatCrud, SQLiteChatCrud
+from dating.database import SQLiteConnectionPool
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.crud import USERS_DB, RAMUserCrud, SQLiteUserCrud
+from dating.users.schema import UserIn
+
+from .utils import percentiles, print_table
+
+
+USERS = 10_000
+CHATS_PER_USER = 20
+LOOKUPS = 300
+
+
+def seed(settings: Settings) -> None:
+    rng = random.Random(0)
+    users: RAMUserCrud | SQLiteUserCrud
+    chats: RAMChatCrud | SQLiteChatCrud
+
+    if settings.storage == "sqlite":
+        pool = SQLiteConnectionPool(settings.sqlite_path, size=1)
+        pool.create_tables()
+        users, chats = SQLiteUserCrud(pool), SQLiteChatCrud(pool)
+    else:
+        USERS_DB.clear()
+        CHATS_DB.clear()
+        users, chats = RAMUserCrud(), RAMChatCrud()
+
+    for i in range(USERS):
+        users.create_user(UserIn(username=f"user{i}", hashed_password="hash"))
+    chats.create_chats(
+        [user_id, rng.randint(1, USERS)] for user_id in range(1, USERS + 1) for _ in range(CHATS_PER_USER // 2)
+    )
+
+    if settings.storage == "sqlite":
+        pool.close()
+
+
+async def one_by_one(client: httpx.AsyncClient, user_id: int) -> int:
+    chats = (await client.get(f"/chats/user/{user_id}")).json()
+    members = {member_id for chat in chats for member_id in chat["users_ids"]}
+    users = [(await client.get(f"/users/{member_id}")).json() for member_id in members]
+    return len(users)
+
+
+async def batched(client: httpx.AsyncClient, user_id: int) -> int:
+    chats = (await client.get(f"/chats/user/{user_id}/with-users")).json()
+    return len({user["id"] for chat in chats for user in chat["users"]})
+
+
+async def measure(settings: Settings) -> list[tuple[object, ...]]:
+    app = create_app(settings)
+    rows: list[tuple[object, ...]] = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, lookup in (("one by one", one_by_one), ("with-users", batched)):
+                rng = random.Random(1)
+                latencies = []
+                for _ in range(LOOKUPS):
+                    start = time.perf_counter()
+                    await lookup(client, rng.randint(1, USERS))
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+                stats = percentiles(latencies)
+                rows.append((settings.storage, name, stats["p50"], stats["p95"], stats["p99"]))
+
+    return rows
+
+
+def main() -> None:
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for storage in ("ram", "sqlite"):
+            settings = Settings(storage=storage, sqlite_path=str(Path(directory) / "batch.sqlite3"), metrics=False)
+            seed(settings)
+            rows.extend(asyncio.run(measure(settings)))
+
+    print_table(("storage", "client", "p50, ms", "p95, ms", "p99, ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Message fan-out latency of ChatHub with thousands of concurrent subscribers.
+
+Every subscriber is a task draining its own queue, the way each WebSocket connection does in the
+/chats/{chat_id}/ws route, so the numbers include event loop scheduling of all consumers.
+
+    python -m benchmarks.chat_fanout
+"""
+
+import asyncio
+import time
+
+from dating.chats.hub import ChatHub, Subscription
+from dating.chats.schema import Message
+
+from .utils import percentiles, print_table
+
+
+CONNECTIONS = (1_000, 5_000, 10_000)
+CHATS = 100
+MESSAGES = 20
+
+
+async def consume(subscription: Subscription, published: dict[tuple[int, int], float], latencies: list[float]) -> None:
+    """Takes the messages of the run, or fewer if the hub drops the subscription and closes its queue"""
+
+    for _ in range(MESSAGES):
+        if (message := await subscription.queue.get()) is None:
+            return
+        received = time.perf_counter()
+        message_id = int(message.split('"id":', 1)[1].split(",", 1)[0])
+        latencies.append(received - published[subscription.chat_id, message_id])
+
+
+async def run(connections: int) -> tuple[float, dict[str, float], int]:
+    hub = ChatHub(max_queue=256)
+    subscriptions = [hub.subscribe(i % CHATS, i) for i in range(connections)]
+    published: dict[tuple[int, int], float] = {}
+    latencies: list[float] = []
+    consumers = [asyncio.create_task(consume(subscription, published, latencies)) for subscription in subscriptions]
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    for message_id in range(1, MESSAGES + 1):
+        for chat_id in range(CHATS):
+            published[chat_id, message_id] = time.perf_counter()
+            hub.publish(Message(id=message_id, chat_id=chat_id, author_id=1, text="hello", created_at=time.time()))
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*consumers)
+    elapsed = time.perf_counter() - start
+
+    return len(latencies) / elapsed, percentiles([latency * 1e6 for latency in latencies]), hub.dropped
+
+
+def main() -> None:
+    rows = []
+    for connections in CONNECTIONS:
+        deliveries, latency, dropped = asyncio.run(run(connections))
+        rows.append((connections, deliveries, latency["p50"], latency["p95"], latency["p99"], dropped))
+
+    print_table(("connections", "deliveries/s", "p50, us", "p95, us", "p99, us", "dropped"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+A long-time user's chats: the response listing all of them, as /chats/user/{user_id} did, against a page of
+DEFAULT_PAGE_SIZE deep into them, the page requested over HTTP, and their matchmaking exclusion set built
+from the whole list against the partners index.
+
+    python -m benchmarks.chat_pages
+"""
+
+import asyncio
+import time
+
+import httpx
+
+from dating.chats.crud import CHATS_DB, RAMChatCrud
+from dating.chats.schema import ChatOut
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.pagination import DEFAULT_PAGE_SIZE, encode_cursor
+from dating.serialization import json_list_response
+
+from .utils import ns_per_call, print_table
+
+
+CHATS = (1_000, 10_000, 100_000)
+REQUESTS = 20
+
+
+def partners_from_list(crud: RAMChatCrud, user_id: int) -> set[int]:
+    partners = {user_id}
+    for chat in crud.get_user_chats(user_id):
+        partners.update(chat.users_ids)
+    return partners
+
+
+async def page_request_ms(chats: int) -> float:
+    transport = httpx.ASGITransport(app=create_app(Settings(metrics=False)))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            response = await client.get("/chats/user/1", params={"cursor": encode_cursor(chats // 2)})
+            assert response.status_code == 200
+        return (time.perf_counter() - start) / REQUESTS * 1000
+
+
+def main() -> None:
+    rows = []
+    crud = RAMChatCrud()
+
+    for chats in CHATS:
+        CHATS_DB.clear()
+        crud.create_chats([1, user_id] for user_id in range(2, chats + 2))
+
+        number = max(1_000_000 // chats, 10)
+        rows.append((
+            chats,
+            ns_per_call(lambda: json_list_response(ChatOut, crud.get_user_chats(1)), number) / 1_000_000,
+            ns_per_call(
+                lambda: json_list_response(ChatOut, crud.get_user_chats(1, chats // 2, DEFAULT_PAGE_SIZE + 1)),
+                number,
+            ) / 1_000_000,
+            asyncio.run(page_request_ms(chats)),
+            ns_per_call(lambda: partners_from_list(crud, 1), number) / 1000,
+            ns_per_call(lambda: crud.get_chat_partners(1), number) / 1000,
+        ))
+
+    CHATS_DB.clear()
+    print_table(
+        ("chats", "all chats response, ms", "page response, ms", "page over http, ms", "partners from list, us",
+         "partners index, us"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
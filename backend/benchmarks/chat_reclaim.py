@@ -0,0 +1,81 @@
+"""
+Reclaiming a million abandoned chats in RAM: how long it takes with runs back to back, the longest an event loop
+ticking every millisecond meanwhile waits, and the process RSS before and after.
+
+    python -m benchmarks.chat_reclaim
+"""
+
+import asyncio
+import time
+
+from dating.chats.crud import CHATS_DB, RAMChatCrud, RAMMessageCrud
+from dating.chats.reclaim import ChatReclaimer
+from dating.chats.service import ChatService, RAMChatServiceImp
+from dating.main.config import CHAT_RECLAIM_BATCH
+from dating.users.crud import RAMUserCrud
+from dating.users.service import UserService, RAMUserServiceImp
+
+from .load import rss_mb
+from .utils import print_table
+
+
+CHATS = 1_000_000
+USERS = 100_000
+
+
+async def reclaim_all(reclaimer: ChatReclaimer) -> tuple[float, float, int]:
+    longest = 0.0
+    done = False
+
+    async def tick() -> None:
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    runs = 0
+    while CHATS_DB.shrunk:
+        await reclaimer.run()
+        runs += 1
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    done = True
+    await ticker
+    return elapsed, longest, runs
+
+
+def main() -> None:
+    chats = RAMChatCrud()
+    service = ChatService(
+        RAMChatServiceImp(chats, RAMMessageCrud(segment_size=16)), UserService(RAMUserServiceImp(RAMUserCrud())),
+    )
+
+    created = chats.create_chats([i % USERS + 1, (i + 1) % USERS + 1] for i in range(CHATS))
+    for chat in created:
+        for user_id in chat.users_ids:
+            chats.delete_chat_for_user(chat.id, user_id)
+    del created
+    before = rss_mb()
+
+    rows = []
+    reclaimer = ChatReclaimer(service, min_members=1, batch=CHAT_RECLAIM_BATCH)
+    elapsed, stall, runs = asyncio.run(reclaim_all(reclaimer))
+    after = sum(map(len, (CHATS_DB.by_id, CHATS_DB.by_user, CHATS_DB.partners, CHATS_DB.shrunk)))
+    rows.append((reclaimer.reclaimed, runs, elapsed, stall * 1000, before, rss_mb(), after))
+
+    print_table(
+        ("reclaimed", "runs", "total, s", "longest loop stall, ms", "rss before, MB", "rss after, MB", "entries left"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
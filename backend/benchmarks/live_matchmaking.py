@@ -0,0 +1,119 @@
+"""
+Matchmaking queue and presence tracking at scale: the cost of joining, leaving and matching with tens
+of thousands of users waiting, and of heartbeats, random online picks and sweeps over 1M users online.
+Then WAITERS concurrent long-polls are paired through the queue to show they all resolve.
+
+    python -m benchmarks.live_matchmaking
+"""
+
+import asyncio
+import random
+import time
+
+from dating.chats.matchmaking import MatchQueue
+from dating.users.presence import PresenceTracker
+
+from .utils import ns_per_call, print_table
+
+
+WAITERS = 50_000
+ONLINE = 1_000_000
+TOPICS = [f"topic{i}" for i in range(100)]
+
+
+async def queue_rows() -> list[tuple[str, float]]:
+    rng = random.Random(0)
+    queue = MatchQueue(max_size=WAITERS * 2)
+    ids = iter(range(WAITERS, 10 ** 9))
+
+    for user_id in range(WAITERS):
+        queue.put(user_id, rng.sample(TOPICS, 3))
+
+    def join_and_leave() -> None:
+        user_id = next(ids)
+        queue.discard(user_id, queue.put(user_id, ()))
+
+    def match_and_rejoin() -> None:
+        match = queue.pop_match(rng.sample(TOPICS, 3), except_=set())
+        assert match
+        user_id, waiter = match
+        waiter.future.set_result(None)
+        queue.put(user_id, waiter.topics)
+
+    # The oldest waiters are all users already met, as many as a match may skip
+    met_queue = MatchQueue(max_size=WAITERS)
+    for user_id in range(WAITERS):
+        met_queue.put(user_id, ())
+    already_met = set(range(met_queue.window * 4))
+
+    def match_skipping_met() -> None:
+        match = met_queue.pop_match((), except_=already_met)
+        assert match
+        user_id, waiter = match
+        waiter.future.set_result(None)
+        met_queue.put(user_id, waiter.topics)
+
+    return [
+        ("queue: join and leave", ns_per_call(join_and_leave)),
+        ("queue: match by topics", ns_per_call(match_and_rejoin)),
+        ("queue: match skipping met", ns_per_call(match_skipping_met)),
+    ]
+
+
+def presence_rows() -> list[tuple[str, float]]:
+    now = 0.0
+    presence = PresenceTracker(ttl=60, clock=lambda: now)
+    rng = random.Random(0)
+
+    for user_id in range(ONLINE):
+        presence.touch(user_id)
+
+    ids = [rng.randrange(ONLINE) for _ in range(100_000)]
+    heartbeats = iter(ids * 10)
+    touch = ns_per_call(lambda: presence.touch(next(heartbeats)))
+    pick = ns_per_call(lambda: presence.random_online(except_={1, 2, 3}))
+
+    now = 61
+    start = time.perf_counter_ns()
+    swept = presence.sweep(ONLINE)
+    sweep = (time.perf_counter_ns() - start) / swept
+
+    return [("presence: heartbeat", touch), ("presence: random online", pick), ("presence: sweep, per user", sweep)]
+
+
+async def long_polls() -> tuple[float, int]:
+    queue = MatchQueue(max_size=WAITERS)
+    matched = 0
+
+    async def wait(user_id: int) -> None:
+        future = queue.put(user_id, ())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), 5)
+        except TimeoutError:
+            queue.discard(user_id, future)
+
+    async def take() -> None:
+        nonlocal matched
+        while match := queue.pop_match((), except_=set()):
+            match[1].future.set_result(None)
+            matched += 1
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    waits = [asyncio.create_task(wait(user_id)) for user_id in range(WAITERS)]
+    await asyncio.sleep(0)
+    await take()
+    await asyncio.gather(*waits)
+    return time.perf_counter() - start, matched
+
+
+def main() -> None:
+    rows = asyncio.run(queue_rows()) + presence_rows()
+    print_table(("operation", "ns"), rows)
+
+    seconds, matched = asyncio.run(long_polls())
+    print(f"{WAITERS} long-polls, {matched} matched in {seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
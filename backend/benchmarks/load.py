@@ -0,0 +1,323 @@
+"""
+Offline load test of the whole API.
+
+Seeds synthetic users, sessions and chats into the backend create_app picks for the storage, then
+drives a fixed mix of register, login, /users/me, /chats/start and /chats/user/{id} requests
+in-process through the ASGI transport and over HTTP against a local uvicorn. Reports throughput,
+p50/p95/p99 latency per endpoint and server memory, and saves them as JSON for comparing runs.
+
+    python -m benchmarks.load --storage ram --users 100000 --requests 20000
+    python -m benchmarks.load --storage sqlite --transport asgi --output sqlite.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import socket
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from passlib.hash import argon2
+
+from dating.chats.crud import CHATS_DB, MESSAGES_DB, RAMChatCrud, SQLiteChatCrud
+from dating.database import SQLiteConnectionPool
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.crud import USERS_DB, SESSIONS_DB, RAMUserCrud, RAMSessionCrud, SQLiteUserCrud, SQLiteSessionCrud
+from dating.users.schema import UserIn
+from dating.users.security import SESSION_EXPIRATION_TIME
+
+from .utils import percentiles, print_table
+
+
+PASSWORD = "password"
+RESULTS_DIRECTORY = Path(__file__).parent / "results"
+
+# Share of each operation in the request mix
+MIX = {
+    "register": 1,
+    "login": 1,
+    "me": 60,
+    "start": 8,
+    "user_chats": 30,
+}
+
+
+@dataclass
+class Population:
+    users: int
+    sessions: int
+    chats: int
+    seed: int
+
+
+@dataclass
+class Run:
+    transport: str
+    storage: str
+    requests: int
+    concurrency: int
+    seconds: float
+    requests_per_second: float
+    errors: int
+    rss_mb_seeded: float | None
+    rss_mb_after: float | None
+    latency_ms: dict[str, dict[str, float]]
+
+
+def token(i: int) -> str:
+    return f"load-token-{i}"
+
+
+def seed(settings: Settings, population: Population) -> None:
+    """Fills the stores create_app(settings) uses. Every user shares one precomputed password hash"""
+
+    hashed_password = argon2.hash(PASSWORD)
+    rng = random.Random(population.seed)
+
+    users: RAMUserCrud | SQLiteUserCrud
+    chats: RAMChatCrud | SQLiteChatCrud
+    sessions: RAMSessionCrud | SQLiteSessionCrud
+
+    if settings.storage == "sqlite":
+        pool = SQLiteConnectionPool(settings.sqlite_path, size=1)
+        pool.create_tables()
+        users, chats = SQLiteUserCrud(pool), SQLiteChatCrud(pool)
+        sessions = SQLiteSessionCrud(pool, ttl=SESSION_EXPIRATION_TIME)
+    elif settings.storage == "ram":
+        for store in (USERS_DB, CHATS_DB, MESSAGES_DB, SESSIONS_DB):
+            store.clear()
+        users, chats = RAMUserCrud(), RAMChatCrud()
+        sessions = RAMSessionCrud(ttl=SESSION_EXPIRATION_TIME, max_sessions=population.sessions * 2)
+    else:
+        raise ValueError(f"Can't seed {settings.storage!r} storage")
+
+    for i in range(population.users):
+        users.create_user(UserIn(username=f"user{i}", hashed_password=hashed_password))
+    for i in range(population.sessions):
+        sessions.add_session(token(i), i % population.users + 1)
+    for _ in range(population.chats):
+        chats.create_chat(rng.sample(range(1, population.users + 1), 2))
+
+    if settings.storage == "sqlite":
+        pool.close()
+
+
+def plan(requests: int, population: Population) -> list[tuple[str, int]]:
+    """The operations of a run with their argument, the same for every transport and storage"""
+
+    rng = random.Random(population.seed)
+    operations = rng.choices(list(MIX), weights=list(MIX.values()), k=requests)
+    return [(operation, rng.randrange(population.sessions)) for operation in operations]
+
+
+async def request(client: httpx.AsyncClient, operation: str, argument: int, population: Population) -> bool:
+    cookie = {"Cookie": f"Authorization=Basic {token(argument)}"}
+
+    if operation == "register":
+        username = f"load-{time.monotonic_ns()}-{argument}"
+        response = await client.post("/users/", json={"username": username, "password": PASSWORD})
+        return response.status_code == 201
+    if operation == "login":
+        username = f"user{argument % population.users}"
+        response = await client.post("/users/login", json={"username": username, "password": PASSWORD})
+        return response.status_code == 200
+    if operation == "me":
+        response = await client.get("/users/me", headers=cookie)
+        return response.status_code == 200
+    if operation == "start":
+        response = await client.post("/chats/start", headers=cookie)
+        return response.status_code == 201
+    if operation == "user_chats":
+        response = await client.get(f"/chats/user/{argument % population.users + 1}")
+        return response.status_code == 200
+    raise ValueError(operation)
+
+
+async def drive(
+        client: httpx.AsyncClient, operations: list[tuple[str, int]], concurrency: int, population: Population,
+) -> tuple[float, int, dict[str, list[float]]]:
+    latencies: dict[str, list[float]] = {operation: [] for operation in MIX}
+    errors = 0
+
+    for operation, argument in operations[:min(200, len(operations))]:
+        if operation in ("me", "user_chats"):
+            await request(client, operation, argument, population)
+
+    async def worker(worker_id: int) -> None:
+        nonlocal errors
+        for operation, argument in operations[worker_id::concurrency]:
+            start = time.perf_counter()
+            ok = await request(client, operation, argument, population)
+            latencies[operation].append((time.perf_counter() - start) * 1000)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+    return time.perf_counter() - start, errors, latencies
+
+
+def summary(latencies: dict[str, list[float]]) -> dict[str, dict[str, float]]:
+    result = {}
+    everything = [latency for samples in latencies.values() for latency in samples]
+
+    for name, samples in (*latencies.items(), ("all", everything)):
+        if len(samples) >= 2:
+            result[name] = {"count": len(samples), **percentiles(samples)}
+
+    return result
+
+
+def rss_mb(pid: int | None = None) -> float | None:
+    """Current resident memory of a process from /proc, or peak resident memory of this one elsewhere"""
+
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+def run_asgi(settings: Settings, population: Population, operations: list[tuple[str, int]], concurrency: int) -> Run:
+    seed(settings, population)
+    app = create_app(settings)
+    seeded = rss_mb()
+
+    async def main() -> tuple[float, int, dict[str, list[float]]]:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+                return await drive(client, operations, concurrency, population)
+
+    seconds, errors, latencies = asyncio.run(main())
+    return Run(
+        "asgi", settings.storage, len(operations), concurrency, seconds, len(operations) / seconds, errors,
+        seeded, rss_mb(), summary(latencies),
+    )
+
+
+def serve(settings: Settings, population: Population, port: int) -> None:
+    seed(settings, population)
+    app: FastAPI = create_app(settings)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def wait_for_port(port: int, process: multiprocessing.process.BaseProcess, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                raise RuntimeError("uvicorn didn't start")
+            time.sleep(0.1)
+
+
+def run_uvicorn(
+        settings: Settings, population: Population, operations: list[tuple[str, int]], concurrency: int,
+) -> Run:
+    port = free_port()
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(settings, population, port))
+    process.start()
+
+    try:
+        wait_for_port(port, process, timeout=600)
+        seeded = rss_mb(process.pid)
+
+        async def main() -> tuple[float, int, dict[str, list[float]]]:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+                return await drive(client, operations, concurrency, population)
+
+        seconds, errors, latencies = asyncio.run(main())
+        after = rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.join()
+
+    return Run(
+        "uvicorn", settings.storage, len(operations), concurrency, seconds, len(operations) / seconds, errors,
+        seeded, after, summary(latencies),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", choices=("ram", "sqlite"), default="ram")
+    parser.add_argument("--transport", choices=("asgi", "uvicorn", "both"), default="both")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--chats", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-metrics", action="store_true", help="create the app with metrics turned off")
+    parser.add_argument("--output", type=Path, help=f"results file, by default a new one in {RESULTS_DIRECTORY}")
+    args = parser.parse_args()
+
+    population = Population(args.users, min(args.sessions, args.users), args.chats, args.seed)
+    operations = plan(args.requests, population)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for transport in ("asgi", "uvicorn") if args.transport == "both" else (args.transport,):
+            settings = Settings(
+                storage=args.storage,
+                sqlite_path=str(Path(directory) / f"{transport}.sqlite3"),
+                metrics=not args.no_metrics,
+            )
+            runner = run_asgi if transport == "asgi" else run_uvicorn
+            runs.append(runner(settings, population, operations, args.concurrency))
+
+    rows = []
+    for run in runs:
+        for name, stats in run.latency_ms.items():
+            rows.append((
+                run.transport, name, stats["count"], stats["p50"], stats["p95"], stats["p99"],
+                run.requests_per_second if name == "all" else "", run.rss_mb_after if name == "all" else "",
+            ))
+    print_table(("transport", "operation", "requests", "p50, ms", "p95, ms", "p99, ms", "requests/s", "rss, MB"), rows)
+
+    results: dict[str, Any] = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "arguments": {name: str(value) if isinstance(value, Path) else value for name, value in vars(args).items()},
+        "mix": MIX,
+        "runs": [asdict(run) for run in runs],
+    }
+
+    output = args.output or RESULTS_DIRECTORY / f"load-{args.storage}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Cost of RAMUserCrud.get_random_user against the size of the exclusion set.
+
+    python -m benchmarks.matchmaking
+"""
+
+from dating.users.crud import USERS_DB, RAMUserCrud
+from dating.users.schema import UserIn
+
+from .utils import ns_per_call, print_table
+
+
+USERS = 200_000
+EXCLUDED = (0, 100, 10_000, 100_000, 190_000)
+
+
+def main() -> None:
+    crud = RAMUserCrud()
+    USERS_DB.clear()
+    for i in range(USERS):
+        crud.create_user(UserIn(username=f"user{i}", hashed_password="hash"))
+
+    rows = []
+    for excluded in EXCLUDED:
+        except_ = set(range(1, excluded + 1))
+        rows.append((excluded, ns_per_call(lambda: crud.get_random_user(except_), number=20_000)))
+
+    print_table(("excluded users", "get_random_user, ns"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Resident bytes per user and per chat in the RAM storages, against storing the API dataclasses directly.
+
+    python -m benchmarks.memory
+"""
+
+import gc
+import tracemalloc
+from typing import Callable
+
+from dating.chats.crud import CHATS_DB, RAMChatCrud
+from dating.chats.schema import Chat
+from dating.users.crud import USERS_DB, RAMUserCrud
+from dating.users.schema import User, UserIn
+
+from .utils import print_table
+
+
+COUNT = 200_000
+HASH = "$argon2id$v=19$m=65536,t=3,p=4$c2FsdHNhbHRzYWx0$aGFzaGhhc2hoYXNoaGFzaGhhc2hoYXNoaGFzaGg"
+
+
+def allocated(fill: Callable[[], object]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    kept = fill()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / COUNT
+
+
+def dataclass_users() -> object:
+    by_id: dict[int, User] = {}
+    by_username: dict[str, User] = {}
+    ids: list[int] = []
+    for i in range(1, COUNT + 1):
+        user = User(id=i, username=f"user{i}", hashed_password=HASH[:-6] + f"{i:06}")
+        by_id[i] = by_username[user.username] = user
+        ids.append(i)
+    return by_id, by_username, ids
+
+
+def record_users() -> object:
+    USERS_DB.clear()
+    crud = RAMUserCrud()
+    for i in range(1, COUNT + 1):
+        crud.create_user(UserIn(username=f"user{i}", hashed_password=HASH[:-6] + f"{i:06}"))
+    return USERS_DB
+
+
+def dataclass_chats() -> object:
+    by_id: dict[int, Chat] = {}
+    for i in range(1, COUNT + 1):
+        by_id[i] = Chat(id=i, users_ids=[i + 1000, i + 2000])
+    return by_id
+
+
+def record_chats() -> object:
+    CHATS_DB.clear()
+    crud = RAMChatCrud()
+    for i in range(1, COUNT + 1):
+        crud.create_chat((i + 1000, i + 2000))
+    # The per-user indexes are the same for both layouts
+    CHATS_DB.by_user.clear()
+    CHATS_DB.partners.clear()
+    return CHATS_DB
+
+
+def main() -> None:
+    print_table(
+        ("entity", "dataclasses, bytes", "records, bytes"),
+        [
+            ("user", allocated(dataclass_users), allocated(record_users)),
+            ("chat", allocated(dataclass_chats), allocated(record_chats)),
+        ],
+    )
+    USERS_DB.clear()
+    CHATS_DB.clear()
+
+
+if __name__ == "__main__":
+    main()
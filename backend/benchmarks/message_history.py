@@ -0,0 +1,43 @@
+"""
+Cost of reading a page of chat history against the chat length.
+
+    python -m benchmarks.message_history [max messages]
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+from dating.chats.segments import MessageLog
+
+from .utils import ns_per_call, print_table
+
+
+SIZES = (100, 100_000, 1_000_000, 10_000_000)
+SEGMENT_SIZE = 1024
+
+
+def main() -> None:
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rows = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (size for size in SIZES if size <= max_size):
+            for mode, log_directory in (("memory", None), ("mapped", Path(directory))):
+                log = MessageLog(chat_id=size, segment_size=SEGMENT_SIZE, directory=log_directory)
+                for _ in range(size):
+                    log.append(author_id=1, text="hello there", created_at=0)
+
+                rows.append((
+                    size,
+                    mode,
+                    ns_per_call(lambda: log.read(limit=50), number=2_000) / 1000,
+                    ns_per_call(lambda: log.read(before=size // 2, limit=50), number=2_000) / 1000,
+                ))
+                log.delete()
+
+    print_table(("messages", "segments", "latest 50, us", "50 before middle, us"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Throughput cost of the metrics middleware and timers: the async_stack workload with metrics off and on.
+
+    python -m benchmarks.metrics_overhead
+"""
+
+import asyncio
+
+from passlib.hash import argon2
+
+from dating.chats.crud import RAMChatCrud
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.crud import RAMUserCrud
+from dating.users.schema import UserIn
+
+from .async_stack import USERS, drive
+from .utils import print_table
+
+
+ROUNDS = 3
+
+
+def main() -> None:
+    users, chats = RAMUserCrud(), RAMChatCrud()
+    hashed_password = argon2.hash("password")
+    for i in range(USERS):
+        users.create_user(UserIn(username=f"user{i}", hashed_password=hashed_password))
+    for i in range(1, USERS):
+        chats.create_chat([i, i + 1])
+
+    rows = []
+    for metrics in (False, True):
+        runs = [asyncio.run(drive(create_app(Settings(metrics=metrics)))) for _ in range(ROUNDS)]
+        rps, latency = max(runs, key=lambda run: run[0])
+        rows.append(("on" if metrics else "off", rps, latency["p50"], latency["p99"]))
+
+    print_table(("metrics", "requests/s", "p50, ms", "p99, ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Response encoding cost: FastAPI's path (asdict, validation against response_model, json.dumps)
+against the precompiled schema encoders.
+
+    python -m benchmarks.serialization
+"""
+
+import json
+from dataclasses import asdict
+
+from pydantic import TypeAdapter
+
+from dating.chats.schema import Chat, ChatOut
+from dating.serialization import encoder_for
+from dating.users.schema import User, UserOut
+
+from .utils import ns_per_call, print_table
+
+
+def main() -> None:
+    user = User(id=42, username="someone", hashed_password="$argon2id$v=19$m=65536,t=3,p=4$hash")
+    chats = [Chat(id=i, users_ids=[i, i + 1]) for i in range(50)]
+
+    user_adapter = TypeAdapter(UserOut)
+    chats_adapter = TypeAdapter(list[ChatOut])
+    encode_user = encoder_for(UserOut)
+    encode_chat = encoder_for(ChatOut)
+
+    def fastapi_user() -> bytes:
+        return json.dumps(user_adapter.dump_python(user_adapter.validate_python(asdict(user)))).encode()
+
+    def fastapi_chats() -> bytes:
+        return json.dumps(chats_adapter.dump_python(chats_adapter.validate_python([asdict(c) for c in chats]))).encode()
+
+    rows = [
+        ("UserOut", ns_per_call(fastapi_user), ns_per_call(lambda: encode_user(user).encode())),
+        (
+            "list[ChatOut] x50",
+            ns_per_call(fastapi_chats),
+            ns_per_call(lambda: ("[" + ",".join(encode_chat(c) for c in chats) + "]").encode()),
+        ),
+    ]
+
+    print_table(("payload", "asdict + pydantic, ns", "encoder, ns"), rows)
+
+
+if __name__ == "__main__":
+    main()
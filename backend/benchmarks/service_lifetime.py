@@ -0,0 +1,80 @@
+"""
+Per-request dependency overhead: app-scoped service singletons and async providers, against building
+crud, implementation and service through generator factories on every request, with the app-wide
+objects behind sync lambdas that FastAPI runs in the threadpool.
+
+    python -m benchmarks.service_lifetime
+"""
+
+import asyncio
+from functools import partial
+from typing import Annotated, Any, AsyncGenerator, Callable
+
+from fastapi import Depends, FastAPI
+from passlib.hash import argon2
+from passlib.ifc import PasswordHash
+
+from dating.chats.crud import RAMChatCrud, RAMMessageCrud
+from dating.chats.hub import ChatHub
+from dating.chats.service import ChatService, RAMChatServiceFactory
+from dating.dependencies import Stub
+from dating.main.api import create_app
+from dating.main.config import Settings, MESSAGES_SEGMENT_SIZE
+from dating.users.crud import RAMUserCrud
+from dating.users.schema import UserIn
+from dating.users.security import SessionProvider, AuthCache
+from dating.users.service import UserService, RAMUserServiceFactory
+
+from .async_stack import USERS, drive
+from .utils import print_table
+
+
+ROUNDS = 3
+
+
+def sync_provider(value: Any) -> Callable[[], Any]:
+    return lambda: value
+
+
+def per_request(app: FastAPI) -> FastAPI:
+    user_service_factory = RAMUserServiceFactory(RAMUserCrud)
+    chat_service_factory = RAMChatServiceFactory(RAMChatCrud, partial(RAMMessageCrud, MESSAGES_SEGMENT_SIZE))
+
+    async def create_chat_service(
+            user_service: Annotated[UserService, Depends(Stub(UserService))],
+    ) -> AsyncGenerator[ChatService, None]:
+        async for chat_service in chat_service_factory.create_chat_service(user_service):
+            yield chat_service
+
+    app.dependency_overrides[UserService] = user_service_factory.create_user_service
+    app.dependency_overrides[ChatService] = create_chat_service
+
+    for dependency in (ChatHub, SessionProvider, AuthCache, PasswordHash):
+        value = asyncio.run(app.dependency_overrides[dependency]())
+        app.dependency_overrides[dependency] = sync_provider(value)
+
+    return app
+
+
+def main() -> None:
+    users, chats = RAMUserCrud(), RAMChatCrud()
+    hashed_password = argon2.hash("password")
+    for i in range(USERS):
+        users.create_user(UserIn(username=f"user{i}", hashed_password=hashed_password))
+    for i in range(1, USERS):
+        chats.create_chat([i, i + 1])
+
+    rows = []
+    for name, make_app in (
+            ("per request", lambda: per_request(create_app(Settings(metrics=False)))),
+            ("app scoped", lambda: create_app(Settings(metrics=False))),
+    ):
+        runs = [asyncio.run(drive(make_app())) for _ in range(ROUNDS)]
+        rps, latency = max(runs, key=lambda run: run[0])
+        rows.append((name, rps, latency["p50"], latency["p99"]))
+
+    print_table(("services", "requests/s", "p50, ms", "p99, ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Cost of validating a session token, stored ones looked up in each storage against signed ones verified in process,
+and memory of the signed tokens denylist.
+
+    python -m benchmarks.session_tokens
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from dating.database import SQLiteConnectionPool
+from dating.main.config import Settings
+from dating.main.state_server import connect, start_state_server
+from dating.users.crud import SESSIONS_DB, RAMSessionCrud, SQLiteSessionCrud
+from dating.users.security import SessionProvider, SignedSessionProvider, StoredSessionProvider, TokenDenylist
+
+from .utils import print_table
+
+
+SESSIONS = 100_000
+REVOKED = 100_000
+NUMBER = 5_000
+TTL = 3600
+
+
+async def validate(provider: SessionProvider, tokens: list[str]) -> float:
+    start = time.perf_counter_ns()
+    for token in tokens:
+        await provider.validate_token(token)
+    return (time.perf_counter_ns() - start) / len(tokens)
+
+
+def measure(provider: SessionProvider) -> float:
+    async def run() -> float:
+        tokens = [await provider.create_token(user_id) for user_id in range(1, SESSIONS + 1)]
+        return await validate(provider, random.choices(tokens, k=NUMBER))
+
+    return asyncio.run(run())
+
+
+def signed_provider(revoked: int) -> SignedSessionProvider:
+    denylist = TokenDenylist()
+    expires_at = time.time() + TTL
+    for _ in range(revoked):
+        denylist.revoke(random.getrandbits(63), expires_at)
+    return SignedSessionProvider(b"benchmark secret", TTL, denylist)
+
+
+def denylist_bytes_per_token() -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    provider = signed_provider(REVOKED)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del provider
+    return size / REVOKED
+
+
+def main() -> None:
+    rows = [("stored", "ram", measure(StoredSessionProvider(RAMSessionCrud(TTL, SESSIONS))))]
+    SESSIONS_DB.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pool = SQLiteConnectionPool(os.path.join(directory, "dating.sqlite3"), size=8)
+        pool.create_tables()
+        rows.append(("stored", "sqlite", measure(StoredSessionProvider(SQLiteSessionCrud(pool, TTL), offload=True))))
+        pool.close()
+
+        settings = Settings(
+            storage="shared", state_server_address=os.path.join(directory, "state.sock"), state_server_authkey="key",
+        )
+        server = start_state_server(settings)
+        try:
+            sessions = connect(settings).sessions
+            rows.append(("stored", "shared", measure(StoredSessionProvider(sessions, offload=True))))
+        finally:
+            server.terminate()
+
+    rows.append(("signed", "-", measure(signed_provider(0))))
+    rows.append(("signed", f"{REVOKED} revoked", measure(signed_provider(REVOKED))))
+
+    print_table(("tokens", "store", "validate, ns"), rows)
+    print(f"\ndenylist: {denylist_bytes_per_token():.0f} bytes per revoked token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Snapshot and restore of the RAM stores with millions of users, chats and messages: the pause forking the snapshot
+takes, the longest stall of an event loop ticking while it runs, its duration and size, and restore time.
+
+    python -m benchmarks.snapshots --users 2000000 --chats 2000000 --messages 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from dating.chats.crud import CHATS_DB, MESSAGES_DB, ChatRecord
+from dating.chats.segments import MessageLog
+from dating.main.config import MESSAGES_SEGMENT_SIZE
+from dating.snapshots import Snapshotter, load_snapshot, snapshot_stores
+from dating.users.crud import USERS_DB, SESSIONS_DB, Session, UserRecord
+
+from .load import rss_mb
+from .utils import print_table
+
+
+TOPICS = [f"topic{i}" for i in range(1000)]
+MESSAGES_PER_CHAT = 100
+
+
+def new_log(chat_id: int) -> MessageLog:
+    return MessageLog(chat_id, MESSAGES_SEGMENT_SIZE)
+
+
+def seed(users: int, chats: int, sessions: int, messages: int) -> None:
+    rng = random.Random(0)
+    USERS_DB.load(
+        [
+            UserRecord(user_id, f"user{user_id}", f"$argon2id$v=19$m=65536,t=3,p=4$hash{user_id}",
+                       tuple(rng.sample(TOPICS, 3)) if user_id % 2 else ())
+            for user_id in range(1, users + 1)
+        ],
+        users + 1,
+    )
+    CHATS_DB.load(
+        [ChatRecord(chat_id, (rng.randint(1, users), rng.randint(1, users))) for chat_id in range(1, chats + 1)],
+        chats + 1,
+    )
+    SESSIONS_DB.clear()
+    now = time.monotonic()
+    SESSIONS_DB.update((f"token-{i}", Session(rng.randint(1, users), now + 3600)) for i in range(sessions))
+    MESSAGES_DB.clear()
+    for i in range(messages):
+        chat_id = i // MESSAGES_PER_CHAT + 1
+        log = MESSAGES_DB.get(chat_id) or MESSAGES_DB.setdefault(chat_id, new_log(chat_id))
+        log.append(rng.randint(1, users), f"message {i} of the benchmark", now)
+
+
+async def snapshot_while_ticking(snapshotter: Snapshotter) -> tuple[float, float]:
+    """Longest gap between ticks of a 1 ms loop while the snapshot runs, and how long it ran"""
+
+    longest = 0.0
+    done = False
+
+    async def tick() -> None:
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await snapshotter.run()
+    elapsed = time.perf_counter() - start
+    done = True
+    await ticker
+    return longest, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2_000_000)
+    parser.add_argument("--chats", type=int, default=2_000_000)
+    parser.add_argument("--sessions", type=int, default=200_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.users, args.chats, args.sessions, args.messages)
+    seeded = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "dating.snapshot"
+        snapshotter = Snapshotter(path, snapshot_stores, poll_interval=0.01)
+        stall, duration = asyncio.run(snapshot_while_ticking(snapshotter))
+        size = path.stat().st_size / 2 ** 20
+
+        USERS_DB.clear()
+        CHATS_DB.clear()
+        SESSIONS_DB.clear()
+        MESSAGES_DB.clear()
+        start = time.perf_counter()
+        stats = load_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, new_log)
+        restore = time.perf_counter() - start
+
+    print_table(
+        ("users", "chats", "sessions", "messages", "seed, s", "fork pause, ms", "loop stall, ms", "snapshot, s",
+         "size, MB", "restore, s", "rss, MB"),
+        [(stats.users, stats.chats, stats.sessions, stats.messages, seeded, snapshotter.last_pause * 1000,
+          stall * 1000, duration, size, restore, rss_mb())],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Per-operation cost of the RAM and SQLite backends on the same populations.
+
+    python -m benchmarks.storage_backends
+"""
+
+import random
+import tempfile
+from itertools import count
+from pathlib import Path
+
+from dating.chats.crud import CHATS_DB, RAMChatCrud, SQLiteChatCrud
+from dating.database import SQLiteConnectionPool
+from dating.users.crud import USERS_DB, SESSIONS_DB, RAMUserCrud, RAMSessionCrud, SQLiteUserCrud, SQLiteSessionCrud
+from dating.users.schema import UserIn
+
+from .utils import ns_per_call, print_table
+
+
+USERS = 100_000
+CHATS = 100_000
+SESSIONS = 100_000
+NUMBER = 5_000
+
+
+def measure(
+        name: str,
+        users: RAMUserCrud | SQLiteUserCrud,
+        chats: RAMChatCrud | SQLiteChatCrud,
+        sessions: RAMSessionCrud | SQLiteSessionCrud,
+) -> list[tuple[str, str, float]]:
+    for i in range(USERS):
+        users.create_user(UserIn(username=f"user{i}", hashed_password="hash"))
+    for _ in range(CHATS):
+        chats.create_chat(random.sample(range(1, USERS + 1), 2))
+    for i in range(SESSIONS):
+        sessions.add_session(f"token{i}", i + 1)
+
+    new_users = count(USERS)
+    return [
+        (name, "get_user_by_id", ns_per_call(lambda: users.get_user_by_id(random.randint(1, USERS)), NUMBER)),
+        (name, "get_user_by_username", ns_per_call(lambda: users.get_user_by_username("user500"), NUMBER)),
+        (name, "create_user", ns_per_call(
+            lambda: users.create_user(UserIn(username=f"user{next(new_users)}", hashed_password="hash")), NUMBER
+        )),
+        (name, "get_user_chats", ns_per_call(lambda: chats.get_user_chats(random.randint(1, USERS)), NUMBER)),
+        (name, "session get_user_id", ns_per_call(lambda: sessions.get_user_id("token500"), NUMBER)),
+    ]
+
+
+def main() -> None:
+    rows = measure(
+        "ram",
+        RAMUserCrud(),
+        RAMChatCrud(),
+        RAMSessionCrud(ttl=3600, max_sessions=SESSIONS),
+    )
+    USERS_DB.clear()
+    CHATS_DB.clear()
+    SESSIONS_DB.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pool = SQLiteConnectionPool(str(Path(directory) / "dating.sqlite3"), size=1)
+        pool.create_tables()
+        rows += measure("sqlite", SQLiteUserCrud(pool), SQLiteChatCrud(pool), SQLiteSessionCrud(pool, ttl=3600))
+        pool.close()
+
+    print_table(("backend", "operation", "us"), [(name, op, ns / 1000) for name, op, ns in rows])
+
+
+if __name__ == "__main__":
+    main()
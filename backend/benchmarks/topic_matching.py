@@ -0,0 +1,76 @@
+"""
+TopicIndex with 1M users over thousands of topics: build time, memory, query latency,
+and how close the sampled best match comes to the exact one.
+
+    python -m benchmarks.topic_matching
+"""
+
+import random
+import time
+import tracemalloc
+from collections import Counter
+from itertools import accumulate
+
+from dating.users.topics import TopicIndex
+
+from .utils import ns_per_call, print_table
+
+
+USERS = 1_000_000
+TOPICS = 5_000
+TOPICS_PER_USER = (3, 8)
+QUERIES = 200
+EXACT_QUERIES = 20
+
+
+def random_topics(rng: random.Random, cum_weights: list[float]) -> tuple[str, ...]:
+    count = rng.randint(*TOPICS_PER_USER)
+    return tuple(dict.fromkeys(f"topic{i}" for i in rng.choices(range(TOPICS), cum_weights=cum_weights, k=count)))
+
+
+def exact_best_score(users_topics: list[tuple[str, ...]], topics: tuple[str, ...]) -> int:
+    wanted = set(topics)
+    scores: Counter[int] = Counter()
+    for user_id, user_topics in enumerate(users_topics):
+        if user_id and wanted.intersection(user_topics):
+            scores[user_id] = len(wanted.intersection(user_topics))
+    return max(scores.values(), default=0)
+
+
+def main() -> None:
+    rng = random.Random(0)
+    # Topic popularity follows Zipf's law, like tags usually do
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(TOPICS)))
+    users_topics = [random_topics(rng, cum_weights) for _ in range(USERS)]
+
+    tracemalloc.start()
+    index = TopicIndex(rng=random.Random(1))
+    start = time.perf_counter()
+    for user_id, topics in enumerate(users_topics):
+        index.update(user_id, topics)
+    build_seconds = time.perf_counter() - start
+    index_mb = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+
+    queries = [users_topics[rng.randrange(USERS)] for _ in range(QUERIES)]
+    query_iter = iter(queries * 50)
+    query_ns = ns_per_call(lambda: index.best_match(next(query_iter), except_={0}), number=QUERIES * 50)
+
+    found, exact = 0, 0
+    for topics in queries[:EXACT_QUERIES]:
+        match = index.best_match(topics, except_={0})
+        found += len(set(topics).intersection(index.topics(match))) if match is not None else 0
+        exact += exact_best_score(users_topics, topics)
+
+    new_topics = iter([random_topics(rng, cum_weights) for _ in range(10_000)])
+    changed = iter(range(USERS))
+    update_ns = ns_per_call(lambda: index.update(next(changed), next(new_topics)), number=10_000)
+
+    print_table(
+        ("users", "topics", "build, s", "index, MB", "best_match, us", "update, us", "overlap found / best"),
+        [(USERS, TOPICS, build_seconds, index_mb, query_ns / 1000, update_ns / 1000, f"{found} / {exact}")],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Lookup latency of RAMUserCrud against the number of stored users.
+
+    python -m benchmarks.users_lookup
+"""
+
+import random
+
+from dating.users.crud import USERS_DB, RAMUserCrud
+from dating.users.schema import UserIn
+
+from .utils import ns_per_call, print_table
+
+
+SIZES = (1_000, 10_000, 100_000, 300_000)
+
+
+def main() -> None:
+    crud = RAMUserCrud()
+    rows = []
+
+    for size in SIZES:
+        USERS_DB.clear()
+        for i in range(size):
+            crud.create_user(UserIn(username=f"user{i}", hashed_password="hash"))
+
+        user_id = random.randint(1, size)
+        username = f"user{random.randrange(size)}"
+        rows.append((
+            size,
+            ns_per_call(lambda: crud.get_user_by_id(user_id)),
+            ns_per_call(lambda: crud.get_user_by_username(username)),
+            ns_per_call(lambda: crud.get_user_by_id(size + 1)),
+        ))
+
+    print_table(("users", "by id, ns", "by username, ns", "missing id, ns"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import time
+from statistics import quantiles
+from typing import Callable, Iterable, Sequence
+
+
+def ns_per_call(func: Callable[[], object], number: int = 100_000) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(number):
+        func()
+    return (time.perf_counter_ns() - start) / number
+
+
+def percentiles(samples: Sequence[float]) -> dict[str, float]:
+    cuts = quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def print_table(header: Sequence[str], rows: Iterable[Sequence[object]]) -> None:
+    rows = [[f"{cell:.1f}" if isinstance(cell, float) else str(cell) for cell in row] for row in rows]
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in (header, *rows):
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,40 @@
+"""
+Multi-process deployment: `gunicorn` from the backend directory.
+
+Unless DATING_STORAGE says otherwise, workers use the shared storage, served by a state server
+process started here before the workers are forked. It also relays chat messages, so a message
+posted to any worker reaches the WebSocket subscribers of all of them.
+"""
+
+import os
+import secrets
+
+from dating.main.config import Settings
+from dating.main.state_server import start_state_server
+
+
+wsgi_app = "dating.main.api:app"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+# Client addresses are taken from the X-Forwarded-For header of requests from these proxies only, so the per IP
+# rate limits see clients and not the proxy. nginx has to set it: proxy_set_header X-Forwarded-For
+# $proxy_add_x_forwarded_for. List the proxy's address here when it doesn't run on the same host
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+state_server = None
+
+
+def on_starting(server):
+    global state_server
+
+    os.environ.setdefault("DATING_STORAGE", "shared")
+    os.environ.setdefault("DATING_STATE_SERVER_AUTHKEY", secrets.token_hex(32))
+
+    settings = Settings.from_env()
+    if settings.storage == "shared":
+        state_server = start_state_server(settings)
+
+
+def on_exit(server):
+    if state_server is not None:
+        state_server.terminate()
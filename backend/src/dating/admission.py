@@ -0,0 +1,205 @@
+"""
+Admission control of the expensive routes, the ones hashing a password on every request.
+
+Requests to them are shed with 429 before anything else runs when their client IP or the username in their
+body is out of tokens, or when too many of them are already in flight. Other routes only pay a dict lookup.
+"""
+
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Collection
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+MAX_INSPECTED_BODY = 4096
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float) -> None:
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class TokenBuckets:
+    """
+    A token bucket per key, refilled with rate tokens a second up to burst.
+
+    Buckets are kept in an OrderedDict from the least recently used, so a check is O(1), the least recently
+    used bucket is evicted when there are max_size of them, and sweeping drops the ones idle long enough
+    to be full again, which is the same as not having them. Only used from the event loop.
+    """
+
+    def __init__(
+            self,
+            rate: float,
+            burst: int,
+            max_size: int,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.clock = clock
+        self.rejected = 0
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str) -> float:
+        """Takes a token of key, returns 0 if there was one, otherwise seconds until there is"""
+
+        now = self.clock()
+        bucket = self._buckets.get(key)
+
+        if bucket is None:
+            if len(self._buckets) >= self.max_size:
+                self._buckets.popitem(last=False)
+            self._buckets[key] = _Bucket(self.burst - 1, now)
+            return 0.0
+
+        tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+        bucket.updated_at = now
+        self._buckets.move_to_end(key)
+
+        if tokens >= 1:
+            bucket.tokens = tokens - 1
+            return 0.0
+
+        bucket.tokens = tokens
+        self.rejected += 1
+        return (1 - tokens) / self.rate
+
+    def sweep(self, limit: int) -> int:
+        full_before = self.clock() - self.burst / self.rate
+        swept = 0
+
+        while swept < limit and self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.updated_at > full_before:
+                break
+
+            del self._buckets[key]
+            swept += 1
+
+        return swept
+
+
+class ConcurrencyLimit:
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self) -> bool:
+        if self.in_flight >= self.max_concurrency:
+            self.rejected += 1
+            return False
+
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+
+class AdmissionMiddleware:
+    """
+    Limits POST requests to paths by client IP, by the username of their JSON body and by how many of them
+    are in flight at once. The body is read ahead only for them, and at most MAX_INSPECTED_BODY of it,
+    a body without a username, or too big to have just one, is only limited by IP.
+
+    The IP is the client of the scope, which uvicorn takes from X-Forwarded-For for requests from the proxies
+    in its forwarded_allow_ips, see gunicorn.conf.py. Behind a proxy it doesn't trust, all clients share the
+    proxy's bucket.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            paths: Collection[str],
+            by_ip: TokenBuckets,
+            by_username: TokenBuckets,
+            concurrency: ConcurrencyLimit,
+    ) -> None:
+        self.app = app
+        self.paths = frozenset(paths)
+        self.by_ip = by_ip
+        self.by_username = by_username
+        self.concurrency = concurrency
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        retry_after = self.by_ip.acquire(client[0] if client else "")
+        if retry_after:
+            await self._reject(retry_after, scope, receive, send)
+            return
+
+        messages = await self._read_ahead(receive)
+        username = self._username(messages)
+        if username is not None:
+            retry_after = self.by_username.acquire(username)
+            if retry_after:
+                await self._reject(retry_after, scope, receive, send)
+                return
+
+        if not self.concurrency.acquire():
+            await self._reject(1, scope, receive, send)
+            return
+
+        async def replay() -> Message:
+            return messages.pop(0) if messages else await receive()
+
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            self.concurrency.release()
+
+    @staticmethod
+    async def _read_ahead(receive: Receive) -> list[Message]:
+        messages = []
+        size = 0
+
+        while size <= MAX_INSPECTED_BODY:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        return messages
+
+    @staticmethod
+    def _username(messages: list[Message]) -> str | None:
+        if messages[-1]["type"] != "http.request" or messages[-1].get("more_body", False):
+            return None
+
+        try:
+            data = json.loads(b"".join(message.get("body", b"") for message in messages))
+        except ValueError:
+            return None
+
+        username = data.get("username") if isinstance(data, dict) else None
+        return username if isinstance(username, str) else None
+
+    @staticmethod
+    async def _reject(retry_after: float, scope: Scope, receive: Receive, send: Send) -> None:
+        response = JSONResponse(
+            {"detail": "Too many requests"},
+            status_code=429,
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+        await response(scope, receive, send)
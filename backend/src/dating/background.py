@@ -0,0 +1,62 @@
+import asyncio
+import inspect
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from fastapi import FastAPI
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTasks:
+    def __init__(self) -> None:
+        self._tasks: list[tuple[float, Callable[[], object]]] = []
+        self._startup: list[Callable[[], object]] = []
+        self._shutdown: list[Callable[[], object]] = []
+
+    def every(self, interval: float, func: Callable[[], object]) -> None:
+        self._tasks.append((interval, func))
+
+    def at_startup(self, func: Callable[[], object]) -> None:
+        """Runs func once before the app serves requests and the periodic tasks start"""
+
+        self._startup.append(func)
+
+    def at_shutdown(self, func: Callable[[], object]) -> None:
+        """Runs func once the periodic tasks are stopped"""
+
+        self._shutdown.append(func)
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI) -> AsyncIterator[None]:
+        for func in self._startup:
+            await self._call(func)
+
+        running = [asyncio.create_task(self._run(interval, func)) for interval, func in self._tasks]
+
+        try:
+            yield
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+            for func in self._shutdown:
+                await self._call(func)
+
+    @staticmethod
+    async def _run(interval: float, func: Callable[[], object]) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await PeriodicTasks._call(func)
+
+    @staticmethod
+    async def _call(func: Callable[[], object]) -> None:
+        try:
+            result = func()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Task %r failed", func)
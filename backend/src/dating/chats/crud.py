@@ -1,49 +1,604 @@
-from typing import Iterable
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from pathlib import Path
+from typing import Container, Iterable, Iterator
 
-from .schema import Chat
+from .schema import Chat, Message
+from .segments import MessageLog
+from ..database import SQLiteConnectionPool, MAX_INTEGER
+from ..locks import StripedLock
 
 
-CHATS_DB: list[Chat] = []
+logger = logging.getLogger(__name__)
 
 
-class RAMChatCrud:
+class ChatRecord:
+    __slots__ = ("id", "users_ids")
+
+    def __init__(self, id: int, users_ids: Iterable[int]) -> None:
+        self.id = id
+        self.users_ids = array("q", users_ids)
+
+    def to_schema(self) -> Chat:
+        return Chat(id=self.id, users_ids=self.users_ids.tolist())
+
+
+class ChatStorage:
+    """
+    Safe to use from many threads.
+
+    Membership of a chat changes under its stripe of chat_locks and the indexes of a user under
+    its stripe of user_locks. A user lock is only ever taken inside a chat lock, never the other way.
+
+    by_user keeps each user's chat ids sorted, so a page of them is a binary search and a slice, and
+    partners counts the chats each user shares with everyone else, so nobody has to list them to find out.
+    Chats that lost members or were created with fewer than two are queued in shrunk, for reclaim to find
+    the abandoned ones without a scan.
+    """
+
+    def __init__(self) -> None:
+        self.by_id: dict[int, ChatRecord] = {}
+        self.by_user: dict[int, array[int]] = {}
+        self.partners: dict[int, dict[int, int]] = {}
+        self.shrunk: OrderedDict[int, None] = OrderedDict()
+        self.chat_locks = StripedLock()
+        self.user_locks = StripedLock()
+        self._ids_counter = itertools.count(1)
+        self._shrunk_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[ChatRecord]:
+        return iter(list(self.by_id.values()))
+
+    def next_id(self) -> int:
+        return next(self._ids_counter)
+
+    def add(self, chat: ChatRecord) -> None:
+        with self.chat_locks(chat.id):
+            self.by_id[chat.id] = chat
+            members = dict.fromkeys(chat.users_ids)
+            for user_id in members:
+                with self.user_locks(user_id):
+                    chats_ids = self.by_user.get(user_id)
+                    if chats_ids is None:
+                        chats_ids = self.by_user[user_id] = array("q")
+
+                    # Ids are handed out in order, so this is an append unless another thread got ahead
+                    if not chats_ids or chats_ids[-1] < chat.id:
+                        chats_ids.append(chat.id)
+                    else:
+                        insort(chats_ids, chat.id)
+
+                    self._count_partners(user_id, members, 1)
+
+            # Chats start with their creator and somebody else, so the ones with fewer are abandoned already
+            if len(members) < 2:
+                with self._shrunk_lock:
+                    self.shrunk[chat.id] = None
+
+    def remove(self, chat_id: int) -> ChatRecord | None:
+        with self.chat_locks(chat_id):
+            return self._remove(chat_id)
+
+    def reclaim(self, min_members: int, limit: int) -> tuple[int, list[int]]:
+        """
+        Removes the chats left with fewer than min_members members among up to limit of the shrunk ones,
+        returning how many of those were checked and the ids of the removed ones. Chats that still have
+        enough members just leave the queue
+        """
+
+        with self._shrunk_lock:
+            chats_ids = [self.shrunk.popitem(last=False)[0] for _ in range(min(limit, len(self.shrunk)))]
+
+        reclaimed = []
+        for chat_id in chats_ids:
+            with self.chat_locks(chat_id):
+                chat = self.by_id.get(chat_id)
+                if chat is not None and len(set(chat.users_ids)) < min_members:
+                    self._remove(chat_id)
+                    reclaimed.append(chat_id)
+
+        return len(chats_ids), reclaimed
+
+    def remove_member(self, chat_id: int, user_id: int) -> Chat | None:
+        with self.chat_locks(chat_id):
+            chat = self.by_id.get(chat_id)
+            if chat is None or user_id not in chat.users_ids:
+                return None
+
+            chat.users_ids.remove(user_id)
+            if user_id not in chat.users_ids:
+                members = set(chat.users_ids)
+                with self.user_locks(user_id):
+                    self._unindex(chat_id, user_id)
+                    self._count_partners(user_id, members, -1)
+                for member_id in members:
+                    with self.user_locks(member_id):
+                        self._count_partners(member_id, (user_id,), -1)
+
+            with self._shrunk_lock:
+                self.shrunk[chat_id] = None
+            return chat.to_schema()
+
+    def user_chats(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[ChatRecord]:
+        """User's chats in the order of their ids, the ones after that id and no more than limit of them"""
+
+        with self.user_locks(user_id):
+            chats_ids = self.by_user.get(user_id)
+            if chats_ids is None:
+                return []
+
+            start = bisect_right(chats_ids, after) if after is not None else 0
+            page = chats_ids[start:start + limit] if limit is not None else chats_ids[start:]
+
+        chats = (self.by_id.get(chat_id) for chat_id in page)
+        return [chat for chat in chats if chat is not None]
+
+    def chat_partners(self, user_id: int) -> set[int]:
+        with self.user_locks(user_id):
+            return set(self.partners.get(user_id, ()))
+
+    def load(self, records: list[ChatRecord], next_id: int) -> None:
+        """Replaces all chats with records in bulk, handing out ids from next_id on. Not safe with concurrent use"""
+
+        self.clear()
+        by_user: dict[int, list[int]] = {}
+        partners = self.partners
+
+        for chat in records:
+            self.by_id[chat.id] = chat
+            members = dict.fromkeys(chat.users_ids)
+            # Chats start with their creator and somebody else, so the ones with fewer members lost some
+            if len(members) < 2:
+                self.shrunk[chat.id] = None
+            for user_id in members:
+                chats_ids = by_user.get(user_id)
+                if chats_ids is None:
+                    chats_ids = by_user[user_id] = []
+                chats_ids.append(chat.id)
+
+                user_partners = partners.get(user_id)
+                if user_partners is None:
+                    user_partners = partners[user_id] = {}
+                for partner_id in members:
+                    if partner_id != user_id:
+                        user_partners[partner_id] = user_partners.get(partner_id, 0) + 1
+
+        for user_id, chats_ids in by_user.items():
+            chats_ids.sort()
+            self.by_user[user_id] = array("q", chats_ids)
+
+        for user_id in [user_id for user_id, user_partners in partners.items() if not user_partners]:
+            del partners[user_id]
+
+        self._ids_counter = itertools.count(next_id)
+
+    def clear(self) -> None:
+        self.by_id.clear()
+        self.by_user.clear()
+        self.partners.clear()
+        self.shrunk.clear()
+        self._ids_counter = itertools.count(1)
+
+    def _remove(self, chat_id: int) -> ChatRecord | None:
+        chat = self.by_id.pop(chat_id, None)
+        if chat is not None:
+            members = set(chat.users_ids)
+            for user_id in members:
+                with self.user_locks(user_id):
+                    self._unindex(chat_id, user_id)
+                    self._count_partners(user_id, members, -1)
+        return chat
+
+    def _unindex(self, chat_id: int, user_id: int) -> None:
+        chats_ids = self.by_user[user_id]
+        del chats_ids[bisect_left(chats_ids, chat_id)]
+        if not chats_ids:
+            del self.by_user[user_id]
+
+    def _count_partners(self, user_id: int, members: Iterable[int], delta: int) -> None:
+        user_partners = self.partners.setdefault(user_id, {})
+
+        for member_id in members:
+            if member_id != user_id:
+                count = user_partners.get(member_id, 0) + delta
+                if count:
+                    user_partners[member_id] = count
+                else:
+                    del user_partners[member_id]
+
+        if not user_partners:
+            del self.partners[user_id]
+
+
+class ChatCrud(ABC):
+    @abstractmethod
     def get_by_id(self, chat_id: int) -> Chat | None:
-        for chat in CHATS_DB:
-            if chat.id == chat_id:
-                return chat
+        raise NotImplementedError
 
-        return None
+    @abstractmethod
+    def get_user_chats(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[Chat]:
+        raise NotImplementedError
 
-    def get_user_chats(self, user_id: int) -> list[Chat]:
-        chats: list[Chat] = []
-        for chat in CHATS_DB:
-            if user_id in chat.users_ids:
-                chats.append(chat)
-        return chats
+    @abstractmethod
+    def get_chat_partners(self, user_id: int) -> set[int]:
+        raise NotImplementedError
 
+    @abstractmethod
     def create_chat(self, users_ids: Iterable[int]) -> Chat:
-        chat_id = max(CHATS_DB, key=lambda x: x.id).id + 1 if CHATS_DB else 1
-        chat = Chat(id=chat_id, users_ids=list(users_ids))
-        CHATS_DB.append(chat)
-        return chat
+        raise NotImplementedError
 
+    @abstractmethod
+    def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        raise NotImplementedError
+
+    @abstractmethod
     def delete_chat(self, chat_id: int) -> Chat | None:
-        chat = self.get_by_id(chat_id)
+        raise NotImplementedError
 
-        if not chat:
-            return None
+    @abstractmethod
+    def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, list[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_chats(self) -> int:
+        raise NotImplementedError
+
+
+CHATS_DB = ChatStorage()
+
+
+class RAMChatCrud(ChatCrud):
+    def get_by_id(self, chat_id: int) -> Chat | None:
+        record = CHATS_DB.by_id.get(chat_id)
+        return record.to_schema() if record else None
+
+    def get_user_chats(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[Chat]:
+        return [record.to_schema() for record in CHATS_DB.user_chats(user_id, after, limit)]
+
+    def get_chat_partners(self, user_id: int) -> set[int]:
+        return CHATS_DB.chat_partners(user_id)
+
+    def create_chat(self, users_ids: Iterable[int]) -> Chat:
+        record = ChatRecord(CHATS_DB.next_id(), users_ids)
+        CHATS_DB.add(record)
+        return record.to_schema()
+
+    def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        return [self.create_chat(users_ids) for users_ids in chats_users_ids]
+
+    def delete_chat(self, chat_id: int) -> Chat | None:
+        record = CHATS_DB.remove(chat_id)
+        return record.to_schema() if record else None
+
+    def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        records = (CHATS_DB.remove(chat_id) for chat_id in dict.fromkeys(chats_ids))
+        return [record.to_schema() for record in records if record]
+
+    def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
+        return CHATS_DB.remove_member(chat_id, user_id)
+
+    def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, list[int]]:
+        return CHATS_DB.reclaim(min_members, limit)
+
+    def count_chats(self) -> int:
+        return len(CHATS_DB)
+
+
+class SQLiteChatCrud(ChatCrud):
+    def __init__(self, pool: SQLiteConnectionPool) -> None:
+        self.pool = pool
+
+    def get_by_id(self, chat_id: int) -> Chat | None:
+        with self.pool.connection() as connection:
+            return self._get_by_id(connection, chat_id)
+
+    def get_user_chats(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[Chat]:
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                "SELECT chat_id, user_id FROM chat_members WHERE chat_id IN ("
+                "SELECT chat_id FROM chat_members WHERE user_id = ? AND chat_id > ? ORDER BY chat_id LIMIT ?"
+                ") ORDER BY chat_id, position",
+                (user_id, after if after is not None else 0, limit if limit is not None else -1),
+            ).fetchall()
+
+        return self._chats(rows)
+
+    def get_chat_partners(self, user_id: int) -> set[int]:
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                "SELECT DISTINCT partners.user_id FROM chat_members AS own "
+                "JOIN chat_members AS partners ON partners.chat_id = own.chat_id "
+                "WHERE own.user_id = ? AND partners.user_id != own.user_id",
+                (user_id,),
+            ).fetchall()
+
+        return {row[0] for row in rows}
+
+    def create_chat(self, users_ids: Iterable[int]) -> Chat:
+        users_ids = list(users_ids)
+
+        with self.pool.connection() as connection, connection:
+            chat_id = connection.execute("INSERT INTO chats DEFAULT VALUES").lastrowid
+            assert chat_id is not None
+            connection.executemany(
+                "INSERT INTO chat_members (chat_id, position, user_id) VALUES (?, ?, ?)",
+                [(chat_id, position, user_id) for position, user_id in enumerate(users_ids)],
+            )
+            if len(set(users_ids)) < 2:
+                connection.execute("INSERT INTO shrunk_chats (chat_id) VALUES (?)", (chat_id,))
+
+        return Chat(id=chat_id, users_ids=users_ids)
+
+    def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        """
+        Chats created in one transaction with a statement per table. AUTOINCREMENT hands out consecutive ids
+        while the transaction holds the write lock, so they are known from the last one.
+        """
+
+        members = [list(users_ids) for users_ids in chats_users_ids]
+
+        if not members:
+            return []
+
+        with self.pool.connection() as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT INTO chats DEFAULT VALUES", [()] * len(members))
+            last_id = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'chats'").fetchone()[0]
+
+            chats = [
+                Chat(id=chat_id, users_ids=users_ids)
+                for chat_id, users_ids in enumerate(members, start=last_id - len(members) + 1)
+            ]
+            connection.executemany(
+                "INSERT INTO chat_members (chat_id, position, user_id) VALUES (?, ?, ?)",
+                [
+                    (chat.id, position, user_id)
+                    for chat in chats
+                    for position, user_id in enumerate(chat.users_ids)
+                ],
+            )
+            connection.executemany(
+                "INSERT INTO shrunk_chats (chat_id) VALUES (?)",
+                [(chat.id,) for chat in chats if len(set(chat.users_ids)) < 2],
+            )
+
+        return chats
+
+    def delete_chat(self, chat_id: int) -> Chat | None:
+        with self.pool.connection() as connection, connection:
+            chat = self._get_by_id(connection, chat_id)
+
+            if chat:
+                connection.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
 
-        CHATS_DB.remove(chat)
         return chat
 
+    def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        chats_ids = list(dict.fromkeys(chats_ids))
+        encoded_ids = json.dumps(chats_ids)
+
+        with self.pool.connection() as connection, connection:
+            rows = connection.execute(
+                "SELECT chats.id, chat_members.user_id FROM chats "
+                "LEFT JOIN chat_members ON chat_members.chat_id = chats.id "
+                "WHERE chats.id IN (SELECT value FROM json_each(?)) "
+                "ORDER BY chats.id, chat_members.position",
+                (encoded_ids,),
+            ).fetchall()
+            connection.execute("DELETE FROM chats WHERE id IN (SELECT value FROM json_each(?))", (encoded_ids,))
+
+        chats = {chat.id: chat for chat in self._chats(rows)}
+        return [chats[chat_id] for chat_id in chats_ids if chat_id in chats]
+
     def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
-        chat = self.get_by_id(chat_id)
+        with self.pool.connection() as connection, connection:
+            cursor = connection.execute(
+                "DELETE FROM chat_members WHERE chat_id = ? AND position = "
+                "(SELECT min(position) FROM chat_members WHERE chat_id = ? AND user_id = ?)",
+                (chat_id, chat_id, user_id),
+            )
 
-        if not chat:
-            return None
+            if not cursor.rowcount:
+                return None
+
+            connection.execute("INSERT OR IGNORE INTO shrunk_chats (chat_id) VALUES (?)", (chat_id,))
+            return self._get_by_id(connection, chat_id)
+
+    def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, list[int]]:
+        """
+        Deletes the chats left with fewer than min_members members among up to limit of the shrunk ones,
+        returning how many of those were checked and the ids of the deleted ones. Chats that lost members
+        are queued in shrunk_chats by delete_chat_for_user and the ones created with fewer than two on
+        creation, so no call scans the chats, and the ones that still have enough members just leave the queue
+        """
+
+        with self.pool.connection() as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT shrunk.chat_id, count(DISTINCT chat_members.user_id) "
+                "FROM (SELECT chat_id FROM shrunk_chats ORDER BY chat_id LIMIT ?) AS shrunk "
+                "LEFT JOIN chat_members ON chat_members.chat_id = shrunk.chat_id "
+                "GROUP BY shrunk.chat_id",
+                (limit,),
+            ).fetchall()
+
+            reclaimed = [chat_id for chat_id, members in rows if members < min_members]
+            connection.execute(
+                "DELETE FROM shrunk_chats WHERE chat_id IN (SELECT value FROM json_each(?))",
+                (json.dumps([chat_id for chat_id, _ in rows]),),
+            )
+            if reclaimed:
+                connection.execute(
+                    "DELETE FROM chats WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(reclaimed),)
+                )
+
+        return len(rows), reclaimed
+
+    def count_chats(self) -> int:
+        """Reads the count the triggers on chats keep, rather than counting the table"""
+
+        with self.pool.connection() as connection:
+            count: int = connection.execute("SELECT count FROM chats_count").fetchone()[0]
+        return count
 
-        if user_id not in chat.users_ids:
+    @staticmethod
+    def _chats(rows: Iterable[tuple[int, int | None]]) -> list[Chat]:
+        """Chats from (chat id, member id) rows ordered by chat and position, a None member id for no members"""
+
+        chats: dict[int, Chat] = {}
+        for chat_id, member_id in rows:
+            chat = chats.get(chat_id)
+            if chat is None:
+                chat = chats[chat_id] = Chat(id=chat_id, users_ids=[])
+            if member_id is not None:
+                chat.users_ids.append(member_id)
+
+        return list(chats.values())
+
+    @staticmethod
+    def _get_by_id(connection: sqlite3.Connection, chat_id: int) -> Chat | None:
+        if not connection.execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone():
             return None
 
-        chat.users_ids.remove(user_id)
-        return chat
+        rows = connection.execute(
+            "SELECT user_id FROM chat_members WHERE chat_id = ? ORDER BY position", (chat_id,)
+        ).fetchall()
+        return Chat(id=chat_id, users_ids=[row[0] for row in rows])
+
+
+class MessageCrud(ABC):
+    @abstractmethod
+    def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_chats_messages(self, chats_ids: Iterable[int]) -> None:
+        raise NotImplementedError
+
+
+MESSAGES_DB: dict[int, MessageLog] = {}
+
+
+class RAMMessageCrud(MessageCrud):
+    def __init__(self, segment_size: int, directory: Path | None = None) -> None:
+        self.segment_size = segment_size
+        self.directory = directory
+
+    def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        log = MESSAGES_DB.get(chat_id)
+
+        if log is None:
+            log = MESSAGES_DB.setdefault(chat_id, MessageLog(chat_id, self.segment_size, self.directory))
+
+        return log.append(author_id, text, time.time())
+
+    def recover(self, chats_ids: Container[int]) -> int:
+        """
+        Reopens the logs left in the directory for chats_ids, returning how many. Directories of other chats
+        would be taken over by new chats reusing their ids, so they are moved aside instead.
+        """
+
+        if self.directory is None or not self.directory.is_dir():
+            return 0
+
+        recovered = 0
+        for path in self.directory.iterdir():
+            if not path.name.isdecimal() or not path.is_dir():
+                continue
+
+            chat_id = int(path.name)
+            if chat_id not in chats_ids:
+                stale = path.with_name(f"{path.name}.stale-{time.time_ns()}")
+                path.rename(stale)
+                logger.warning("Moved messages of unknown chat %s to %s", chat_id, stale)
+            elif chat_id not in MESSAGES_DB:
+                MESSAGES_DB[chat_id] = MessageLog(chat_id, self.segment_size, self.directory)
+                recovered += 1
+
+        return recovered
+
+    def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        log = MESSAGES_DB.get(chat_id)
+
+        if log is None:
+            return []
+
+        return log.read(before=before, after=after, limit=limit)
+
+    def delete_chats_messages(self, chats_ids: Iterable[int]) -> None:
+        for chat_id in chats_ids:
+            log = MESSAGES_DB.pop(chat_id, None)
+
+            if log is not None:
+                log.delete()
+
+
+class SQLiteMessageCrud(MessageCrud):
+    def __init__(self, pool: SQLiteConnectionPool) -> None:
+        self.pool = pool
+
+    def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        created_at = time.time()
+
+        with self.pool.connection() as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            message_id = connection.execute(
+                "SELECT coalesce(max(id), 0) + 1 FROM messages WHERE chat_id = ?", (chat_id,)
+            ).fetchone()[0]
+            connection.execute(
+                "INSERT INTO messages (chat_id, id, author_id, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, message_id, author_id, text, created_at),
+            )
+
+        return Message(id=message_id, chat_id=chat_id, author_id=author_id, text=text, created_at=created_at)
+
+    def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        with self.pool.connection() as connection:
+            if after is not None:
+                rows = connection.execute(
+                    "SELECT id, author_id, text, created_at FROM messages "
+                    "WHERE chat_id = ? AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                    (chat_id, after, before if before is not None else MAX_INTEGER, limit),
+                ).fetchall()
+            else:
+                rows = connection.execute(
+                    "SELECT id, author_id, text, created_at FROM messages "
+                    "WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (chat_id, before if before is not None else MAX_INTEGER, limit),
+                ).fetchall()
+                rows.reverse()
+
+        return [
+            Message(id=message_id, chat_id=chat_id, author_id=author_id, text=text, created_at=created_at)
+            for message_id, author_id, text, created_at in rows
+        ]
+
+    def delete_chats_messages(self, chats_ids: Iterable[int]) -> None:
+        encoded_ids = json.dumps(list(chats_ids))
+        with self.pool.connection() as connection, connection:
+            connection.execute(
+                "DELETE FROM messages WHERE chat_id IN (SELECT value FROM json_each(?))", (encoded_ids,)
+            )
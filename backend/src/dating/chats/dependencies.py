@@ -0,0 +1,26 @@
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Path, status
+
+from .schema import Chat
+from .service import ChatService
+from ..dependencies import Stub
+from ..users.dependencies import get_current_user
+from ..users.schema import User
+
+
+async def get_member_chat(
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        current_user: Annotated[User, Depends(get_current_user)],
+        chat_id: Annotated[int, Path()],
+) -> Chat:
+
+    chat = await chat_service.get_by_id(chat_id)
+
+    if not chat:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if current_user.id not in chat.users_ids:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+    return chat
@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import logging
+import queue
+import secrets
+import threading
+import time
+from collections import defaultdict, deque
+from typing import NamedTuple
+
+from .schema import Message, MessageOut
+from ..serialization import encoder_for
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, chat_id: int, user_id: int, max_queue: int) -> None:
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue[str | None] = asyncio.Queue(max_queue)
+        self.dropped = False
+        self.left = False
+
+    def drop(self) -> None:
+        self.dropped = True
+        self._close()
+
+    def leave(self) -> None:
+        self.left = True
+        self._close()
+
+    def _close(self) -> None:
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Departure(NamedTuple):
+    """A user leaving a chat, relayed so their subscriptions in other workers close too"""
+
+    chat_id: int
+    user_id: int
+
+
+class ChatHub:
+    """
+    In-process pub/sub for chat messages.
+
+    Each subscription owns a bounded queue. A subscriber whose queue is full when a message is published
+    is dropped, so one slow connection never holds up the others.
+    """
+
+    def __init__(self, max_queue: int) -> None:
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._subscriptions: defaultdict[int, set[Subscription]] = defaultdict(set)
+
+    def subscribe(self, chat_id: int, user_id: int) -> Subscription:
+        subscription = Subscription(chat_id, user_id, self.max_queue)
+        self._subscriptions[chat_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.chat_id)
+
+        if subscriptions is None:
+            return
+
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.chat_id]
+
+    def leave(self, chat_id: int, user_id: int) -> None:
+        """Closes the user's subscriptions to the chat they left"""
+
+        leaving = [
+            subscription for subscription in self._subscriptions.get(chat_id, ())
+            if subscription.user_id == user_id
+        ]
+
+        for subscription in leaving:
+            self.unsubscribe(subscription)
+            subscription.leave()
+
+    def subscribers_count(self, chat_id: int) -> int:
+        return len(self._subscriptions.get(chat_id, ()))
+
+    def publish(self, message: Message) -> None:
+        encoded = encoder_for(MessageOut)(message)
+
+        slow: list[Subscription] = []
+        for subscription in self._subscriptions.get(message.chat_id, ()):
+            try:
+                subscription.queue.put_nowait(encoded)
+            except asyncio.QueueFull:
+                slow.append(subscription)
+
+        for subscription in slow:
+            self.unsubscribe(subscription)
+            subscription.drop()
+            self.dropped += 1
+
+
+class MessageFeed:
+    """
+    Messages published by every worker and the users leaving chats, numbered in publish order, for each worker
+    to hand to its own subscribers.
+
+    Only the last size messages are kept, so a worker more than size messages behind misses the oldest ones.
+    Lives in the state server, whose connection threads call it concurrently.
+    """
+
+    def __init__(self, size: int) -> None:
+        self._messages: deque[tuple[str, Message | Departure]] = deque(maxlen=size)
+        self._sequence = 0
+        self._published = threading.Condition()
+
+    def sequence(self) -> int:
+        with self._published:
+            return self._sequence
+
+    def publish(self, origin: str, message: Message | Departure) -> None:
+        with self._published:
+            self._messages.append((origin, message))
+            self._sequence += 1
+            self._published.notify_all()
+
+    def read(self, after: int, timeout: float) -> tuple[int, list[tuple[str, Message | Departure]]]:
+        """Number of the last message and the messages after the after-th one, waiting up to timeout for one"""
+
+        with self._published:
+            self._published.wait_for(lambda: self._sequence > after, timeout)
+            start = max(len(self._messages) - (self._sequence - after), 0)
+            return self._sequence, list(itertools.islice(self._messages, start, None))
+
+
+class RelayedChatHub(ChatHub):
+    """
+    ChatHub of one of several workers. A published message reaches the subscribers of this worker at once and
+    is relayed through the feed to the other workers, whose receiving thread publishes it to theirs.
+    """
+
+    def __init__(self, max_queue: int, feed: MessageFeed, timeout: float = 1) -> None:
+        super().__init__(max_queue)
+        self.feed = feed
+        self.timeout = timeout
+        self.origin = secrets.token_hex(8)
+        self._outbox: queue.SimpleQueue[Message | Departure | None] = queue.SimpleQueue()
+        self._running = threading.Event()
+
+    def publish(self, message: Message) -> None:
+        super().publish(message)
+        self._outbox.put(message)
+
+    def leave(self, chat_id: int, user_id: int) -> None:
+        super().leave(chat_id, user_id)
+        self._outbox.put(Departure(chat_id, user_id))
+
+    def start(self) -> None:
+        """Starts relaying, from the event loop the subscribers are read on"""
+
+        loop = asyncio.get_running_loop()
+        self._running.set()
+        threading.Thread(target=self._send, name="hub-sender", daemon=True).start()
+        threading.Thread(target=self._receive, args=(loop,), name="hub-receiver", daemon=True).start()
+
+    def stop(self) -> None:
+        self._running.clear()
+        self._outbox.put(None)
+
+    def _send(self) -> None:
+        while (message := self._outbox.get()) is not None:
+            try:
+                self.feed.publish(self.origin, message)
+            except (OSError, EOFError):
+                logger.exception("Couldn't relay %r", message)
+
+    def _receive(self, loop: asyncio.AbstractEventLoop) -> None:
+        after = None
+        while self._running.is_set():
+            try:
+                if after is None:
+                    after = self.feed.sequence()
+                after, messages = self.feed.read(after, self.timeout)
+            except (OSError, EOFError):
+                logger.exception("Couldn't read relayed messages")
+                time.sleep(self.timeout)
+                continue
+
+            remote = [message for origin, message in messages if origin != self.origin]
+            if remote and self._running.is_set():
+                try:
+                    loop.call_soon_threadsafe(self._deliver, remote)
+                except RuntimeError:
+                    return
+
+    def _deliver(self, messages: list[Message | Departure]) -> None:
+        for message in messages:
+            if isinstance(message, Departure):
+                super().leave(message.chat_id, message.user_id)
+            else:
+                super().publish(message)
@@ -0,0 +1,140 @@
+import asyncio
+from collections import OrderedDict
+from typing import Iterable, NamedTuple
+
+from .schema import Chat
+from .service import ChatService
+from ..users.schema import User
+from ..users.presence import PresenceTracker
+from ..users.exceptions import UserNotFound
+
+
+MAX_MATCH_WAIT = 30
+
+
+class MatchQueueFull(Exception):
+    pass
+
+
+class Waiter(NamedTuple):
+    topics: frozenset[str]
+    future: asyncio.Future[Chat | None]
+
+
+class MatchQueue:
+    """
+    Users waiting on /chats/start for someone to start a chat with them, oldest first.
+
+    Waiters are kept by user id in an OrderedDict, so joining, leaving and taking one are O(1). A match looks
+    at no more than window eligible waiters from the oldest, skipping at most 4 * window the user already
+    has chats with, and takes the one sharing most topics with the user, the oldest of them on a tie.
+    Only used from the event loop.
+    """
+
+    def __init__(self, max_size: int, window: int = 16) -> None:
+        self.max_size = max_size
+        self.window = window
+        self._waiters: OrderedDict[int, Waiter] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._waiters
+
+    def put(self, user_id: int, topics: Iterable[str]) -> asyncio.Future[Chat | None]:
+        """Future resolved with the chat somebody starts with the user, the one already waiting if any"""
+
+        waiter = self._waiters.get(user_id)
+        if waiter is not None:
+            return waiter.future
+
+        if len(self._waiters) >= self.max_size:
+            raise MatchQueueFull
+
+        future: asyncio.Future[Chat | None] = asyncio.get_running_loop().create_future()
+        self._waiters[user_id] = Waiter(frozenset(topics), future)
+        return future
+
+    def discard(self, user_id: int, future: asyncio.Future[Chat | None]) -> None:
+        """Removes the user if future is still theirs, resolving it with None"""
+
+        waiter = self._waiters.get(user_id)
+        if waiter is not None and waiter.future is future:
+            del self._waiters[user_id]
+            future.set_result(None)
+
+    def pop_match(self, topics: Iterable[str], except_: set[int]) -> tuple[int, Waiter] | None:
+        wanted = set(topics)
+        best_id, best_score = None, -1
+        seen = skipped = 0
+
+        for user_id, waiter in self._waiters.items():
+            if seen == self.window:
+                break
+            if user_id in except_:
+                skipped += 1
+                if skipped > self.window * 4:
+                    break
+                continue
+
+            seen += 1
+            score = len(wanted.intersection(waiter.topics))
+            if score > best_score:
+                best_id, best_score = user_id, score
+                if score == len(wanted):
+                    break
+
+        if best_id is None:
+            return None
+        return best_id, self._waiters.pop(best_id)
+
+    def clear(self) -> None:
+        for waiter in self._waiters.values():
+            waiter.future.set_result(None)
+        self._waiters.clear()
+
+
+class Matchmaker:
+    """
+    Finds who a user starts a chat with: somebody waiting in the queue first, then somebody online,
+    then anybody. With wait, the user joins the queue instead of being matched with someone who isn't
+    looking for a chat, and gets the chat whoever takes them from it starts, or None after wait seconds.
+
+    Without a queue wait is ignored, and without presence nobody is preferred for being online. Workers
+    sharing storage leave both out, as each would only see the users it happens to serve.
+    """
+
+    def __init__(self, queue: MatchQueue | None, presence: PresenceTracker | None) -> None:
+        self.queue = queue
+        self.presence = presence
+
+    async def start_chat(self, chat_service: ChatService, user: User, wait: float = 0) -> Chat | None:
+        except_users = await chat_service.get_chat_partners(user.id)
+
+        while self.queue is not None and (match := self.queue.pop_match(user.topics, except_users)):
+            waiter_id, waiter = match
+            try:
+                chat = await chat_service.create_chat((waiter_id, user.id))
+            except UserNotFound:
+                waiter.future.set_result(None)
+                except_users.add(waiter_id)
+                continue
+            except BaseException:
+                waiter.future.set_result(None)
+                raise
+
+            waiter.future.set_result(chat)
+            return chat
+
+        if not wait or self.queue is None:
+            return await chat_service.create_chat_with_matched_user(user, self.presence, except_users)
+
+        future = self.queue.put(user.id, user.topics)
+        try:
+            await asyncio.wait((future,), timeout=wait)
+        finally:
+            # Leaves the queue on timeout and on cancellation alike, unless somebody already took the user from it
+            self.queue.discard(user.id, future)
+
+        return await future
@@ -0,0 +1,30 @@
+import asyncio
+
+from .service import ChatService
+
+
+class ChatReclaimer:
+    """
+    Deletes abandoned chats, the ones left with fewer than min_members members, from a periodic task.
+
+    A run checks slices of at most batch queued chats, going on to the next one while they come back full, up to
+    max_slices of them, and lets the event loop run between two, so no number of dead chats holds requests up.
+    """
+
+    def __init__(self, chat_service: ChatService, min_members: int, batch: int, max_slices: int = 10) -> None:
+        self.chat_service = chat_service
+        self.min_members = min_members
+        self.batch = batch
+        self.max_slices = max_slices
+        self.live = 0
+        self.reclaimed = 0
+
+    async def run(self) -> None:
+        for _ in range(self.max_slices):
+            checked, reclaimed = await self.chat_service.reclaim_chats(self.min_members, self.batch)
+            self.reclaimed += reclaimed
+            if checked < self.batch:
+                break
+            await asyncio.sleep(0)
+
+        self.live = await self.chat_service.count_chats()
@@ -1,41 +1,75 @@
-from dataclasses import asdict
+import asyncio
+from operator import attrgetter
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, status, Body, Path, HTTPException
+from fastapi import (
+    APIRouter, Depends, status, Body, Path, Query, HTTPException, Response, WebSocket, WebSocketDisconnect,
+)
 
-from .schema import ChatOut
+from .schema import Chat, ChatOut, ChatWithUsersOut, MessageIn, MessageOut
 from .service import ChatService
-from ..dependencies import Stub, Dataclass
+from .hub import ChatHub, Subscription
+from .matchmaking import Matchmaker, MatchQueueFull, MAX_MATCH_WAIT
+from .dependencies import get_member_chat
+from ..dependencies import Stub
+from ..schema import MAX_BATCH_SIZE
+from ..pagination import DEFAULT_PAGE_SIZE, NEXT_CURSOR_HEADER, get_cursor_key, split_page
+from ..serialization import json_response, json_list_response
 from ..users.schema import User
 from ..users.dependencies import get_current_user
 from ..users.exceptions import UserNotFound
+from ..users.presence import PresenceTracker
 
 
 chats_router = APIRouter(tags=["chats"], prefix="/chats")
 
 
 @chats_router.get("/{chat_id}", response_model=ChatOut)
-def get_chat(
+async def get_chat(
         chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
         chat_id: Annotated[int, Path()],
-) -> Dataclass:
+) -> Response:
 
-    chat = chat_service.get_by_id(chat_id)
+    chat = await chat_service.get_by_id(chat_id)
 
     if not chat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    return asdict(chat)
+    return json_response(ChatOut, chat)
+
+
+@chats_router.get(
+    "/user/{user_id}",
+    response_model=list[ChatOut],
+    description=f"User's chats by id, limit at a time. The cursor of the next page is in {NEXT_CURSOR_HEADER}",
+)
+async def get_user_chats(
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        user_id: Annotated[int, Path()],
+        after: Annotated[int | None, Depends(get_cursor_key)],
+        limit: Annotated[int, Query(ge=1, le=MAX_BATCH_SIZE)] = DEFAULT_PAGE_SIZE,
+) -> Response:
+
+    chats = await chat_service.get_user_chats(user_id, after=after, limit=limit + 1)
+    page, next_cursor = split_page(chats, limit, key=attrgetter("id"))
+    return json_list_response(ChatOut, page, headers=_next_cursor_headers(next_cursor))
 
 
-@chats_router.get("/user/{user_id}", response_model=list[ChatOut])
-def get_user_chats(
+@chats_router.get(
+    "/user/{user_id}/with-users",
+    response_model=list[ChatWithUsersOut],
+    description=f"Paginated as /chats/user/{{user_id}}, with the cursor of the next page in {NEXT_CURSOR_HEADER}",
+)
+async def get_user_chats_with_users(
         chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
         user_id: Annotated[int, Path()],
-) -> list[Dataclass]:
+        after: Annotated[int | None, Depends(get_cursor_key)],
+        limit: Annotated[int, Query(ge=1, le=MAX_BATCH_SIZE)] = DEFAULT_PAGE_SIZE,
+) -> Response:
 
-    chats = chat_service.get_user_chats(user_id)
-    return [asdict(chat) for chat in chats]
+    chats = await chat_service.get_user_chats_with_users(user_id, after=after, limit=limit + 1)
+    page, next_cursor = split_page(chats, limit, key=attrgetter("id"))
+    return json_list_response(ChatWithUsersOut, page, headers=_next_cursor_headers(next_cursor))
 
 
 @chats_router.post(
@@ -46,32 +80,82 @@ def get_user_chats(
     description="This endpoint should not be public. Hide it in nginx config. This only for use "
                 "from another internal services"
 )
-def create_chat(
+async def create_chat(
         chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
         current_user: Annotated[User, Depends(get_current_user)],
         users_ids: Annotated[list[int], Body()],
-) -> Dataclass:
+) -> Response:
 
     try:
-        chat = chat_service.create_chat(users_ids=(current_user.id, *users_ids))
+        chat = await chat_service.create_chat(users_ids=(current_user.id, *users_ids))
     except UserNotFound as err:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(err))
 
-    return asdict(chat)
+    return json_response(ChatOut, chat, status_code=status.HTTP_201_CREATED)
+
+
+@chats_router.post(
+    "/batch",
+    response_model=list[ChatOut],
+    status_code=status.HTTP_201_CREATED,
+    tags=["Non-public"],
+    description="This endpoint should not be public. Hide it in nginx config. This only for use "
+                "from another internal services"
+)
+async def create_chats(
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        current_user: Annotated[User, Depends(get_current_user)],
+        chats_users_ids: Annotated[list[list[int]], Body(max_length=MAX_BATCH_SIZE)],
+) -> Response:
+
+    try:
+        chats = await chat_service.create_chats((current_user.id, *users_ids) for users_ids in chats_users_ids)
+    except UserNotFound as err:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(err))
+
+    return json_list_response(ChatOut, chats, status_code=status.HTTP_201_CREATED)
+
+
+@chats_router.post(
+    "/batch/delete",
+    response_model=list[ChatOut],
+    tags=["Non-public"],
+    description="This endpoint should not be public. Hide it in nginx config. This only for use "
+                "from another internal services"
+)
+async def delete_chats(
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        chats_ids: Annotated[list[int], Body(max_length=MAX_BATCH_SIZE)],
+) -> Response:
+
+    chats = await chat_service.delete_chats(chats_ids)
+    return json_list_response(ChatOut, chats)
 
 
 @chats_router.post(
     "/start",
     response_model=ChatOut | None,
     status_code=status.HTTP_201_CREATED,
+    description="With wait, waits up to that many seconds for another user looking for a chat, "
+                "and returns null if nobody comes. Deployments with several workers ignore it",
 )
-def create_chat_with_matched_user(
+async def create_chat_with_matched_user(
         chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        matchmaker: Annotated[Matchmaker, Depends(Stub(Matchmaker))],
         current_user: Annotated[User, Depends(get_current_user)],
-) -> Dataclass | None:
+        wait: Annotated[float, Query(ge=0, le=MAX_MATCH_WAIT)] = 0,
+) -> Response:
+
+    try:
+        chat = await matchmaker.start_chat(chat_service, current_user, wait)
+    except MatchQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many users waiting",
+            headers={"Retry-After": "1"},
+        )
 
-    chat = chat_service.create_chat_with_matched_user(current_user.id)
-    return asdict(chat) if chat else None
+    return json_response(ChatOut, chat, status_code=status.HTTP_201_CREATED)
 
 
 @chats_router.delete(
@@ -81,29 +165,114 @@ def create_chat_with_matched_user(
     description="This endpoint should not be public. Hide it in nginx config. This only for use "
                 "from another internal services"
 )
-def delete_chat(
+async def delete_chat(
         chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
         chat_id: Annotated[int, Path()],
-) -> Dataclass:
+) -> Response:
 
-    chat = chat_service.delete_chat(chat_id)
+    chat = await chat_service.delete_chat(chat_id)
 
     if not chat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    return asdict(chat)
+    return json_response(ChatOut, chat)
 
 
 @chats_router.delete("/my/{chat_id}", response_model=ChatOut)
-def delete_my_chat(
+async def delete_my_chat(
         chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        hub: Annotated[ChatHub, Depends(Stub(ChatHub))],
         chat_id: Annotated[int, Path()],
         current_user: Annotated[User, Depends(get_current_user)],
-) -> Dataclass:
+) -> Response:
 
-    chat = chat_service.delete_chat_for_user(chat_id, current_user.id)
+    chat = await chat_service.delete_chat_for_user(chat_id, current_user.id)
 
     if not chat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    return asdict(chat)
+    if current_user.id not in chat.users_ids:
+        hub.leave(chat_id, current_user.id)
+
+    return json_response(ChatOut, chat)
+
+
+@chats_router.get("/{chat_id}/messages", response_model=list[MessageOut])
+async def get_messages(
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        chat: Annotated[Chat, Depends(get_member_chat)],
+        before: Annotated[int | None, Query(ge=1)] = None,
+        after: Annotated[int | None, Query(ge=0)] = None,
+        limit: Annotated[int, Query(ge=1, le=100)] = 50,
+) -> Response:
+
+    messages = await chat_service.get_messages(chat.id, before=before, after=after, limit=limit)
+    return json_list_response(MessageOut, messages)
+
+
+@chats_router.post("/{chat_id}/messages", response_model=MessageOut, status_code=status.HTTP_201_CREATED)
+async def send_message(
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        hub: Annotated[ChatHub, Depends(Stub(ChatHub))],
+        chat: Annotated[Chat, Depends(get_member_chat)],
+        current_user: Annotated[User, Depends(get_current_user)],
+        message_in: MessageIn,
+) -> Response:
+
+    message = await chat_service.add_message(chat.id, current_user.id, message_in.text)
+    hub.publish(message)
+    return json_response(MessageOut, message, status_code=status.HTTP_201_CREATED)
+
+
+@chats_router.websocket("/{chat_id}/ws")
+async def chat_messages(
+        websocket: WebSocket,
+        chat_service: Annotated[ChatService, Depends(Stub(ChatService))],
+        hub: Annotated[ChatHub, Depends(Stub(ChatHub))],
+        presence: Annotated[PresenceTracker, Depends(Stub(PresenceTracker))],
+        chat: Annotated[Chat, Depends(get_member_chat)],
+        current_user: Annotated[User, Depends(get_current_user)],
+) -> None:
+
+    await websocket.accept()
+    presence.connect(current_user.id)
+    subscription = hub.subscribe(chat.id, current_user.id)
+    sender = asyncio.create_task(_send_messages(websocket, subscription))
+
+    try:
+        while True:
+            try:
+                # A binary frame has no "text" for receive_json, which raises KeyError
+                message_in = MessageIn(**await websocket.receive_json())
+            except (KeyError, TypeError, ValueError):
+                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+                break
+
+            # The user may have left the chat, or it may be gone, since they connected
+            current_chat = await chat_service.get_by_id(chat.id)
+            if current_chat is None or current_user.id not in current_chat.users_ids:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                break
+
+            hub.publish(await chat_service.add_message(chat.id, current_user.id, message_in.text))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        presence.disconnect(current_user.id)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+
+async def _send_messages(websocket: WebSocket, subscription: Subscription) -> None:
+    while (message := await subscription.queue.get()) is not None:
+        await websocket.send_text(message)
+
+    if subscription.left:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    else:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+
+def _next_cursor_headers(next_cursor: str | None) -> dict[str, str] | None:
+    return {NEXT_CURSOR_HEADER: next_cursor} if next_cursor is not None else None
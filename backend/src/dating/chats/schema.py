@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 
 from ..schema import BaseSchema
+from ..users.schema import User, UserOut
 
 
 @dataclass
@@ -16,3 +17,41 @@ class Chat(ChatBase):
 @dataclass
 class ChatOut(ChatBase):
     id: int
+
+
+@dataclass
+class ChatWithUsers(Chat):
+    users: list[User]
+
+
+@dataclass
+class ChatWithUsersOut(ChatOut):
+    users: list[UserOut]
+
+
+@dataclass
+class MessageBase(BaseSchema):
+    text: str
+
+
+@dataclass
+class MessageIn(MessageBase):
+    def __post_init__(self) -> None:
+        if not isinstance(self.text, str) or not self.text:
+            raise ValueError("No text")
+
+
+@dataclass
+class Message(MessageBase):
+    id: int
+    chat_id: int
+    author_id: int
+    created_at: float
+
+
+@dataclass
+class MessageOut(MessageBase):
+    id: int
+    chat_id: int
+    author_id: int
+    created_at: float
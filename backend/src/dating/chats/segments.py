@@ -0,0 +1,266 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+from .schema import Message
+
+
+logger = logging.getLogger(__name__)
+
+class SegmentError(Exception):
+    pass
+
+
+class MemorySegment:
+    def __init__(self, chat_id: int, first_id: int) -> None:
+        self.chat_id = chat_id
+        self.first_id = first_id
+        self.messages: list[Message] = []
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, message: Message) -> None:
+        self.messages.append(message)
+
+    def read(self, start: int, stop: int) -> list[Message]:
+        return self.messages[start:stop]
+
+
+RECORD_HEADER = struct.Struct("<qqdI")  # id, author_id, created_at, text length
+OFFSET = struct.Struct("<Q")
+
+
+class MappedSegment:
+    """
+    Sealed segment stored on disk and memory-mapped only while it's read.
+
+    File layout: the records (RECORD_HEADER followed by utf-8 text), then the offset of every record
+    and the records count, both as little-endian uint64.
+    """
+
+    def __init__(self, chat_id: int, first_id: int, path: Path, length: int) -> None:
+        self.chat_id = chat_id
+        self.first_id = first_id
+        self.path = path
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    @classmethod
+    def open(cls, chat_id: int, path: Path) -> "MappedSegment":
+        """Segment sealed earlier at path, named after its first id"""
+
+        with open(path, "rb") as file:
+            size = file.seek(0, 2)
+            if size < OFFSET.size:
+                raise SegmentError(f"Segment {path} is truncated")
+
+            file.seek(size - OFFSET.size)
+            length: int = OFFSET.unpack(file.read(OFFSET.size))[0]
+
+        if size < OFFSET.size * (length + 1):
+            raise SegmentError(f"Segment {path} is truncated")
+
+        return cls(chat_id, int(path.stem), path, length)
+
+    @classmethod
+    def write(cls, segment: MemorySegment, path: Path) -> "MappedSegment":
+        offsets: list[int] = []
+        chunks: list[bytes] = []
+        position = 0
+
+        for message in segment.messages:
+            text = message.text.encode()
+            offsets.append(position)
+            chunks.append(RECORD_HEADER.pack(message.id, message.author_id, message.created_at, len(text)))
+            chunks.append(text)
+            position += RECORD_HEADER.size + len(text)
+
+        chunks.append(struct.pack(f"<{len(offsets)}Q", *offsets))
+        chunks.append(OFFSET.pack(len(offsets)))
+
+        if path.exists():
+            raise FileExistsError(f"Segment {path} is sealed already")
+
+        # Written aside and renamed into place, so a crash never leaves a partial segment under its name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as file:
+            file.write(b"".join(chunks))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+        return cls(segment.chat_id, segment.first_id, path, len(segment))
+
+    def read(self, start: int, stop: int) -> list[Message]:
+        start, stop, _ = slice(start, stop).indices(self.length)
+        if start >= stop:
+            return []
+
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets_start = len(data) - OFFSET.size * (self.length + 1)
+            offsets = struct.unpack_from(f"<{stop - start}Q", data, offsets_start + OFFSET.size * start)
+
+            messages: list[Message] = []
+            for offset in offsets:
+                message_id, author_id, created_at, text_length = RECORD_HEADER.unpack_from(data, offset)
+                text_start = offset + RECORD_HEADER.size
+                messages.append(Message(
+                    id=message_id,
+                    chat_id=self.chat_id,
+                    author_id=author_id,
+                    text=data[text_start:text_start + text_length].decode(),
+                    created_at=created_at,
+                ))
+
+        return messages
+
+    def delete(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class MessageLog:
+    """
+    Append-only messages of one chat, split into fixed-size segments.
+
+    Message ids are sequential per chat, so the segment and position of any id are computed directly
+    and a page of history costs the same however long the chat is.
+
+    Appends are serialized by the log's own lock. Reads don't lock: last_id is only advanced
+    once its message is in a segment.
+
+    With a directory, a log picks up the segments already sealed there and numbers new messages after them.
+    """
+
+    def __init__(self, chat_id: int, segment_size: int, directory: Path | None = None) -> None:
+        self.chat_id = chat_id
+        self.segment_size = segment_size
+        self.directory = directory
+        self.segments: list[MemorySegment | MappedSegment] = []
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+        if directory is not None:
+            self._open_sealed(directory / str(chat_id))
+
+    def __len__(self) -> int:
+        return self.last_id
+
+    def append(self, author_id: int, text: str, created_at: float) -> Message:
+        with self._lock:
+            message = Message(
+                id=self.last_id + 1, chat_id=self.chat_id, author_id=author_id, text=text, created_at=created_at,
+            )
+            self._add(message)
+            return message
+
+    def in_memory(self) -> list[Message]:
+        """Messages not sealed on disk, all of them without a directory"""
+
+        last_id = self.last_id
+        return [
+            message
+            for segment in self.segments if isinstance(segment, MemorySegment)
+            for message in segment.messages if message.id <= last_id
+        ]
+
+    def restore(self, messages: Iterable[Message]) -> None:
+        """Adds messages an earlier process had in memory, but the ones sealed since. Not safe with concurrent use"""
+
+        for message in messages:
+            if message.id <= self.last_id:
+                continue
+            if message.id != self.last_id + 1:
+                raise SegmentError(f"Messages of chat {self.chat_id} after {self.last_id} are missing")
+            self._add(message)
+
+    def _add(self, message: Message) -> None:
+        tail = self.segments[-1] if self.segments else None
+        if not isinstance(tail, MemorySegment) or len(tail) == self.segment_size:
+            tail = MemorySegment(self.chat_id, message.id)
+            self.segments.append(tail)
+
+        tail.append(message)
+        self.last_id = message.id
+
+        if len(tail) == self.segment_size and self.directory is not None:
+            path = self.directory / str(self.chat_id) / f"{tail.first_id:012d}.seg"
+            self.segments[-1] = MappedSegment.write(tail, path)
+
+    def read(self, before: int | None = None, after: int | None = None, limit: int = 50) -> list[Message]:
+        """Up to limit messages in id order: the first ones after `after`, or else the last ones before `before`"""
+
+        last_id = self.last_id
+        upper = min(before - 1 if before is not None else last_id, last_id)
+        lower = max(after + 1 if after is not None else 1, 1)
+
+        if after is not None:
+            upper = min(upper, lower + limit - 1)
+        else:
+            lower = max(lower, upper - limit + 1)
+
+        messages: list[Message] = []
+        message_id = lower
+        while message_id <= upper:
+            segment = self.segments[(message_id - 1) // self.segment_size]
+            start = message_id - segment.first_id
+            stop = min(upper - segment.first_id + 1, len(segment))
+            messages.extend(segment.read(start, stop))
+            message_id = segment.first_id + stop
+
+        return messages
+
+    def _open_sealed(self, chat_directory: Path) -> None:
+        if not chat_directory.is_dir():
+            return
+
+        # Names are zero-padded first ids, so they sort in id order
+        paths = sorted(chat_directory.glob("*.seg"))
+        for position, path in enumerate(paths):
+            last = position == len(paths) - 1
+            try:
+                segment = MappedSegment.open(self.chat_id, path)
+            except SegmentError:
+                if not last:
+                    raise
+                self._set_aside(path)
+                return
+
+            if segment.first_id != self.last_id + 1:
+                raise SegmentError(f"Segment {path} doesn't continue the log of chat {self.chat_id}")
+            if len(segment) != self.segment_size:
+                if not last:
+                    raise SegmentError(f"Segment {path} doesn't hold {self.segment_size} messages")
+                self._set_aside(path)
+                return
+
+            self.segments.append(segment)
+            self.last_id += len(segment)
+
+    def _set_aside(self, path: Path) -> None:
+        """Moves away a broken last segment, left partial by a crash of a process writing segments in place"""
+
+        broken = path.with_name(f"{path.name}.broken-{time.time_ns()}")
+        path.rename(broken)
+        logger.warning("Moved broken last segment of chat %s to %s", self.chat_id, broken)
+
+    def delete(self) -> None:
+        with self._lock:
+            for segment in self.segments:
+                if isinstance(segment, MappedSegment):
+                    segment.delete()
+            self.segments.clear()
+
+        if self.directory is not None:
+            try:
+                (self.directory / str(self.chat_id)).rmdir()
+            except OSError:
+                pass
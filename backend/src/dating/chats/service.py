@@ -1,61 +1,273 @@
 from abc import ABC, abstractmethod
-from typing import Generator, Callable, Iterable
+from typing import AsyncGenerator, Callable, Iterable
 
-# from sqlalchemy import Engine
-# from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from .schema import Chat
-from .crud import RAMChatCrud
-from ..users.service import UserService, UserServiceFactory
+from .schema import Chat, ChatWithUsers, Message
+from .crud import ChatCrud, MessageCrud, RAMChatCrud, RAMMessageCrud
+from ..users.schema import User
+from ..users.service import UserService
+from ..users.presence import PresenceTracker
 from ..users.exceptions import UserNotFound
 
 
+# Online users picked at random before giving up on them, as presence may still hold deleted users
+ONLINE_MATCH_ATTEMPTS = 3
+
+
 class ChatServiceImp(ABC):
+    @abstractmethod
+    async def get_by_id(self, chat_id: int) -> Chat | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_chats(self, user_id: int, after: int | None, limit: int | None) -> list[Chat]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_chat_partners(self, user_id: int) -> set[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_chat(self, users_ids: Iterable[int]) -> Chat:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_chat(self, chat_id: int) -> Chat | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count_chats(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        raise NotImplementedError
+
+
+class SyncChatServiceImp(ABC):
     @abstractmethod
     def get_by_id(self, chat_id: int) -> Chat | None:
         raise NotImplementedError
 
     @abstractmethod
-    def get_user_chats(self, user_id: int) -> list[Chat]:
+    def get_user_chats(self, user_id: int, after: int | None, limit: int | None) -> list[Chat]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_chat_partners(self, user_id: int) -> set[int]:
         raise NotImplementedError
 
     @abstractmethod
     def create_chat(self, users_ids: Iterable[int]) -> Chat:
         raise NotImplementedError
 
+    @abstractmethod
+    def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        raise NotImplementedError
+
     @abstractmethod
     def delete_chat(self, chat_id: int) -> Chat | None:
         raise NotImplementedError
 
+    @abstractmethod
+    def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        raise NotImplementedError
+
     @abstractmethod
     def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
         raise NotImplementedError
 
+    @abstractmethod
+    def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_chats(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        raise NotImplementedError
+
+
+class OffloadedChatServiceImp(ChatServiceImp):
+    def __init__(self, implementation: SyncChatServiceImp) -> None:
+        self.imp = implementation
+
+    async def get_by_id(self, chat_id: int) -> Chat | None:
+        return await run_in_threadpool(self.imp.get_by_id, chat_id)
+
+    async def get_user_chats(self, user_id: int, after: int | None, limit: int | None) -> list[Chat]:
+        return await run_in_threadpool(self.imp.get_user_chats, user_id, after, limit)
+
+    async def get_chat_partners(self, user_id: int) -> set[int]:
+        return await run_in_threadpool(self.imp.get_chat_partners, user_id)
+
+    async def create_chat(self, users_ids: Iterable[int]) -> Chat:
+        return await run_in_threadpool(self.imp.create_chat, users_ids)
+
+    async def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        return await run_in_threadpool(self.imp.create_chats, [list(users_ids) for users_ids in chats_users_ids])
+
+    async def delete_chat(self, chat_id: int) -> Chat | None:
+        return await run_in_threadpool(self.imp.delete_chat, chat_id)
+
+    async def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        return await run_in_threadpool(self.imp.delete_chats, list(chats_ids))
+
+    async def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
+        return await run_in_threadpool(self.imp.delete_chat_for_user, chat_id, user_id)
+
+    async def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, int]:
+        return await run_in_threadpool(self.imp.reclaim_chats, min_members, limit)
+
+    async def count_chats(self) -> int:
+        return await run_in_threadpool(self.imp.count_chats)
+
+    async def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        return await run_in_threadpool(self.imp.add_message, chat_id, author_id, text)
+
+    async def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        return await run_in_threadpool(self.imp.get_messages, chat_id, before, after, limit)
+
 
 class RAMChatServiceImp(ChatServiceImp):
-    def __init__(self, crud: RAMChatCrud) -> None:
+    def __init__(self, crud: RAMChatCrud, message_crud: RAMMessageCrud) -> None:
+        self.db = crud
+        self.messages = message_crud
+
+    async def get_by_id(self, chat_id: int) -> Chat | None:
+        return self.db.get_by_id(chat_id)
+
+    async def get_user_chats(self, user_id: int, after: int | None, limit: int | None) -> list[Chat]:
+        return self.db.get_user_chats(user_id, after, limit)
+
+    async def get_chat_partners(self, user_id: int) -> set[int]:
+        return self.db.get_chat_partners(user_id)
+
+    async def create_chat(self, users_ids: Iterable[int]) -> Chat:
+        return self.db.create_chat(users_ids)
+
+    async def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        return self.db.create_chats(chats_users_ids)
+
+    async def delete_chat(self, chat_id: int) -> Chat | None:
+        chat = self.db.delete_chat(chat_id)
+
+        if chat:
+            self.messages.delete_chats_messages([chat_id])
+
+        return chat
+
+    async def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        chats = self.db.delete_chats(chats_ids)
+
+        if chats:
+            self.messages.delete_chats_messages([chat.id for chat in chats])
+
+        return chats
+
+    async def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
+        return self.db.delete_chat_for_user(chat_id, user_id)
+
+    async def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, int]:
+        checked, chats_ids = self.db.reclaim_chats(min_members, limit)
+
+        if chats_ids:
+            self.messages.delete_chats_messages(chats_ids)
+
+        return checked, len(chats_ids)
+
+    async def count_chats(self) -> int:
+        return self.db.count_chats()
+
+    async def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        return self.messages.add_message(chat_id, author_id, text)
+
+    async def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        return self.messages.get_messages(chat_id, before, after, limit)
+
+
+class CrudChatServiceImp(SyncChatServiceImp):
+    def __init__(self, crud: ChatCrud, message_crud: MessageCrud) -> None:
         self.db = crud
+        self.messages = message_crud
 
     def get_by_id(self, chat_id: int) -> Chat | None:
         return self.db.get_by_id(chat_id)
 
-    def get_user_chats(self, user_id: int) -> list[Chat]:
-        return self.db.get_user_chats(user_id)
+    def get_user_chats(self, user_id: int, after: int | None, limit: int | None) -> list[Chat]:
+        return self.db.get_user_chats(user_id, after, limit)
+
+    def get_chat_partners(self, user_id: int) -> set[int]:
+        return self.db.get_chat_partners(user_id)
 
     def create_chat(self, users_ids: Iterable[int]) -> Chat:
         return self.db.create_chat(users_ids)
 
+    def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        return self.db.create_chats(chats_users_ids)
+
     def delete_chat(self, chat_id: int) -> Chat | None:
-        return self.db.delete_chat(chat_id)
+        chat = self.db.delete_chat(chat_id)
+
+        if chat:
+            self.messages.delete_chats_messages([chat_id])
+
+        return chat
+
+    def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        chats = self.db.delete_chats(chats_ids)
+
+        if chats:
+            self.messages.delete_chats_messages([chat.id for chat in chats])
+
+        return chats
 
     def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
         return self.db.delete_chat_for_user(chat_id, user_id)
 
+    def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, int]:
+        checked, chats_ids = self.db.reclaim_chats(min_members, limit)
+
+        if chats_ids:
+            self.messages.delete_chats_messages(chats_ids)
+
+        return checked, len(chats_ids)
+
+    def count_chats(self) -> int:
+        return self.db.count_chats()
 
-# class RDBMSChatServiceImp(ChatServiceImp):
-#     def __init__(self, crud: ChatCrud) -> None:
-#         self.crud = crud
-#
+    def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        return self.messages.add_message(chat_id, author_id, text)
+
+    def get_messages(self, chat_id: int, before: int | None, after: int | None, limit: int) -> list[Message]:
+        return self.messages.get_messages(chat_id, before, after, limit)
 
 
 class ChatService:
@@ -63,65 +275,181 @@ class ChatService:
         self.imp = implementation
         self.user_service = user_service
 
-    def get_by_id(self, chat_id: int) -> Chat | None:
-        return self.imp.get_by_id(chat_id)
-
-    def get_user_chats(self, user_id: int) -> list[Chat]:
-        return self.imp.get_user_chats(user_id)
-
-    def create_chat(self, users_ids: Iterable[int]) -> Chat:
+    async def get_by_id(self, chat_id: int) -> Chat | None:
+        return await self.imp.get_by_id(chat_id)
+
+    async def get_user_chats(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[Chat]:
+        """User's chats in the order of their ids, the ones after that id and no more than limit of them"""
+
+        return await self.imp.get_user_chats(user_id, after, limit)
+
+    async def get_user_chats_with_users(
+            self,
+            user_id: int,
+            after: int | None = None,
+            limit: int | None = None,
+    ) -> list[ChatWithUsers]:
+        """User's chats with their members fetched in one batch. Members that don't exist anymore are left out"""
+
+        chats = await self.get_user_chats(user_id, after, limit)
+        users = await self.user_service.get_users_by_ids(
+            member_id for chat in chats for member_id in chat.users_ids
+        )
+        users_by_id = {user.id: user for user in users}
+
+        return [
+            ChatWithUsers(
+                id=chat.id,
+                users_ids=chat.users_ids,
+                users=[users_by_id[member_id] for member_id in chat.users_ids if member_id in users_by_id],
+            )
+            for chat in chats
+        ]
+
+    async def create_chat(self, users_ids: Iterable[int]) -> Chat:
+        users_ids = list(users_ids)
         for user_id in users_ids:
-            if not self.user_service.get_user_by_id(user_id):
+            if not await self.user_service.get_user_by_id(user_id):
                 raise UserNotFound(f"User with id {user_id} doesn't exists")
 
-        return self.imp.create_chat(users_ids)
+        return await self.imp.create_chat(users_ids)
+
+    async def create_chats(self, chats_users_ids: Iterable[Iterable[int]]) -> list[Chat]:
+        """Creates all the chats or, if any of their users doesn't exist, none"""
+
+        chats_users_ids = [list(users_ids) for users_ids in chats_users_ids]
+        wanted_ids = {user_id for users_ids in chats_users_ids for user_id in users_ids}
+        found_ids = {user.id for user in await self.user_service.get_users_by_ids(wanted_ids)}
+
+        missing_ids = wanted_ids - found_ids
+        if missing_ids:
+            raise UserNotFound(f"User with id {min(missing_ids)} doesn't exists")
+
+        return await self.imp.create_chats(chats_users_ids)
 
-    def create_chat_with_matched_user(self, user_id: int) -> Chat | None:
-        user_chats = self.get_user_chats(user_id)
-        except_users: set[int] = set()
-        for chat in user_chats:
-            for id_ in chat.users_ids:
-                except_users.add(id_)
+    async def get_chat_partners(self, user_id: int) -> set[int]:
+        """Ids of the user and of everyone they have a chat with"""
 
-        second_user = self.user_service.get_random_user(except_=except_users)
+        partners = await self.imp.get_chat_partners(user_id)
+        partners.add(user_id)
+        return partners
+
+    async def create_chat_with_matched_user(
+            self,
+            user: User,
+            online: PresenceTracker | None = None,
+            except_users: set[int] | None = None,
+    ) -> Chat | None:
+        """
+        Chat with the user sharing most topics with user, or with a random one if nobody shares any.
+
+        With online, users online are preferred: the best match only if it's online, else a random online user,
+        else the best match or a random user anyway.
+        """
+
+        if except_users is None:
+            except_users = await self.get_chat_partners(user.id)
+
+        second_user = None
+        if user.topics:
+            second_user = await self.user_service.get_best_match(user.topics, except_=except_users)
+
+        if online is not None and (not second_user or second_user.id not in online):
+            second_user = await self._get_random_online_user(online, except_users) or second_user
+
+        if not second_user:
+            second_user = await self.user_service.get_random_user(except_=except_users)
 
         if not second_user:
             return None
 
-        return self.create_chat((user_id, second_user.id))
+        return await self.create_chat((user.id, second_user.id))
 
-    def delete_chat(self, chat_id: int) -> Chat | None:
-        return self.imp.delete_chat(chat_id)
+    async def _get_random_online_user(self, online: PresenceTracker, except_users: set[int]) -> User | None:
+        for _ in range(ONLINE_MATCH_ATTEMPTS):
+            user_id = online.random_online(except_users)
+            if user_id is None:
+                return None
 
-    def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
-        return self.imp.delete_chat_for_user(chat_id, user_id)
+            user = await self.user_service.get_user_by_id(user_id)
+            if user:
+                return user
+
+            except_users.add(user_id)
+
+        return None
+
+    async def delete_chat(self, chat_id: int) -> Chat | None:
+        return await self.imp.delete_chat(chat_id)
+
+    async def delete_chats(self, chats_ids: Iterable[int]) -> list[Chat]:
+        return await self.imp.delete_chats(chats_ids)
+
+    async def delete_chat_for_user(self, chat_id: int, user_id: int) -> Chat | None:
+        return await self.imp.delete_chat_for_user(chat_id, user_id)
+
+    async def reclaim_chats(self, min_members: int, limit: int) -> tuple[int, int]:
+        """
+        Checks up to limit of the chats queued for reclaim and deletes the ones left with fewer than min_members
+        members, with their messages. Returns how many were checked and how many deleted
+        """
+
+        return await self.imp.reclaim_chats(min_members, limit)
+
+    async def count_chats(self) -> int:
+        return await self.imp.count_chats()
+
+    async def add_message(self, chat_id: int, author_id: int, text: str) -> Message:
+        return await self.imp.add_message(chat_id, author_id, text)
+
+    async def get_messages(
+            self,
+            chat_id: int,
+            before: int | None = None,
+            after: int | None = None,
+            limit: int = 50,
+    ) -> list[Message]:
+        return await self.imp.get_messages(chat_id, before, after, limit)
 
 
 class ChatServiceFactory(ABC):
+    """Service lifetimes work the same way as in UserServiceFactory"""
+
+    app_scoped = True
+
     @abstractmethod
-    def create_chat_service(self) -> Generator[ChatService, None, None]:
+    def build_chat_service(self, user_service: UserService) -> ChatService:
         raise NotImplementedError
 
+    async def create_chat_service(self, user_service: UserService) -> AsyncGenerator[ChatService, None]:
+        yield self.build_chat_service(user_service)
+
 
 class RAMChatServiceFactory(ChatServiceFactory):
-    def __init__(self, crud_factory: Callable[[], RAMChatCrud], user_service_factory: UserServiceFactory) -> None:
+    def __init__(
+            self,
+            crud_factory: Callable[[], RAMChatCrud],
+            message_crud_factory: Callable[[], RAMMessageCrud],
+    ) -> None:
+        self.crud_factory = crud_factory
+        self.message_crud_factory = message_crud_factory
+
+    def build_chat_service(self, user_service: UserService) -> ChatService:
+        crud = self.crud_factory()
+        imp = RAMChatServiceImp(crud, self.message_crud_factory())
+        return ChatService(imp, user_service)
+
+
+class OffloadedChatServiceFactory(ChatServiceFactory):
+    def __init__(
+            self,
+            crud_factory: Callable[[], ChatCrud],
+            message_crud_factory: Callable[[], MessageCrud],
+    ) -> None:
         self.crud_factory = crud_factory
-        self.user_service_factory = user_service_factory
+        self.message_crud_factory = message_crud_factory
 
-    def create_chat_service(self) -> Generator[ChatService, None, None]:
+    def build_chat_service(self, user_service: UserService) -> ChatService:
         crud = self.crud_factory()
-        imp = RAMChatServiceImp(crud)
-        user_service = self.user_service_factory.create_user_service()
-        yield ChatService(imp, next(user_service))
-
-
-# class RDBMSUserServiceFactory(UserServiceFactory):
-#     def __init__(self, engine: Engine, crud_factory: Callable[[Session], UserCrud]) -> None:
-#         self.engine = engine
-#         self.crud_factory = crud_factory
-#
-#     def create_user_service(self) -> Generator[UserService, None, None]:
-#         with Session(self.engine) as session:
-#             crud = self.crud_factory(session)
-#             imp = RDBMSUserServiceImp(crud)
-#             yield UserService(imp)
+        imp = OffloadedChatServiceImp(CrudChatServiceImp(crud, self.message_crud_factory()))
+        return ChatService(imp, user_service)
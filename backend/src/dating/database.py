@@ -0,0 +1,149 @@
+import sqlite3
+from contextlib import contextmanager
+from queue import LifoQueue
+from threading import Lock
+from typing import Iterator
+
+
+MAX_INTEGER = 2 ** 63 - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_topics (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    PRIMARY KEY (user_id, position)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS user_topics_topic ON user_topics (topic, user_id);
+
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT
+);
+
+CREATE TABLE IF NOT EXISTS chat_members (
+    chat_id INTEGER NOT NULL REFERENCES chats (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, position)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS chat_members_user_id ON chat_members (user_id, chat_id);
+
+CREATE TABLE IF NOT EXISTS shrunk_chats (
+    chat_id INTEGER PRIMARY KEY REFERENCES chats (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS chats_count (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS chats_count_insert AFTER INSERT ON chats
+BEGIN
+    UPDATE chats_count SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS chats_count_delete AFTER DELETE ON chats
+BEGIN
+    UPDATE chats_count SET count = count - 1;
+END;
+
+-- Counts the chats of databases made before the counter, the triggers keep it from then on
+INSERT OR IGNORE INTO chats_count (id, count) SELECT 0, count(*) FROM chats;
+
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id INTEGER NOT NULL REFERENCES chats (id) ON DELETE CASCADE,
+    id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+
+CREATE TABLE IF NOT EXISTS revocations (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_id INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS revocations_expires_at ON revocations (expires_at);
+"""
+
+
+class SQLiteConnectionPool:
+    """
+    Bounded pool of connections to one SQLite database, created per worker process.
+
+    Connections run in WAL mode so readers don't block the writer, and keep a cache of prepared statements
+    for the constant queries of the sqlite cruds.
+    """
+
+    def __init__(self, path: str, size: int, busy_timeout: float = 5) -> None:
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle: LifoQueue[sqlite3.Connection] = LifoQueue()
+        self._created = 0
+        self._lock = Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self._acquire()
+
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put(connection)
+
+    def create_tables(self) -> None:
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+
+        if not create:
+            return self._idle.get()
+
+        try:
+            return self._connect()
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
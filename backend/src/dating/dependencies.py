@@ -1,4 +1,7 @@
-from typing import Callable, Any, NoReturn
+from typing import Awaitable, Callable, Any, NoReturn, TypeVar
+
+
+T = TypeVar("T")
 
 
 class Stub:
@@ -15,5 +18,14 @@ class Stub:
         return hash(self._dependency)
 
 
-Dataclass = dict[str, Any]
+def singleton(value: T) -> Callable[[], Awaitable[T]]:
+    """
+    Dependency provider of an app-wide object.
+
+    It's a coroutine function, as FastAPI runs sync dependencies in the threadpool.
+    """
+
+    async def provide() -> T:
+        return value
 
+    return provide
@@ -0,0 +1,16 @@
+import threading
+from typing import Hashable
+
+
+class StripedLock:
+    """
+    Fixed set of locks shared by keys with the same hash modulo stripes.
+
+    Keys in different stripes never contend, and memory doesn't grow with the number of keys.
+    """
+
+    def __init__(self, stripes: int = 64) -> None:
+        self._locks = tuple(threading.Lock() for _ in range(stripes))
+
+    def __call__(self, key: Hashable) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
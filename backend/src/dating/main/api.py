@@ -1,33 +1,320 @@
-from fastapi import FastAPI
+import os
+from typing import Annotated, AsyncGenerator, Iterator, TypeVar
+
+from fastapi import Depends, FastAPI
+from starlette.concurrency import run_in_threadpool
 from passlib.ifc import PasswordHash
 from passlib.hash import argon2
 
+from .config import (
+    Settings,
+    SESSIONS_LIMIT,
+    SESSIONS_SWEEP_INTERVAL,
+    SESSIONS_SWEEP_BATCH,
+    REVOCATIONS_SYNC_INTERVAL,
+    AUTH_CACHE_SIZE,
+    AUTH_CACHE_TTL,
+    CHAT_SUBSCRIPTION_QUEUE_SIZE,
+    MESSAGES_SEGMENT_SIZE,
+    PRESENCE_TTL,
+    PRESENCE_SWEEP_INTERVAL,
+    PRESENCE_SWEEP_BATCH,
+    MATCH_QUEUE_SIZE,
+    SNAPSHOT_INTERVAL,
+    HASHING_RATE_PER_IP,
+    HASHING_BURST_PER_IP,
+    HASHING_RATE_PER_USERNAME,
+    HASHING_BURST_PER_USERNAME,
+    RATE_LIMIT_BUCKETS,
+    RATE_LIMIT_SWEEP_INTERVAL,
+    RATE_LIMIT_SWEEP_BATCH,
+    CHAT_RECLAIM_INTERVAL,
+    CHAT_RECLAIM_BATCH,
+)
 from ..users.router import users_router
 from ..chats.router import chats_router
-from ..users.service import RAMUserServiceFactory, UserService
-from ..chats.service import RAMChatServiceFactory, ChatService
-from ..users.crud import RAMUserCrud, RAMSessionCrud
-from ..chats.crud import RAMChatCrud
-from ..users.security import SessionProvider
+from .state_server import connect
+from ..users.service import (
+    RAMUserServiceFactory,
+    OffloadedUserServiceFactory,
+    UserServiceFactory,
+    UserService,
+)
+from ..chats.service import (
+    RAMChatServiceFactory,
+    OffloadedChatServiceFactory,
+    ChatServiceFactory,
+    ChatService,
+)
+from ..users.crud import (
+    RAMUserCrud,
+    RAMSessionCrud,
+    SQLiteUserCrud,
+    SQLiteSessionCrud,
+    SQLiteRevocationCrud,
+    RevocationCrud,
+)
+from ..chats.crud import CHATS_DB, RAMChatCrud, RAMMessageCrud, SQLiteChatCrud, SQLiteMessageCrud
+from ..chats.hub import ChatHub, MessageFeed, RelayedChatHub
+from ..chats.matchmaking import Matchmaker, MatchQueue
+from ..chats.reclaim import ChatReclaimer
+from ..background import PeriodicTasks
+from ..database import SQLiteConnectionPool
+from ..dependencies import Stub, singleton
+from ..users.security import (
+    SessionProvider,
+    StoredSessionProvider,
+    SignedSessionProvider,
+    TokenDenylist,
+    AuthCache,
+    SESSION_EXPIRATION_TIME,
+)
+from ..users.hashing import PasswordHasherPool
+from ..users.presence import PresenceTracker
+from ..users.dependencies import get_current_user
+from ..metrics import Metrics, MetricsMiddleware, metrics_router, render_summary, render_value, timed
+from ..snapshots import Snapshotter, restore_stores, snapshot_stores
+from ..admission import AdmissionMiddleware, ConcurrencyLimit, TokenBuckets
+
+
+T = TypeVar("T")
+
+
+def hashing_stats(hasher: PasswordHasherPool) -> Iterator[str]:
+    stats = hasher.stats()
+    yield from render_value("dating_password_hashing_in_flight", "Hashing calls accepted", "gauge", stats.in_flight)
+    yield from render_value("dating_password_hashing_queued", "Hashing calls waiting", "gauge", stats.queued)
+    yield from render_value("dating_password_hashing_rejected_total", "Hashing rejects", "counter", stats.rejected)
+    yield from render_summary(
+        "dating_password_hash_seconds", "argon2 time of hashing calls, no waiting", stats.total_seconds, stats.calls,
+    )
+    yield from render_value(
+        "dating_password_hash_max_seconds", "Longest argon2 time of a hashing call", "gauge", stats.max_seconds,
+    )
+
+
+def snapshot_stats(snapshotter: Snapshotter) -> Iterator[str]:
+    yield from render_value(
+        "dating_snapshot_pause_seconds", "Pause of the last snapshot", "gauge", snapshotter.last_pause,
+    )
+    yield from render_value(
+        "dating_snapshot_duration_seconds", "Duration of the last snapshot", "gauge", snapshotter.last_duration,
+    )
+    yield from render_value("dating_snapshots_total", "Snapshots taken", "counter", snapshotter.taken)
+    yield from render_value("dating_snapshots_failed_total", "Snapshots failed", "counter", snapshotter.failed)
+
+
+def admission_stats(by_ip: TokenBuckets, by_username: TokenBuckets, concurrency: ConcurrencyLimit) -> Iterator[str]:
+    yield from render_value(
+        "dating_rate_limit_buckets", "Rate limit buckets kept", "gauge", len(by_ip) + len(by_username),
+    )
+    yield from render_value("dating_rate_limited_ip_total", "Requests over their IP rate", "counter", by_ip.rejected)
+    yield from render_value(
+        "dating_rate_limited_username_total", "Requests over their username rate", "counter", by_username.rejected,
+    )
+    yield from render_value(
+        "dating_hashing_routes_in_flight", "Requests to hashing routes in flight", "gauge", concurrency.in_flight,
+    )
+    yield from render_value(
+        "dating_hashing_routes_shed_total", "Requests to hashing routes over the cap", "counter", concurrency.rejected,
+    )
+
 
+def reclaim_stats(reclaimer: ChatReclaimer) -> Iterator[str]:
+    yield from render_value("dating_chats_live", "Chats in the store, as of the last reclaim", "gauge", reclaimer.live)
+    yield from render_value("dating_chats_reclaimed_total", "Abandoned chats deleted", "counter", reclaimer.reclaimed)
 
-def create_app() -> FastAPI:
-    app = FastAPI()
+
+def matchmaking_stats(presence: PresenceTracker, queue: MatchQueue) -> Iterator[str]:
+    yield from render_value("dating_users_online", "Users seen recently or connected", "gauge", len(presence))
+    yield from render_value("dating_match_waiters", "Users waiting for a match", "gauge", len(queue))
+
+
+def create_app(settings: Settings | None = None) -> FastAPI:
+    settings = settings or Settings.from_env()
+
+    periodic_tasks = PeriodicTasks()
+    app = FastAPI(lifespan=periodic_tasks.lifespan)
     app.include_router(users_router)
     app.include_router(chats_router)
 
-    user_service_factory = RAMUserServiceFactory(RAMUserCrud)
-    app.dependency_overrides[UserService] = user_service_factory.create_user_service
+    metrics = Metrics() if settings.metrics else None
+
+    def instrumented(crud: T, name: str) -> T:
+        if metrics is None:
+            return crud
+        return metrics.instrument(crud, metrics.crud, name)
+
+    user_service_factory: UserServiceFactory
+    chat_service_factory: ChatServiceFactory
+    session_provider: SessionProvider
+    # Shares logouts of signed tokens between workers and keeps them across restarts
+    revocation_crud: RevocationCrud | None = None
+    # Relays chat messages to the WebSocket subscribers of other workers
+    message_feed: MessageFeed | None = None
+
+    if settings.storage == "sqlite":
+        pool = SQLiteConnectionPool(settings.sqlite_path, settings.sqlite_pool_size)
+        pool.create_tables()
+
+        sqlite_user_crud = instrumented(SQLiteUserCrud(pool), "users")
+        sqlite_chat_crud = instrumented(SQLiteChatCrud(pool), "chats")
+        sqlite_message_crud = instrumented(SQLiteMessageCrud(pool), "messages")
+        sqlite_session_crud = instrumented(SQLiteSessionCrud(pool, ttl=SESSION_EXPIRATION_TIME), "sessions")
+
+        user_service_factory = OffloadedUserServiceFactory(lambda: sqlite_user_crud)
+        chat_service_factory = OffloadedChatServiceFactory(lambda: sqlite_chat_crud, lambda: sqlite_message_crud)
+        session_provider = StoredSessionProvider(sqlite_session_crud, offload=True)
+        periodic_tasks.every(
+            SESSIONS_SWEEP_INTERVAL, lambda: run_in_threadpool(sqlite_session_crud.sweep, SESSIONS_SWEEP_BATCH)
+        )
+
+        if settings.session_tokens == "signed":
+            sqlite_revocation_crud = instrumented(SQLiteRevocationCrud(pool), "revocations")
+            revocation_crud = sqlite_revocation_crud
+            periodic_tasks.every(
+                SESSIONS_SWEEP_INTERVAL,
+                lambda: run_in_threadpool(sqlite_revocation_crud.sweep, SESSIONS_SWEEP_BATCH),
+            )
+    elif settings.storage == "shared":
+        state = connect(settings)
+
+        shared_user_crud = instrumented(state.users, "users")
+        shared_chat_crud = instrumented(state.chats, "chats")
+        shared_message_crud = instrumented(state.messages, "messages")
+
+        user_service_factory = OffloadedUserServiceFactory(lambda: shared_user_crud)
+        chat_service_factory = OffloadedChatServiceFactory(lambda: shared_chat_crud, lambda: shared_message_crud)
+        session_provider = StoredSessionProvider(instrumented(state.sessions, "sessions"), offload=True)
+        message_feed = state.feed
+    else:
+        message_crud = RAMMessageCrud(MESSAGES_SEGMENT_SIZE, settings.messages_directory)
+
+        if settings.snapshot_path is not None:
+            restore_stores(settings.snapshot_path, message_crud)
+            snapshotter = Snapshotter(settings.snapshot_path, snapshot_stores)
+            periodic_tasks.every(SNAPSHOT_INTERVAL, snapshotter.run)
+            periodic_tasks.at_shutdown(snapshotter.take)
+
+            if metrics is not None:
+                metrics.collect(lambda: snapshot_stats(snapshotter))
+
+        ram_user_crud = instrumented(RAMUserCrud(), "users")
+        ram_chat_crud = instrumented(RAMChatCrud(), "chats")
+        message_crud.recover(CHATS_DB.by_id)
+        ram_message_crud = instrumented(message_crud, "messages")
+        ram_session_crud = instrumented(
+            RAMSessionCrud(ttl=SESSION_EXPIRATION_TIME, max_sessions=SESSIONS_LIMIT), "sessions",
+        )
+
+        user_service_factory = RAMUserServiceFactory(lambda: ram_user_crud)
+        chat_service_factory = RAMChatServiceFactory(lambda: ram_chat_crud, lambda: ram_message_crud)
+        session_provider = StoredSessionProvider(ram_session_crud)
+        periodic_tasks.every(SESSIONS_SWEEP_INTERVAL, lambda: ram_session_crud.sweep(SESSIONS_SWEEP_BATCH))
+
+    if settings.session_tokens == "signed":
+        denylist = TokenDenylist()
+        signed_session_provider = SignedSessionProvider(
+            settings.session_secret.encode(),
+            ttl=SESSION_EXPIRATION_TIME,
+            denylist=denylist,
+            revocations=revocation_crud,
+            offload=True,
+        )
+        session_provider = signed_session_provider
+        periodic_tasks.every(SESSIONS_SWEEP_INTERVAL, lambda: denylist.sweep(SESSIONS_SWEEP_BATCH))
+
+        if revocation_crud is not None:
+            periodic_tasks.at_startup(signed_session_provider.sync_revocations)
+            periodic_tasks.every(REVOCATIONS_SYNC_INTERVAL, signed_session_provider.sync_revocations)
+
+        if metrics is not None:
+            metrics.collect(lambda: render_value(
+                "dating_revoked_tokens", "Revoked signed tokens not expired yet", "gauge", len(denylist),
+            ))
+
+    if user_service_factory.app_scoped and chat_service_factory.app_scoped:
+        user_service = user_service_factory.build_user_service()
+        app.dependency_overrides[UserService] = singleton(user_service)
+        app.dependency_overrides[ChatService] = singleton(chat_service_factory.build_chat_service(user_service))
+    else:
+        async def create_chat_service(
+                user_service: Annotated[UserService, Depends(Stub(UserService))],
+        ) -> AsyncGenerator[ChatService, None]:
+            async for chat_service in chat_service_factory.create_chat_service(user_service):
+                yield chat_service
+
+        app.dependency_overrides[UserService] = user_service_factory.create_user_service
+        app.dependency_overrides[ChatService] = create_chat_service
+
+    if settings.chat_min_members:
+        reclaimer = ChatReclaimer(
+            chat_service_factory.build_chat_service(user_service_factory.build_user_service()),
+            min_members=settings.chat_min_members,
+            batch=CHAT_RECLAIM_BATCH,
+        )
+        periodic_tasks.every(CHAT_RECLAIM_INTERVAL, reclaimer.run)
+
+        if metrics is not None:
+            metrics.collect(lambda: reclaim_stats(reclaimer))
+
+    if message_feed is not None:
+        relayed_hub = RelayedChatHub(max_queue=CHAT_SUBSCRIPTION_QUEUE_SIZE, feed=message_feed)
+        periodic_tasks.at_startup(relayed_hub.start)
+        periodic_tasks.at_shutdown(relayed_hub.stop)
+        hub: ChatHub = relayed_hub
+    else:
+        hub = ChatHub(max_queue=CHAT_SUBSCRIPTION_QUEUE_SIZE)
+
+    app.dependency_overrides[ChatHub] = singleton(hub)
+    app.dependency_overrides[SessionProvider] = singleton(session_provider)
+
+    auth_cache = AuthCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+    app.dependency_overrides[AuthCache] = singleton(auth_cache)
+
+    presence = PresenceTracker(ttl=PRESENCE_TTL)
+    match_queue = MatchQueue(max_size=MATCH_QUEUE_SIZE)
+    matchmaker = Matchmaker(None, None) if settings.storage == "shared" else Matchmaker(match_queue, presence)
+    app.dependency_overrides[PresenceTracker] = singleton(presence)
+    app.dependency_overrides[Matchmaker] = singleton(matchmaker)
+    periodic_tasks.every(PRESENCE_SWEEP_INTERVAL, lambda: presence.sweep(PRESENCE_SWEEP_BATCH))
+
+    workers = os.cpu_count() or 1
+    hasher = PasswordHasherPool(argon2, max_workers=workers, max_pending=workers * 16)
+    instrumented_hasher = hasher
+
+    if settings.rate_limits:
+        by_ip = TokenBuckets(HASHING_RATE_PER_IP, HASHING_BURST_PER_IP, max_size=RATE_LIMIT_BUCKETS)
+        by_username = TokenBuckets(HASHING_RATE_PER_USERNAME, HASHING_BURST_PER_USERNAME, max_size=RATE_LIMIT_BUCKETS)
+        concurrency = ConcurrencyLimit(hasher.max_pending)
+        app.add_middleware(
+            AdmissionMiddleware,
+            paths=("/users/", "/users/login"),
+            by_ip=by_ip,
+            by_username=by_username,
+            concurrency=concurrency,
+        )
+        periodic_tasks.every(
+            RATE_LIMIT_SWEEP_INTERVAL,
+            lambda: (by_ip.sweep(RATE_LIMIT_SWEEP_BATCH), by_username.sweep(RATE_LIMIT_SWEEP_BATCH)),
+        )
+
+        if metrics is not None:
+            metrics.collect(lambda: admission_stats(by_ip, by_username, concurrency))
 
-    chat_service_factory = RAMChatServiceFactory(RAMChatCrud, user_service_factory)
-    app.dependency_overrides[ChatService] = chat_service_factory.create_chat_service
+    if metrics is not None:
+        instrumented_hasher = metrics.instrument(hasher, metrics.hashing, only=("hash", "verify"))
+        metrics.collect(lambda: hashing_stats(hasher))
+        metrics.collect(lambda: matchmaking_stats(presence, match_queue))
 
-    ram_session_crud = RAMSessionCrud()
-    session_provider = SessionProvider(ram_session_crud)
-    app.dependency_overrides[SessionProvider] = lambda: session_provider
+        app.dependency_overrides[get_current_user] = timed(metrics.dependencies, ("get_current_user",))(
+            get_current_user
+        )
+        app.dependency_overrides[Metrics] = singleton(metrics)
+        app.include_router(metrics_router)
+        app.add_middleware(MetricsMiddleware, metrics=metrics)
 
-    hasher = argon2
-    app.dependency_overrides[PasswordHash] = lambda: hasher
+    app.dependency_overrides[PasswordHash] = singleton(instrumented_hasher)
 
     return app
 
@@ -0,0 +1,97 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+
+
+STORAGES = ("ram", "sqlite", "shared")
+SESSION_TOKENS = ("stored", "signed")
+
+SESSIONS_LIMIT = 1_000_000
+SESSIONS_SWEEP_INTERVAL = 1
+SESSIONS_SWEEP_BATCH = 1000
+REVOCATIONS_SYNC_INTERVAL = 1
+AUTH_CACHE_SIZE = 100_000
+AUTH_CACHE_TTL = 5
+CHAT_SUBSCRIPTION_QUEUE_SIZE = 256
+MESSAGE_FEED_SIZE = 10_000
+MESSAGES_SEGMENT_SIZE = 1024
+PRESENCE_TTL = 60
+PRESENCE_SWEEP_INTERVAL = 1
+PRESENCE_SWEEP_BATCH = 1000
+MATCH_QUEUE_SIZE = 100_000
+SNAPSHOT_INTERVAL = 60
+HASHING_RATE_PER_IP = 1
+HASHING_BURST_PER_IP = 20
+HASHING_RATE_PER_USERNAME = 0.2
+HASHING_BURST_PER_USERNAME = 5
+RATE_LIMIT_BUCKETS = 100_000
+RATE_LIMIT_SWEEP_INTERVAL = 1
+RATE_LIMIT_SWEEP_BATCH = 1000
+CHAT_RECLAIM_INTERVAL = 1
+CHAT_RECLAIM_BATCH = 1000
+
+
+@dataclass
+class Settings:
+    storage: str = "ram"
+    sqlite_path: str = "dating.sqlite3"
+    sqlite_pool_size: int = 8
+    messages_directory: Path | None = None
+    state_server_address: str = "dating-state.sock"
+    state_server_authkey: str = ""
+    metrics: bool = True
+    snapshot_path: Path | None = None
+    rate_limits: bool = True
+    # Chats left with fewer members are deleted, 0 keeps them all
+    chat_min_members: int = 1
+    # Stored tokens are looked up in the sessions store, signed ones carry their user and are signed with the secret
+    session_tokens: str = "stored"
+    session_secret: str = ""
+
+    def __post_init__(self) -> None:
+        if self.storage not in STORAGES:
+            raise ValueError(f"Unknown storage {self.storage!r}, expected one of {STORAGES}")
+
+        if self.storage == "shared" and not self.state_server_authkey:
+            raise ValueError("Shared storage requires a state server authkey")
+
+        if self.session_tokens not in SESSION_TOKENS:
+            raise ValueError(f"Unknown session tokens {self.session_tokens!r}, expected one of {SESSION_TOKENS}")
+
+        if self.session_tokens == "signed" and not self.session_secret:
+            raise ValueError("Signed session tokens require a session secret")
+
+        # Signed tokens outlive a restart, so their logouts and their users' ids have to as well
+        if self.session_tokens == "signed" and self.storage != "sqlite":
+            raise ValueError("Signed session tokens require sqlite storage")
+
+        if self.chat_min_members < 0:
+            raise ValueError("Chat min members can't be negative")
+
+        # Only chats created with fewer than two members are queued for reclaim before they lose one
+        if self.chat_min_members > 2:
+            raise ValueError("Chat min members can't be over 2, the members chats start with")
+
+        if self.snapshot_path is not None and self.storage == "sqlite":
+            raise ValueError("Snapshots are only taken of ram and shared storage")
+
+    @classmethod
+    def from_env(cls) -> Self:
+        messages_directory = os.environ.get("DATING_MESSAGES_DIR")
+        snapshot_path = os.environ.get("DATING_SNAPSHOT_PATH")
+
+        return cls(
+            storage=os.environ.get("DATING_STORAGE", cls.storage),
+            sqlite_path=os.environ.get("DATING_SQLITE_PATH", cls.sqlite_path),
+            sqlite_pool_size=int(os.environ.get("DATING_SQLITE_POOL_SIZE", cls.sqlite_pool_size)),
+            messages_directory=Path(messages_directory) if messages_directory else None,
+            state_server_address=os.environ.get("DATING_STATE_SERVER_ADDRESS", cls.state_server_address),
+            state_server_authkey=os.environ.get("DATING_STATE_SERVER_AUTHKEY", cls.state_server_authkey),
+            metrics=os.environ.get("DATING_METRICS", "1") != "0",
+            snapshot_path=Path(snapshot_path) if snapshot_path else None,
+            rate_limits=os.environ.get("DATING_RATE_LIMITS", "1") != "0",
+            chat_min_members=int(os.environ.get("DATING_CHAT_MIN_MEMBERS", cls.chat_min_members)),
+            session_tokens=os.environ.get("DATING_SESSION_TOKENS", cls.session_tokens),
+            session_secret=os.environ.get("DATING_SESSION_SECRET", cls.session_secret),
+        )
@@ -0,0 +1,140 @@
+"""
+State server sharing the RAM stores between worker processes on one host.
+
+The server process owns USERS_DB, CHATS_DB, MESSAGES_DB and SESSIONS_DB and serves their cruds over
+a Unix socket. Workers get proxies of those cruds, so a session created by one worker is valid in
+all of them. The cruds are thread-safe, so the server's connection threads call them directly.
+It also serves the feed relaying chat messages to the WebSocket subscribers of every worker.
+Run it with `python -m dating.main.state_server` or let gunicorn.conf.py start it.
+"""
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from multiprocessing.process import BaseProcess
+from typing import Any, NamedTuple, cast
+
+from .config import (
+    Settings,
+    SESSIONS_LIMIT,
+    SESSIONS_SWEEP_INTERVAL,
+    SESSIONS_SWEEP_BATCH,
+    MESSAGES_SEGMENT_SIZE,
+    MESSAGE_FEED_SIZE,
+    SNAPSHOT_INTERVAL,
+)
+from ..chats.crud import CHATS_DB, RAMChatCrud, RAMMessageCrud
+from ..chats.hub import MessageFeed
+from ..users.crud import RAMUserCrud, RAMSessionCrud
+from ..users.security import SESSION_EXPIRATION_TIME
+from ..snapshots import Snapshotter, restore_stores, snapshot_stores
+
+
+class StateServer(BaseManager):
+    pass
+
+
+class StateClient(BaseManager):
+    pass
+
+
+class SharedState(NamedTuple):
+    users: RAMUserCrud
+    chats: RAMChatCrud
+    messages: RAMMessageCrud
+    sessions: RAMSessionCrud
+    feed: MessageFeed
+
+
+for name in SharedState._fields:
+    StateClient.register(name)
+
+
+def public_methods(cls: type) -> tuple[str, ...]:
+    return tuple(name for name in dir(cls) if not name.startswith("_") and callable(getattr(cls, name)))
+
+
+def serve(settings: Settings) -> None:
+    messages = RAMMessageCrud(MESSAGES_SEGMENT_SIZE, settings.messages_directory)
+
+    snapshotter = None
+    if settings.snapshot_path is not None:
+        restore_stores(settings.snapshot_path, messages)
+        snapshotter = Snapshotter(settings.snapshot_path, snapshot_stores)
+
+    messages.recover(CHATS_DB.by_id)
+    sessions = RAMSessionCrud(ttl=SESSION_EXPIRATION_TIME, max_sessions=SESSIONS_LIMIT)
+    stores = SharedState(
+        users=RAMUserCrud(),
+        chats=RAMChatCrud(),
+        messages=messages,
+        sessions=sessions,
+        feed=MessageFeed(MESSAGE_FEED_SIZE),
+    )
+
+    for name, store in zip(SharedState._fields, stores):
+        StateServer.register(
+            name,
+            callable=lambda store=store: store,
+            exposed=public_methods(type(store)),
+        )
+
+    def sweep_sessions() -> None:
+        while True:
+            time.sleep(SESSIONS_SWEEP_INTERVAL)
+            sessions.sweep(SESSIONS_SWEEP_BATCH)
+
+    threading.Thread(target=sweep_sessions, name="sessions-sweeper", daemon=True).start()
+
+    def take_snapshots(snapshotter: Snapshotter) -> None:
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            snapshotter.take()
+
+    if snapshotter is not None:
+        threading.Thread(target=take_snapshots, args=(snapshotter,), name="snapshotter", daemon=True).start()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    if os.path.exists(settings.state_server_address):
+        os.unlink(settings.state_server_address)
+
+    manager = StateServer(address=settings.state_server_address, authkey=settings.state_server_authkey.encode())
+    try:
+        manager.get_server().serve_forever()
+    finally:
+        if os.path.exists(settings.state_server_address):
+            os.unlink(settings.state_server_address)
+        if snapshotter is not None:
+            snapshotter.take()
+
+
+def connect(settings: Settings) -> SharedState:
+    client = StateClient(address=settings.state_server_address, authkey=settings.state_server_authkey.encode())
+    client.connect()
+    return SharedState(*(cast(Any, getattr(client, name)()) for name in SharedState._fields))
+
+
+def start_state_server(settings: Settings, timeout: float = 10) -> BaseProcess:
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(settings,), name="dating-state-server", daemon=True,
+    )
+    process.start()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connect(settings)
+            return process
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError("State server didn't start")
+            time.sleep(0.05)
+
+
+if __name__ == "__main__":
+    serve(Settings.from_env())
@@ -0,0 +1,249 @@
+"""
+In-process metrics exported in the Prometheus text format.
+
+Recording never takes a lock: every thread writes to its own shard of a metric, preallocated on its
+first write, and shards are only summed when /metrics is scraped.
+"""
+
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Annotated, Any, Callable, Iterable, Iterator, TypeVar, cast
+
+from fastapi import APIRouter, Depends, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .dependencies import Stub
+
+
+T = TypeVar("T")
+Labels = tuple[str, ...]
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self._local = threading.local()
+        self._shards: list[dict[Labels, list[float]]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict[Labels, list[float]]:
+        try:
+            shard: dict[Labels, list[float]] = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _merged(self, width: int) -> dict[Labels, list[float]]:
+        merged: dict[Labels, list[float]] = {}
+
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        for shard in shards:
+            for labels, values in list(shard.items()):
+                total = merged.setdefault(labels, [0.0] * width)
+                for i, value in enumerate(values):
+                    total[i] += value
+
+        return merged
+
+    def _format_labels(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def add(self, labels: Labels, amount: float) -> None:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = [0.0]
+        values[0] += amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, (value,) in sorted(self._merged(1).items()):
+            yield f"{self.name}{self._format_labels(labels)} {value:g}"
+
+
+class Histogram(Metric):
+    """Cumulative histogram over fixed buckets. Per label set, a shard holds the bucket counts, then the sum"""
+
+    kind = "histogram"
+
+    def __init__(
+            self, name: str, help_: str, labels: Labels = (), buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_, labels)
+        self.buckets = buckets
+
+    def observe(self, labels: Labels, value: float) -> None:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = [0.0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, values in sorted(self._merged(len(self.buckets) + 2).items()):
+            count = 0.0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), values):
+                count += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._format_labels(labels, le)} {count:g}"
+            yield f"{self.name}_sum{self._format_labels(labels)} {values[-1]:.9g}"
+            yield f"{self.name}_count{self._format_labels(labels)} {count:g}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_value(name: str, help_: str, kind: str, value: float) -> list[str]:
+    return [f"# HELP {name} {help_}", f"# TYPE {name} {kind}", f"{name} {value:g}"]
+
+
+def render_summary(name: str, help_: str, total: float, count: int) -> list[str]:
+    return [f"# HELP {name} {help_}", f"# TYPE {name} summary", f"{name}_sum {total:.9g}", f"{name}_count {count}"]
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.requests = Histogram(
+            "dating_http_request_duration_seconds", "HTTP requests latency", ("method", "route", "status"),
+        )
+        self.in_flight = Gauge("dating_http_requests_in_flight", "HTTP requests being handled")
+        self.dependencies = Histogram(
+            "dating_dependency_duration_seconds", "Request dependencies latency", ("dependency",),
+        )
+        self.crud = Histogram("dating_crud_duration_seconds", "Storage calls latency", ("crud", "method"))
+        self.hashing = Histogram(
+            "dating_password_hashing_duration_seconds", "Password hashing latency, waiting included", ("method",),
+        )
+        self._metrics: list[Metric] = [self.requests, self.in_flight, self.dependencies, self.crud, self.hashing]
+        self._collectors: list[Callable[[], Iterable[str]]] = []
+
+    def collect(self, collector: Callable[[], Iterable[str]]) -> None:
+        """Adds a callable producing exposition lines of its own on every scrape"""
+
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def instrument(self, target: T, histogram: Histogram, *labels: str, only: Iterable[str] | None = None) -> T:
+        """Proxy of target timing its public methods, or just the `only` ones, labelled with labels and method name"""
+
+        names = only if only is not None else (
+            name for name in dir(target) if not name.startswith("_") and callable(getattr(target, name))
+        )
+        methods = {name: timed(histogram, (*labels, name))(getattr(target, name)) for name in names}
+        return cast(T, _Instrumented(target, methods))
+
+
+class _Instrumented:
+    def __init__(self, target: object, methods: dict[str, Callable[..., Any]]) -> None:
+        self._target = target
+        self.__dict__.update(methods)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+
+def timed(histogram: Histogram, labels: Labels) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        observe = histogram.observe
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_call(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(labels, time.perf_counter() - start)
+
+            return async_call
+
+        @wraps(func)
+        def call(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(labels, time.perf_counter() - start)
+
+        return call
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """Times HTTP requests by method, route template and status, and counts requests in flight"""
+
+    def __init__(self, app: ASGIApp, metrics: Metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = self.metrics.in_flight
+        in_flight.add((), 1)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.add((), -1)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            self.metrics.requests.observe((scope["method"], path, str(status_code)), elapsed)
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def get_metrics(metrics: Annotated[Metrics, Depends(Stub(Metrics))]) -> Response:
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
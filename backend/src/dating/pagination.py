@@ -0,0 +1,56 @@
+"""
+Keyset pagination. A page is the items with keys over the one its cursor holds, and the cursor of the next page
+holds the key of the last item of this one, so listing deep into a collection costs as much as its first page.
+"""
+
+import base64
+import binascii
+from typing import Annotated, Callable, TypeVar
+
+from fastapi import HTTPException, Query, status
+
+
+T = TypeVar("T")
+
+DEFAULT_PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key: int) -> str:
+    return base64.urlsafe_b64encode(key.to_bytes(8, "big", signed=True)).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(cursor)
+
+    if len(data) != 8:
+        raise InvalidCursor(cursor)
+
+    return int.from_bytes(data, "big", signed=True)
+
+
+def split_page(items: list[T], limit: int, key: Callable[[T], int]) -> tuple[list[T], str | None]:
+    """Page of items fetched with one more than limit, and the cursor of the next page if that one was there"""
+
+    if len(items) <= limit:
+        return items, None
+
+    del items[limit:]
+    return items, encode_cursor(key(items[-1]))
+
+
+async def get_cursor_key(cursor: Annotated[str | None, Query()] = None) -> int | None:
+    if cursor is None:
+        return None
+
+    try:
+        return decode_cursor(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -0,0 +1,30 @@
+import random
+from typing import Container, Sequence, TypeVar
+
+
+T = TypeVar("T")
+
+
+def sample_excluding(population: Sequence[T], except_: Container[T], rng: random.Random | None = None) -> T | None:
+    """
+    Uniformly random item of population that is not in except_.
+
+    Items are drawn from a lazily shuffled population (Fisher-Yates over a sparse swap table),
+    so every draw is O(1), no item is drawn twice and exhausting the population ends the loop.
+    The expected number of draws is (n + 1) / (n - k + 1) for k excluded items out of n.
+    """
+
+    randrange = (rng or random).randrange
+    size = len(population)
+    swaps: dict[int, int] = {}
+
+    for i in range(size):
+        j = randrange(i, size)
+        picked = swaps.get(j, j)
+        swaps[j] = swaps.get(i, i)
+
+        item = population[picked]
+        if item not in except_:
+            return item
+
+    return None
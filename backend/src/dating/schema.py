@@ -2,6 +2,10 @@ from dataclasses import dataclass, fields
 from typing import Any, Self
 
 
+# Most items a batch endpoint takes at once
+MAX_BATCH_SIZE = 1000
+
+
 @dataclass
 class BaseSchema:
     @classmethod
@@ -0,0 +1,114 @@
+import json
+import math
+from dataclasses import fields
+from functools import partial
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+from typing import Any, Callable, Iterable, Mapping, get_args, get_origin, get_type_hints
+
+from fastapi import Response
+
+from .schema import BaseSchema
+
+
+Encoder = Callable[[Any], str]
+
+
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+
+def _encode_int_list(value: Iterable[int]) -> str:
+    return "[" + ",".join(map(str, value)) + "]"
+
+
+def _encode_str_list(value: Iterable[str]) -> str:
+    return "[" + ",".join(map(encode_basestring_ascii, value)) + "]"
+
+
+def _encode_bool(value: bool) -> str:
+    return "true" if value else "false"
+
+
+def _encode_float(value: float) -> str:
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"Out of range float values are not JSON compliant: {value!r}")
+    return repr(value)
+
+
+def _encode_any(value: object) -> str:
+    return json.dumps(value, allow_nan=False)
+
+
+FIELD_ENCODERS: dict[Any, Encoder] = {
+    # Writes bools and int enums as plain numbers
+    int: int.__repr__,
+    float: _encode_float,
+    str: encode_basestring_ascii,
+    bool: _encode_bool,
+    list[int]: _encode_int_list,
+    list[str]: _encode_str_list,
+}
+
+
+def _encode_schema_list(encode: Encoder, value: Iterable[object]) -> str:
+    return "[" + ",".join(map(encode, value)) + "]"
+
+
+def _schema_list_item(hint: Any) -> type[BaseSchema] | None:
+    if get_origin(hint) is not list:
+        return None
+
+    (item,) = get_args(hint)
+    return item if isinstance(item, type) and issubclass(item, BaseSchema) else None
+
+
+_ENCODERS: dict[type[BaseSchema], Encoder] = {}
+
+
+def encoder_for(schema: type[BaseSchema]) -> Encoder:
+    """
+    JSON encoder of schema fields, built once per schema.
+
+    The encoder reads the fields straight from any object having them, e.g. a stored User for UserOut,
+    so fields missing in schema are never written and nothing is copied or validated on the way.
+    A list of schemas is written with the encoder of its item schema. Like json.dumps(allow_nan=False),
+    it raises ValueError for a float that isn't finite.
+    """
+
+    if schema in _ENCODERS:
+        return _ENCODERS[schema]
+
+    hints = get_type_hints(schema)
+    parts: list[tuple[str, Callable[[Any], Any], Encoder]] = []
+
+    for field in fields(schema):
+        item = _schema_list_item(hints[field.name])
+        if item is not None:
+            encode_value: Encoder = partial(_encode_schema_list, encoder_for(item))
+        else:
+            encode_value = FIELD_ENCODERS.get(hints[field.name], _encode_any)
+        parts.append((json.dumps(field.name) + ":", attrgetter(field.name), encode_value))
+
+    def encode(obj: Any) -> str:
+        return "{" + ",".join([key + encode_value(get(obj)) for key, get, encode_value in parts]) + "}"
+
+    _ENCODERS[schema] = encode
+    return encode
+
+
+def json_response(schema: type[BaseSchema], obj: object | None, status_code: int = 200) -> JSONBytesResponse:
+    content = encoder_for(schema)(obj) if obj is not None else "null"
+    return JSONBytesResponse(content.encode(), status_code=status_code)
+
+
+def json_list_response(
+        schema: type[BaseSchema],
+        objs: Iterable[object],
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+) -> JSONBytesResponse:
+    encode = encoder_for(schema)
+    content = "[" + ",".join(encode(obj) for obj in objs) + "]"
+    return JSONBytesResponse(content.encode(), status_code=status_code, headers=headers)
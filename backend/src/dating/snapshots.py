@@ -0,0 +1,380 @@
+"""
+Binary snapshots of the RAM stores: users, chats, sessions and messages.
+
+A snapshot is written by a forked child from its copy-on-write view of the stores, so request handling only
+pauses for the fork. The image is columnar: ids and numbers are raw arrays, strings are NUL-joined UTF-8 blobs
+with their lengths, so restoring maps the file and rebuilds every store from a few bulk conversions.
+Of messages, only the ones in memory are included, with the last id of every chat. Segments already sealed
+in the messages directory are reopened from there.
+"""
+
+import asyncio
+import gc
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from itertools import accumulate, islice, repeat
+from operator import itemgetter
+from pathlib import Path
+from typing import BinaryIO, Callable, NamedTuple
+
+from .chats.crud import CHATS_DB, MESSAGES_DB, ChatRecord, ChatStorage, RAMMessageCrud
+from .chats.schema import Message
+from .chats.segments import MessageLog, SegmentError
+from .users.crud import USERS_DB, SESSIONS_DB, Session, UserRecord, UserStorage
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DATSNAP2"
+HEADER = struct.Struct("<8s?d")
+SIZE = struct.Struct("<Q")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotStats(NamedTuple):
+    users: int
+    chats: int
+    sessions: int
+    messages: int
+
+
+class _Writer:
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+
+    def write(self, data: bytes | memoryview) -> None:
+        self.file.write(data)
+
+    def numbers(self, values: "array[int] | array[float]") -> None:
+        self.write(SIZE.pack(len(values)))
+        self.write(memoryview(values).cast("B"))
+
+    def strings(self, values: list[str]) -> None:
+        self.numbers(array("Q", map(len, values)))
+        blob = "\0".join(values).encode("utf-8", "surrogatepass")
+        self.write(SIZE.pack(len(blob)))
+        self.write(blob)
+
+
+class _Reader:
+    def __init__(self, data: memoryview) -> None:
+        self.data = data
+        self.offset = 0
+
+    def read(self, size: int) -> memoryview:
+        if self.offset + size > len(self.data):
+            raise SnapshotError("Snapshot is truncated")
+
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def size(self) -> int:
+        value: int = SIZE.unpack(self.read(SIZE.size))[0]
+        return value
+
+    def ints(self, typecode: str) -> "array[int]":
+        values = array(typecode)
+        values.frombytes(self.read(self.size() * values.itemsize))
+        return values
+
+    def floats(self) -> "array[float]":
+        values = array("d")
+        values.frombytes(self.read(self.size() * values.itemsize))
+        return values
+
+    def strings(self) -> list[str]:
+        lengths = self.ints("Q")
+        text = str(self.read(self.size()), "utf-8", "surrogatepass")
+
+        if not lengths:
+            return []
+
+        values = text.split("\0")
+        if len(values) == len(lengths):
+            return values
+
+        # Some value has a NUL in it, so cut by lengths instead
+        starts = accumulate((length + 1 for length in lengths), initial=0)
+        return [text[start:start + length] for start, length in zip(starts, lengths)]
+
+
+def write_snapshot(
+        path: Path,
+        users: UserStorage,
+        chats: ChatStorage,
+        sessions: OrderedDict[str, Session],
+        messages: dict[int, MessageLog],
+        clock: Callable[[], float] = time.monotonic,
+) -> SnapshotStats:
+    """
+    Writes the stores to path atomically, through a temporary file renamed over it.
+
+    It reads the stores without locking and takes an id from each of them to record the next one, so it is
+    meant for a forked child or for a process that doesn't change the stores anymore.
+    """
+
+    user_records = list(users)
+    chat_records = list(chats)
+    session_items = list(sessions.items())
+    logs = list(messages.values())
+    logs_messages = [log.in_memory() for log in logs]
+    all_messages = [message for log_messages in logs_messages for message in log_messages]
+    now = clock()
+
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "wb") as file:
+        writer = _Writer(file)
+        writer.write(HEADER.pack(MAGIC, sys.byteorder == "little", time.time()))
+
+        writer.numbers(array("q", [users.next_id()]))
+        writer.numbers(array("q", map(itemgetter(0), user_records)))
+        writer.strings(list(map(itemgetter(1), user_records)))
+        writer.strings(list(map(itemgetter(2), user_records)))
+        writer.numbers(array("B", (len(record.topics) for record in user_records)))
+        writer.strings([topic for record in user_records for topic in record.topics])
+
+        writer.numbers(array("q", [chats.next_id()]))
+        writer.numbers(array("q", (chat.id for chat in chat_records)))
+        writer.numbers(array("Q", (len(chat.users_ids) for chat in chat_records)))
+        members = array("q")
+        for chat in chat_records:
+            members.extend(chat.users_ids)
+        writer.numbers(members)
+
+        writer.strings(list(map(itemgetter(0), session_items)))
+        writer.numbers(array("q", (session.user_id for _, session in session_items)))
+        writer.numbers(array("d", (session.expires_at - now for _, session in session_items)))
+
+        writer.numbers(array("q", (log.chat_id for log in logs)))
+        writer.numbers(array("q", (log.last_id for log in logs)))
+        writer.numbers(array("Q", map(len, logs_messages)))
+        writer.numbers(array("q", (message.id for message in all_messages)))
+        writer.numbers(array("q", (message.author_id for message in all_messages)))
+        writer.numbers(array("d", (message.created_at for message in all_messages)))
+        writer.strings([message.text for message in all_messages])
+
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temporary, path)
+    return SnapshotStats(len(user_records), len(chat_records), len(session_items), len(all_messages))
+
+
+def load_snapshot(
+        path: Path,
+        users: UserStorage,
+        chats: ChatStorage,
+        sessions: OrderedDict[str, Session],
+        messages: dict[int, MessageLog],
+        new_log: Callable[[int], MessageLog],
+        clock: Callable[[], float] = time.monotonic,
+) -> SnapshotStats:
+    """
+    Replaces the stores with the snapshot at path. Sessions keep the time they had left when it was taken.
+    Message logs come from new_log, which reopens their sealed segments, and get their messages in memory back.
+    The GC is paused meanwhile: records have no cycles, and collections triggered by millions of them are wasted.
+    """
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = memoryview(mapped)
+            try:
+                stats = _load(_Reader(data), users, chats, sessions, messages, new_log, clock)
+            finally:
+                data.release()
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return stats
+
+
+def _load(
+        reader: _Reader,
+        users: UserStorage,
+        chats: ChatStorage,
+        sessions: OrderedDict[str, Session],
+        messages: dict[int, MessageLog],
+        new_log: Callable[[int], MessageLog],
+        clock: Callable[[], float],
+) -> SnapshotStats:
+    magic, little_endian, taken_at = HEADER.unpack(reader.read(HEADER.size))
+    if magic != MAGIC:
+        raise SnapshotError("Not a snapshot")
+    if little_endian != (sys.byteorder == "little"):
+        raise SnapshotError("Snapshot was taken on a machine with another byte order")
+
+    next_user_id = reader.ints("q")[0]
+    users_ids = reader.ints("q")
+    usernames = reader.strings()
+    passwords = reader.strings()
+    topics_counts = reader.ints("B")
+    all_topics = iter(reader.strings())
+    topics = [tuple(islice(all_topics, count)) if count else () for count in topics_counts]
+    user_records = list(map(tuple.__new__, repeat(UserRecord), zip(users_ids, usernames, passwords, topics)))
+
+    next_chat_id = reader.ints("q")[0]
+    chats_ids = reader.ints("q")
+    members_counts = reader.ints("Q")
+    members = reader.ints("q")
+    starts = accumulate(members_counts, initial=0)
+    chat_records = [
+        ChatRecord(chat_id, members[start:start + count])
+        for chat_id, start, count in zip(chats_ids, starts, members_counts)
+    ]
+
+    tokens = reader.strings()
+    sessions_users_ids = reader.ints("q")
+    time_left = reader.floats()
+    now = clock()
+    expires_after = now - (time.time() - taken_at)
+
+    logs_chats_ids = reader.ints("q")
+    last_ids = reader.ints("q")
+    messages_counts = reader.ints("Q")
+    ids = reader.ints("q")
+    authors_ids = reader.ints("q")
+    times = reader.floats()
+    texts = reader.strings()
+
+    users.load(user_records, next_user_id)
+    chats.load(chat_records, next_chat_id)
+    sessions.clear()
+    sessions.update(
+        (token, Session(user_id, expires_after + left))
+        for token, user_id, left in zip(tokens, sessions_users_ids, time_left)
+        if expires_after + left > now
+    )
+
+    messages.clear()
+    starts = accumulate(messages_counts, initial=0)
+    for chat_id, last_id, start, count in zip(logs_chats_ids, last_ids, starts, messages_counts):
+        try:
+            log = new_log(chat_id)
+            log.restore(
+                Message(text=texts[i], id=ids[i], chat_id=chat_id, author_id=authors_ids[i], created_at=times[i])
+                for i in range(start, start + count)
+            )
+        except SegmentError as error:
+            raise SnapshotError(str(error)) from error
+
+        if log.last_id < last_id:
+            raise SnapshotError(f"Messages of chat {chat_id} after {log.last_id} are missing")
+        messages[chat_id] = log
+
+    return SnapshotStats(len(user_records), len(chat_records), len(sessions), len(ids))
+
+
+def snapshot_stores(path: Path) -> SnapshotStats:
+    return write_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB)
+
+
+def restore_stores(path: Path, message_crud: RAMMessageCrud) -> SnapshotStats | None:
+    """Loads the snapshot at path into the RAM stores, if there is one, with the segments of message_crud"""
+
+    if not path.exists():
+        return None
+
+    def new_log(chat_id: int) -> MessageLog:
+        return MessageLog(chat_id, message_crud.segment_size, message_crud.directory)
+
+    stats = load_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, new_log)
+    logger.info("Restored %s users, %s chats, %s sessions and %s messages from %s", *stats, path)
+    return stats
+
+
+class Snapshotter:
+    """
+    Takes snapshots in a forked child. The last pause is the time the fork took, the last duration
+    the time until the child was done. The GC is off in the child, so it doesn't copy every page it visits.
+    At most one child runs at a time, whatever the number of threads using it.
+    """
+
+    def __init__(self, path: Path, write: Callable[[Path], object], poll_interval: float = 0.05) -> None:
+        self.path = path
+        self.write = write
+        self.poll_interval = poll_interval
+        self.taken = 0
+        self.failed = 0
+        self.last_pause = 0.0
+        self.last_duration = 0.0
+        self._pid: int | None = None
+        self._started_at = 0.0
+        self._lock = threading.RLock()
+
+    @property
+    def running(self) -> bool:
+        return self._pid is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._pid is not None:
+                return
+
+            start = time.perf_counter()
+            pid = os.fork()
+
+            if pid == 0:
+                code = 1
+                try:
+                    gc.disable()
+                    self.write(self.path)
+                    code = 0
+                finally:
+                    os._exit(code)
+
+            self._pid = pid
+            self._started_at = start
+            self.last_pause = time.perf_counter() - start
+
+    def poll(self) -> bool:
+        """Whether the running snapshot, if any, is done"""
+
+        return self._reap(os.WNOHANG)
+
+    def wait(self) -> None:
+        self._reap(0)
+
+    def take(self) -> None:
+        """Takes a snapshot and waits for it, after the running one if any"""
+
+        with self._lock:
+            self.wait()
+            self.start()
+            self.wait()
+
+    async def run(self) -> None:
+        self.start()
+        while not self.poll():
+            await asyncio.sleep(self.poll_interval)
+
+    def _reap(self, options: int) -> bool:
+        with self._lock:
+            if self._pid is None:
+                return True
+
+            pid, status = os.waitpid(self._pid, options)
+            if pid == 0:
+                return False
+
+            self._pid = None
+            self.last_duration = time.perf_counter() - self._started_at
+            if os.waitstatus_to_exitcode(status) == 0:
+                self.taken += 1
+            else:
+                self.failed += 1
+                logger.error("Snapshot to %s failed", self.path)
+            return True
@@ -1,68 +1,310 @@
+import itertools
+import json
+import random
+import sqlite3
+import threading
+import time
+from array import array
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from dataclasses import asdict
-from typing import Container
+from operator import itemgetter
+from typing import Callable, Container, Iterable, Iterator, NamedTuple
 
-# from sqlalchemy import select
-# from sqlalchemy.orm import Session
 # from redis import Redis
 
-# from . import models
 from . import schema
+from .exceptions import UserAlreadyExists
+from .topics import TopicIndex
+from ..database import SQLiteConnectionPool
+from ..locks import StripedLock
+from ..sampling import sample_excluding
 
 
-# class PostgresUserCrud:
-#     def __init__(self, session: Session) -> None:
-#         self.db = session
-#
-#     def get_user_by_id(self, user_id: int) -> models.User | None:
-#         return self.db.get(models.User, user_id)
-#
-#     def get_user_by_username(self, username: str) -> models.User | None:
-#         return self.db.scalar(select(models.User).where(models.User.username == username))
-#
-#     def create_user(self, user: schema.UserIn) -> models.User:
-#         user_model = models.User(**asdict(user))
-#
-#         self.db.add(user_model)
-#
-#         self.db.commit()
-#         self.db.refresh(user_model)
-#
-#         return user_model
+class UserRecord(NamedTuple):
+    id: int
+    username: str
+    hashed_password: str
+    topics: tuple[str, ...] = ()
+
+    def to_schema(self) -> schema.User:
+        return schema.User(
+            id=self.id, username=self.username, hashed_password=self.hashed_password, topics=list(self.topics),
+        )
+
+
+class UserStorage:
+    """
+    Safe to use from many threads. Ids come from an itertools.count and a username is claimed by a single
+    dict.setdefault, both atomic under the GIL. Replacing a user's record holds the user's stripe of user_locks.
+    """
+
+    def __init__(self) -> None:
+        self.by_id: dict[int, UserRecord] = {}
+        self.by_username: dict[str, UserRecord] = {}
+        self.ids = array("q")
+        self.topics = TopicIndex()
+        self.user_locks = StripedLock()
+        self._ids_counter = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[UserRecord]:
+        return iter(self.by_id.values())
+
+    def next_id(self) -> int:
+        return next(self._ids_counter)
+
+    def add_if_absent(self, user: UserRecord) -> bool:
+        if self.by_username.setdefault(user.username, user) is not user:
+            return False
+
+        self.by_id[user.id] = user
+        self.ids.append(user.id)
+        return True
+
+    def set_topics(self, user_id: int, topics: tuple[str, ...]) -> UserRecord | None:
+        with self.user_locks(user_id):
+            user = self.by_id.get(user_id)
+
+            if user is None:
+                return None
+
+            user = user._replace(topics=topics)
+            self.by_id[user_id] = self.by_username[user.username] = user
+            self.topics.update(user_id, topics)
+            return user
 
-USERS_DB: list[schema.User] = []
+    def load(self, records: list[UserRecord], next_id: int) -> None:
+        """Replaces all users with records in bulk, handing out ids from next_id on. Not safe with concurrent use"""
 
+        self.clear()
+        self.by_id.update(zip(map(itemgetter(0), records), records))
+        self.by_username.update(zip(map(itemgetter(1), records), records))
+        self.ids.extend(map(itemgetter(0), records))
+        self.topics.load((record.id, record.topics) for record in records if record.topics)
+        self._ids_counter = itertools.count(next_id)
 
-class RAMUserCrud:
+    def clear(self) -> None:
+        self.by_id.clear()
+        self.by_username.clear()
+        self.topics.clear()
+        del self.ids[:]
+        self._ids_counter = itertools.count(1)
+
+
+class UserCrud(ABC):
+    @abstractmethod
     def get_user_by_id(self, user_id: int) -> schema.User | None:
-        for user in USERS_DB:
-            if user.id == user_id:
-                return user
-        return None
+        raise NotImplementedError
 
+    @abstractmethod
     def get_user_by_username(self, username: str) -> schema.User | None:
-        for user in USERS_DB:
-            if user.username == username:
-                return user
-        return None
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_users_by_ids(self, users_ids: Iterable[int]) -> list[schema.User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_random_user(self, except_: Container[int]) -> schema.User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_user(self, user_in: schema.UserIn) -> schema.User:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_topics(self, user_id: int, topics: Iterable[str]) -> schema.User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> schema.User | None:
+        raise NotImplementedError
+
+
+USERS_DB = UserStorage()
+
+
+class RAMUserCrud(UserCrud):
+    def get_user_by_id(self, user_id: int) -> schema.User | None:
+        record = USERS_DB.by_id.get(user_id)
+        return record.to_schema() if record else None
+
+    def get_user_by_username(self, username: str) -> schema.User | None:
+        record = USERS_DB.by_username.get(username)
+        return record.to_schema() if record else None
+
+    def get_users_by_ids(self, users_ids: Iterable[int]) -> list[schema.User]:
+        records = (USERS_DB.by_id.get(user_id) for user_id in dict.fromkeys(users_ids))
+        return [record.to_schema() for record in records if record]
+
+    def get_random_user(self, except_: Container[int]) -> schema.User | None:
+        user_id = sample_excluding(USERS_DB.ids, except_)
+        return USERS_DB.by_id[user_id].to_schema() if user_id is not None else None
+
+    def create_user(self, user_in: schema.UserIn) -> schema.User:
+        record = UserRecord(USERS_DB.next_id(), user_in.username, user_in.hashed_password)
+
+        if not USERS_DB.add_if_absent(record):
+            raise UserAlreadyExists("Username already occupied")
+
+        return record.to_schema()
+
+    def set_topics(self, user_id: int, topics: Iterable[str]) -> schema.User | None:
+        record = USERS_DB.set_topics(user_id, tuple(topics))
+        return record.to_schema() if record else None
+
+    def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> schema.User | None:
+        user_id = USERS_DB.topics.best_match(topics, except_)
+        return USERS_DB.by_id[user_id].to_schema() if user_id is not None else None
+
+
+class SQLiteUserCrud(UserCrud):
+    RANDOM_USER_ATTEMPTS = 16
+    MATCH_SAMPLE_SIZE = 64
+
+    SELECT_USER = (
+        "SELECT id, username, hashed_password, "
+        "(SELECT group_concat(topic, char(10)) FROM "
+        "(SELECT topic FROM user_topics WHERE user_id = users.id ORDER BY position)) "
+        "FROM users"
+    )
+
+    def __init__(self, pool: SQLiteConnectionPool) -> None:
+        self.pool = pool
+
+    def get_user_by_id(self, user_id: int) -> schema.User | None:
+        with self.pool.connection() as connection:
+            return self._get_by_id(connection, user_id)
+
+    def get_user_by_username(self, username: str) -> schema.User | None:
+        with self.pool.connection() as connection:
+            row = connection.execute(f"{self.SELECT_USER} WHERE username = ?", (username,)).fetchone()
+
+        return self._user(row) if row else None
+
+    def get_users_by_ids(self, users_ids: Iterable[int]) -> list[schema.User]:
+        """Found users in the order of users_ids, in a single query whatever the number of ids"""
+
+        users_ids = list(dict.fromkeys(users_ids))
+
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                f"{self.SELECT_USER} WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(users_ids),)
+            ).fetchall()
+
+        users = {row[0]: self._user(row) for row in rows}
+        return [users[user_id] for user_id in users_ids if user_id in users]
 
     def get_random_user(self, except_: Container[int]) -> schema.User | None:
-        for user in USERS_DB:
-            if user.id not in except_:
-                return user
+        """
+        Probes random ids, which is uniform while ids are dense, then takes the first user not excepted
+        at or after a random id, wrapping around, with index seeks rather than a read of every id
+        """
+
+        with self.pool.connection() as connection:
+            max_id = connection.execute("SELECT max(id) FROM users").fetchone()[0]
+
+            if max_id is None:
+                return None
+
+            for _ in range(self.RANDOM_USER_ATTEMPTS):
+                user_id = random.randint(1, max_id)
+                if user_id in except_:
+                    continue
+
+                user = self._get_by_id(connection, user_id)
+                if user:
+                    return user
+
+            pivot = random.randint(1, max_id)
+            for query in (
+                "SELECT id FROM users WHERE id >= ? ORDER BY id",
+                "SELECT id FROM users WHERE id < ? ORDER BY id",
+            ):
+                for (user_id,) in connection.execute(query, (pivot,)):
+                    if user_id not in except_:
+                        return self._get_by_id(connection, user_id)
 
         return None
 
     def create_user(self, user_in: schema.UserIn) -> schema.User:
-        user_id = max(user.id for user in USERS_DB) + 1 if USERS_DB else 1
-        user = schema.User(id=user_id, **asdict(user_in))
-        USERS_DB.append(user)
-        return user
+        try:
+            with self.pool.connection() as connection, connection:
+                cursor = connection.execute(
+                    "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+                    (user_in.username, user_in.hashed_password),
+                )
+        except sqlite3.IntegrityError:
+            raise UserAlreadyExists("Username already occupied")
+
+        assert cursor.lastrowid is not None
+        return schema.User(id=cursor.lastrowid, **asdict(user_in))
+
+    def set_topics(self, user_id: int, topics: Iterable[str]) -> schema.User | None:
+        with self.pool.connection() as connection, connection:
+            if not connection.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone():
+                return None
+
+            connection.execute("DELETE FROM user_topics WHERE user_id = ?", (user_id,))
+            connection.executemany(
+                "INSERT INTO user_topics (user_id, position, topic) VALUES (?, ?, ?)",
+                [(user_id, position, topic) for position, topic in enumerate(topics)],
+            )
+            return self._get_by_id(connection, user_id)
+
+    def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> schema.User | None:
+        """Same sampling as TopicIndex.best_match, over windows of each topic's index starting at a random user id"""
+
+        topics = list(topics)
+
+        with self.pool.connection() as connection:
+            max_id = connection.execute("SELECT max(id) FROM users").fetchone()[0]
+
+            if max_id is None or not topics:
+                return None
+
+            candidates: set[int] = set()
+            for topic in topics:
+                start = random.randint(1, max_id)
+                rows = connection.execute(
+                    "SELECT user_id FROM user_topics WHERE topic = ? AND user_id >= ? ORDER BY user_id LIMIT ?",
+                    (topic, start, self.MATCH_SAMPLE_SIZE),
+                ).fetchall()
+                if len(rows) < self.MATCH_SAMPLE_SIZE:
+                    rows += connection.execute(
+                        "SELECT user_id FROM user_topics WHERE topic = ? AND user_id < ? ORDER BY user_id LIMIT ?",
+                        (topic, start, self.MATCH_SAMPLE_SIZE - len(rows)),
+                    ).fetchall()
+                candidates.update(user_id for user_id, in rows if user_id not in except_)
+
+            if not candidates:
+                return None
+
+            row = connection.execute(
+                f"SELECT user_id FROM user_topics "
+                f"WHERE user_id IN ({', '.join('?' * len(candidates))}) AND topic IN ({', '.join('?' * len(topics))}) "
+                f"GROUP BY user_id ORDER BY count(*) DESC, user_id LIMIT 1",
+                (*candidates, *topics),
+            ).fetchone()
+
+            return self._get_by_id(connection, row[0])
+
+    def _get_by_id(self, connection: sqlite3.Connection, user_id: int) -> schema.User | None:
+        row = connection.execute(f"{self.SELECT_USER} WHERE id = ?", (user_id,)).fetchone()
+        return self._user(row) if row else None
+
+    @staticmethod
+    def _user(row: tuple[int, str, str, str | None]) -> schema.User:
+        topics = row[3].split("\n") if row[3] else []
+        return schema.User(id=row[0], username=row[1], hashed_password=row[2], topics=topics)
 
 
 class SessionCrud(ABC):
     @abstractmethod
-    def get_user_id(self, token: str) -> int:
+    def get_user_id(self, token: str) -> int | None:
         raise NotImplementedError
 
     @abstractmethod
@@ -77,25 +319,186 @@ class SessionCrud(ABC):
     def delete_session(self, token: str) -> None:
         raise NotImplementedError
 
+    @abstractmethod
+    def sweep(self, limit: int) -> int:
+        raise NotImplementedError
+
 
 Token = str
 UserID = int
 
-SESSIONS_DB: dict[Token, UserID] = {}
+
+class Session(NamedTuple):
+    user_id: UserID
+    expires_at: float
+
+
+SESSIONS_DB: OrderedDict[Token, Session] = OrderedDict()
 
 
 class RAMSessionCrud(SessionCrud):
+    """
+    Every session lives for the same ttl, so SESSIONS_DB insertion order is also expiry order
+    and expired sessions are always at its front.
+
+    Lookups don't lock. Anything reordering or removing sessions holds the lock, as the order is
+    one structure shared by all sessions.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self._lock = threading.Lock()
+
     def session_exists(self, token: Token) -> bool:
-        return token in SESSIONS_DB
+        return self.get_user_id(token) is not None
 
-    def get_user_id(self, token: Token) -> UserID:
-        return SESSIONS_DB[token]
+    def get_user_id(self, token: Token) -> UserID | None:
+        session = SESSIONS_DB.get(token)
+
+        if session is None:
+            return None
+
+        if session.expires_at <= self.clock():
+            self.delete_session(token)
+            return None
+
+        return session.user_id
 
     def add_session(self, token: Token, user_id: UserID) -> None:
-        SESSIONS_DB[token] = user_id
+        with self._lock:
+            self._sweep(limit=2)
+
+            SESSIONS_DB[token] = Session(user_id, self.clock() + self.ttl)
+            SESSIONS_DB.move_to_end(token)
+
+            while len(SESSIONS_DB) > self.max_sessions:
+                SESSIONS_DB.popitem(last=False)
 
     def delete_session(self, token: Token) -> None:
-        del SESSIONS_DB[token]
+        with self._lock:
+            SESSIONS_DB.pop(token, None)
+
+    def sweep(self, limit: int) -> int:
+        with self._lock:
+            return self._sweep(limit)
+
+    def _sweep(self, limit: int) -> int:
+        now = self.clock()
+        swept = 0
+
+        while swept < limit and SESSIONS_DB:
+            token, session = next(iter(SESSIONS_DB.items()))
+            if session.expires_at > now:
+                break
+
+            del SESSIONS_DB[token]
+            swept += 1
+
+        return swept
+
+
+class SQLiteSessionCrud(SessionCrud):
+    def __init__(self, pool: SQLiteConnectionPool, ttl: float, clock: Callable[[], float] = time.time) -> None:
+        self.pool = pool
+        self.ttl = ttl
+        self.clock = clock
+
+    def session_exists(self, token: Token) -> bool:
+        return self.get_user_id(token) is not None
+
+    def get_user_id(self, token: Token) -> UserID | None:
+        with self.pool.connection() as connection:
+            row = connection.execute("SELECT user_id, expires_at FROM sessions WHERE token = ?", (token,)).fetchone()
+
+            if row is None:
+                return None
+
+            user_id, expires_at = row
+            if expires_at <= self.clock():
+                with connection:
+                    connection.execute("DELETE FROM sessions WHERE token = ?", (token,))
+                return None
+
+        return int(user_id)
+
+    def add_session(self, token: Token, user_id: UserID) -> None:
+        with self.pool.connection() as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (token, user_id, expires_at) VALUES (?, ?, ?)",
+                (token, user_id, self.clock() + self.ttl),
+            )
+
+    def delete_session(self, token: Token) -> None:
+        with self.pool.connection() as connection, connection:
+            connection.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def sweep(self, limit: int) -> int:
+        with self.pool.connection() as connection, connection:
+            cursor = connection.execute(
+                "DELETE FROM sessions WHERE token IN "
+                "(SELECT token FROM sessions WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)",
+                (self.clock(), limit),
+            )
+
+        return cursor.rowcount
+
+
+class Revocation(NamedTuple):
+    sequence: int
+    token_id: int
+    expires_at: float
+
+
+class RevocationCrud(ABC):
+    """
+    Log of revoked signed tokens, numbered in order, so workers pull the ones after the last they saw.
+    A revocation is only kept until its token expires.
+    """
+
+    @abstractmethod
+    def add_revocation(self, token_id: int, expires_at: float) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_revocations(self, after: int) -> list[Revocation]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def sweep(self, limit: int) -> int:
+        raise NotImplementedError
+
+
+class SQLiteRevocationCrud(RevocationCrud):
+    def __init__(self, pool: SQLiteConnectionPool, clock: Callable[[], float] = time.time) -> None:
+        self.pool = pool
+        self.clock = clock
+
+    def add_revocation(self, token_id: int, expires_at: float) -> None:
+        with self.pool.connection() as connection, connection:
+            connection.execute(
+                "INSERT INTO revocations (token_id, expires_at) VALUES (?, ?)", (token_id, expires_at),
+            )
+
+    def get_revocations(self, after: int) -> list[Revocation]:
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                "SELECT sequence, token_id, expires_at FROM revocations WHERE sequence > ? ORDER BY sequence",
+                (after,),
+            ).fetchall()
+
+        return [Revocation(*row) for row in rows]
+
+    def sweep(self, limit: int) -> int:
+        with self.pool.connection() as connection, connection:
+            cursor = connection.execute(
+                "DELETE FROM revocations WHERE sequence IN "
+                "(SELECT sequence FROM revocations WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)",
+                (self.clock(), limit),
+            )
+
+        return cursor.rowcount
 
 
 # class RedisSessionCrud(SessionCrud):
@@ -1,17 +1,20 @@
-from typing import Annotated, Type
+from typing import Annotated
 from dataclasses import asdict
 
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, HTTPException, status
+from fastapi.requests import HTTPConnection
 from passlib.ifc import PasswordHash
 
 from .schema import User, RawUserIn, UserIn
 from .service import UserService
-from .security import SessionProvider, AuthenticationError
+from .security import SessionProvider, AuthenticationError, AuthCache
+from .presence import PresenceTracker
+from .hashing import PasswordHasherPool, HasherOverloaded
 from ..dependencies import Stub
 
 
-def get_session_id(request: Request) -> str:
-    auth_cookie = request.cookies.get("Authorization")
+async def get_session_id(connection: HTTPConnection) -> str:
+    auth_cookie = connection.cookies.get("Authorization")
 
     if not auth_cookie:
         raise HTTPException(
@@ -23,21 +26,29 @@ def get_session_id(request: Request) -> str:
     return session_id
 
 
-def get_current_user(
+async def get_current_user(
         user_service: Annotated[UserService, Depends(Stub(UserService))],
         session_provider: Annotated[SessionProvider, Depends(Stub(SessionProvider))],
+        auth_cache: Annotated[AuthCache, Depends(Stub(AuthCache))],
+        presence: Annotated[PresenceTracker, Depends(Stub(PresenceTracker))],
         session_id: Annotated[str, Depends(get_session_id)]
 ) -> User:
 
+    cached_user = auth_cache.get(session_id)
+
+    if cached_user:
+        presence.touch(cached_user.id)
+        return cached_user
+
     try:
-        user_id = session_provider.validate_token(session_id)
+        user_id = await session_provider.validate_token(session_id)
     except AuthenticationError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
         )
 
-    user = user_service.get_user_by_id(user_id)
+    user = await user_service.get_user_by_id(user_id)
 
     if not user:
         raise HTTPException(
@@ -45,13 +56,24 @@ def get_current_user(
             detail="Invalid authentication credentials",
         )
 
+    auth_cache.put(session_id, user)
+    presence.touch(user.id)
     return user
 
 
-def get_user_in(
-        password_hasher: Annotated[Type[PasswordHash], Depends(Stub(PasswordHash))],
+async def get_user_in(
+        password_hasher: Annotated[PasswordHasherPool, Depends(Stub(PasswordHash))],
         raw_user: RawUserIn
 ) -> UserIn:
     user_data = asdict(raw_user)
-    user_data["hashed_password"] = password_hasher.hash(user_data.pop("password"))
+
+    try:
+        user_data["hashed_password"] = await password_hasher.hash(user_data.pop("password"))
+    except HasherOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service overloaded",
+            headers={"Retry-After": "1"},
+        )
+
     return UserIn(**user_data)
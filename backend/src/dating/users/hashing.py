@@ -0,0 +1,90 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Type, TypeVar
+
+from passlib.ifc import PasswordHash
+
+
+T = TypeVar("T")
+
+
+class HasherOverloaded(RuntimeError):
+    pass
+
+
+@dataclass
+class HashingStats:
+    in_flight: int
+    queued: int
+    rejected: int
+    calls: int
+    total_seconds: float
+    max_seconds: float
+
+
+class PasswordHasherPool:
+    """
+    Runs a passlib hasher on a dedicated, size-limited thread pool.
+
+    argon2 releases the GIL while hashing, so worker threads hash in parallel without holding up the event loop
+    or the request threadpool. At most max_pending calls are accepted at once, the rest fail with HasherOverloaded.
+    """
+
+    def __init__(self, hasher: Type[PasswordHash], max_workers: int, max_pending: int) -> None:
+        self.hasher = hasher
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="password-hasher")
+        self._lock = Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._calls = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+
+    async def hash(self, secret: str) -> str:
+        return await self._run(self.hasher.hash, secret)
+
+    async def verify(self, secret: str, hashed: str) -> bool:
+        return await self._run(self.hasher.verify, secret, hashed)
+
+    def stats(self) -> HashingStats:
+        with self._lock:
+            return HashingStats(
+                in_flight=self._in_flight,
+                queued=max(self._in_flight - self.max_workers, 0),
+                rejected=self._rejected,
+                calls=self._calls,
+                total_seconds=self._total_seconds,
+                max_seconds=self._max_seconds,
+            )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+
+    async def _run(self, func: Callable[..., T], *args: str) -> T:
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self._rejected += 1
+                raise HasherOverloaded("Too many pending password hashing calls")
+            self._in_flight += 1
+
+        try:
+            return await asyncio.wrap_future(self._executor.submit(self._timed, func, *args))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _timed(self, func: Callable[..., T], *args: str) -> T:
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._calls += 1
+                self._total_seconds += elapsed
+                self._max_seconds = max(self._max_seconds, elapsed)
@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Container
+
+from ..sampling import sample_excluding
+
+
+class PresenceTracker:
+    """
+    Users active in the last ttl seconds, or with an open WebSocket.
+
+    Every heartbeat moves the user to the end of last_seen, so it's ordered by activity and expired users are
+    always at its front. Online ids are also kept in a list with their positions, for O(1) removal and random
+    picks. Only used from the event loop.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self._last_seen: OrderedDict[int, float] = OrderedDict()
+        self._connections: dict[int, int] = {}
+        self._ids: list[int] = []
+        self._positions: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._positions
+
+    def touch(self, user_id: int) -> None:
+        self._last_seen[user_id] = self.clock()
+        self._last_seen.move_to_end(user_id)
+        self._add(user_id)
+
+    def connect(self, user_id: int) -> None:
+        self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        self.touch(user_id)
+
+    def disconnect(self, user_id: int) -> None:
+        connections = self._connections.get(user_id, 0) - 1
+
+        if connections > 0:
+            self._connections[user_id] = connections
+        else:
+            self._connections.pop(user_id, None)
+            self.touch(user_id)
+
+    def random_online(self, except_: Container[int]) -> int | None:
+        return sample_excluding(self._ids, except_)
+
+    def sweep(self, limit: int) -> int:
+        expired_before = self.clock() - self.ttl
+        swept = 0
+
+        while swept < limit and self._last_seen:
+            user_id, last_seen = next(iter(self._last_seen.items()))
+            if last_seen > expired_before:
+                break
+
+            del self._last_seen[user_id]
+            if user_id not in self._connections:
+                self._remove(user_id)
+            swept += 1
+
+        return swept
+
+    def _add(self, user_id: int) -> None:
+        if user_id not in self._positions:
+            self._positions[user_id] = len(self._ids)
+            self._ids.append(user_id)
+
+    def _remove(self, user_id: int) -> None:
+        position = self._positions.pop(user_id)
+        last = self._ids.pop()
+        if last != user_id:
+            self._ids[position] = last
+            self._positions[last] = position
@@ -1,87 +1,127 @@
-from dataclasses import asdict
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from passlib.ifc import PasswordHash
 
-from .schema import UserIn, UserOut, User, LoginData
+from .schema import UserIn, UserOut, User, LoginData, TopicsIn
 from .service import UserService
-from .security import SESSION_EXPIRATION_TIME, SessionProvider
+from .security import SESSION_EXPIRATION_TIME, SessionProvider, AuthCache
 from .dependencies import get_current_user, get_session_id, get_user_in
 from .exceptions import UserAlreadyExists
-from ..dependencies import Stub, Dataclass
+from .hashing import PasswordHasherPool, HasherOverloaded
+from ..dependencies import Stub
+from ..schema import MAX_BATCH_SIZE
+from ..serialization import json_response, json_list_response
 
 
 users_router = APIRouter(tags=["users"], prefix="/users")
 
 
 @users_router.get("/me", response_model=UserOut)
-def get_me(
+async def get_me(
         current_user: Annotated[User, Depends(get_current_user)]
-) -> Dataclass:
+) -> Response:
 
-    return asdict(current_user)
+    return json_response(UserOut, current_user)
+
+
+@users_router.put("/me/topics", response_model=UserOut)
+async def set_my_topics(
+        user_service: Annotated[UserService, Depends(Stub(UserService))],
+        auth_cache: Annotated[AuthCache, Depends(Stub(AuthCache))],
+        current_user: Annotated[User, Depends(get_current_user)],
+        topics_in: TopicsIn,
+) -> Response:
+
+    user = await user_service.set_topics(current_user.id, topics_in.topics)
+
+    if not user:
+        raise HTTPException(status_code=404)
+
+    auth_cache.invalidate_user(user.id)
+    return json_response(UserOut, user)
+
+
+@users_router.get("/", response_model=list[UserOut], description="Users found by ids, in the order of ids")
+async def get_users(
+        user_service: Annotated[UserService, Depends(Stub(UserService))],
+        ids: Annotated[list[int], Query(max_length=MAX_BATCH_SIZE)],
+) -> Response:
+
+    users = await user_service.get_users_by_ids(ids)
+    return json_list_response(UserOut, users)
 
 
 @users_router.get("/{user_id}", response_model=UserOut)
-def get_user(
+async def get_user(
         user_service: Annotated[UserService, Depends(Stub(UserService))],
         user_id: int
-) -> Dataclass:
+) -> Response:
 
-    user = user_service.get_user_by_id(user_id)
+    user = await user_service.get_user_by_id(user_id)
 
     if not user:
         raise HTTPException(status_code=404)
 
-    return asdict(user)
+    return json_response(UserOut, user)
 
 
 @users_router.post("/", response_model=UserOut, status_code=status.HTTP_201_CREATED)
-def register(
+async def register(
         user_service: Annotated[UserService, Depends(Stub(UserService))],
         user_in: Annotated[UserIn, Depends(get_user_in)],
-) -> Dataclass:
+) -> Response:
 
     try:
-        user = user_service.register(user_in)
+        user = await user_service.register(user_in)
     except UserAlreadyExists:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User already exists")
 
-    return asdict(user)
+    return json_response(UserOut, user, status_code=status.HTTP_201_CREATED)
 
 
 @users_router.post("/login")
-def login(
+async def login(
         user_service: Annotated[UserService, Depends(Stub(UserService))],
         session_provider: Annotated[SessionProvider, Depends(Stub(SessionProvider))],
-        password_hasher: Annotated[PasswordHash, Depends(Stub(PasswordHash))],
+        password_hasher: Annotated[PasswordHasherPool, Depends(Stub(PasswordHash))],
         user_data: LoginData,
         response: Response,
 ) -> str:
 
-    requested_user = user_service.get_user_by_username(user_data.username)
+    requested_user = await user_service.get_user_by_username(user_data.username)
 
     if not requested_user:  # TODO: all this logic to specific components
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
-    if not password_hasher.verify(user_data.password, requested_user.hashed_password):
+    try:
+        password_is_valid = await password_hasher.verify(user_data.password, requested_user.hashed_password)
+    except HasherOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service overloaded",
+            headers={"Retry-After": "1"},
+        )
+
+    if not password_is_valid:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
-    session_id = session_provider.create_token(requested_user.id)
+    session_id = await session_provider.create_token(requested_user.id)
     response.set_cookie(key="Authorization", value=f"Basic {session_id}", expires=SESSION_EXPIRATION_TIME)
 
     return "success"
 
 
 @users_router.post("/logout")
-def logout(
+async def logout(
         session_id: Annotated[str, Depends(get_session_id)],
         session_provider: Annotated[SessionProvider, Depends(Stub(SessionProvider))],
+        auth_cache: Annotated[AuthCache, Depends(Stub(AuthCache))],
         response: Response,
 ) -> str:
 
     response.delete_cookie("Authorization")
-    session_provider.expire_token(session_id)
-    
+    auth_cache.invalidate(session_id)
+    await session_provider.expire_token(session_id)
+
     return "success"
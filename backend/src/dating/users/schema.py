@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
+from .topics import normalize_topics
 from ..schema import BaseSchema
 
 
@@ -12,6 +13,7 @@ class UserBase(BaseSchema):
 class User(UserBase):
     id: int
     hashed_password: str
+    topics: list[str] = field(default_factory=list)
 
 
 @dataclass
@@ -35,6 +37,15 @@ class UserIn(UserBase):
 @dataclass
 class UserOut(UserBase):
     id: int
+    topics: list[str] = field(default_factory=list)
+
+
+@dataclass
+class TopicsIn:
+    topics: list[str]
+
+    def __post_init__(self) -> None:
+        self.topics = list(normalize_topics(self.topics))
 
 
 @dataclass
@@ -1,28 +1,259 @@
+import binascii
+import hashlib
+import heapq
+import hmac
+import secrets
+import struct
+import time
+from abc import ABC, abstractmethod
+from base64 import urlsafe_b64encode
+from collections import OrderedDict
+from typing import Callable, NamedTuple, TypeVar
 from uuid import uuid4
 
-from .crud import SessionCrud
+from starlette.concurrency import run_in_threadpool
+
+from .crud import RevocationCrud, SessionCrud
+from .schema import User
 
 
 SESSION_EXPIRATION_TIME = 60 * 60 * 24 * 7
 
+T = TypeVar("T")
+
 
 class AuthenticationError(ValueError):
     pass
 
 
-class SessionProvider:
-    def __init__(self, crud: SessionCrud) -> None:
+class SessionProvider(ABC):
+    def __init__(self, offload: bool = False) -> None:
+        self.offload = offload
+
+    @abstractmethod
+    async def create_token(self, user_id: int) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def validate_token(self, token: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def expire_token(self, token: str) -> None:
+        raise NotImplementedError
+
+    async def _call(self, func: Callable[..., T], *args: object) -> T:
+        if self.offload:
+            return await run_in_threadpool(func, *args)
+        return func(*args)
+
+
+class StoredSessionProvider(SessionProvider):
+    def __init__(self, crud: SessionCrud, offload: bool = False) -> None:
+        super().__init__(offload)
         self.crud = crud
 
-    def create_token(self, user_id: int) -> str:
+    async def create_token(self, user_id: int) -> str:
         token = str(uuid4())
-        self.crud.add_session(token, user_id)
+        await self._call(self.crud.add_session, token, user_id)
         return token
 
-    def validate_token(self, token: str) -> int:
-        if not self.crud.session_exists(token):
+    async def validate_token(self, token: str) -> int:
+        user_id = await self._call(self.crud.get_user_id, token)
+
+        if user_id is None:
+            raise AuthenticationError
+
+        return user_id
+
+    async def expire_token(self, token: str) -> None:
+        await self._call(self.crud.delete_session, token)
+
+
+class TokenDenylist:
+    """
+    Ids of revoked signed tokens, each kept only until its token expires, as an expired token is rejected anyway.
+    So it holds at most the tokens revoked during one token lifetime, as ints in a dict and a heap by expiry.
+    Only used from the event loop.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self.clock = clock
+        self._expires_at: dict[int, float] = {}
+        self._expiry: list[tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._expires_at)
+
+    def __contains__(self, token_id: object) -> bool:
+        return token_id in self._expires_at
+
+    def revoke(self, token_id: int, expires_at: float) -> None:
+        if expires_at <= self.clock() or token_id in self._expires_at:
+            return
+
+        self._expires_at[token_id] = expires_at
+        heapq.heappush(self._expiry, (expires_at, token_id))
+
+    def sweep(self, limit: int) -> int:
+        now = self.clock()
+        swept = 0
+
+        while swept < limit and self._expiry and self._expiry[0][0] <= now:
+            _, token_id = heapq.heappop(self._expiry)
+            del self._expires_at[token_id]
+            swept += 1
+
+        return swept
+
+
+class SignedSessionProvider(SessionProvider):
+    """
+    Tokens carrying their own id, user id and expiry, signed with HMAC-SHA256, so validating one needs no store.
+    Payload and signature, truncated to 24 bytes, are a single urlsafe base64 blob of 64 characters, decoded at once.
+
+    A token can't be taken back, so logging out puts its id in the denylist, which is only consulted for tokens
+    with a valid signature that haven't expired yet. With revocations, logouts are also recorded in the store
+    and sync_revocations pulls the ones of other workers, so they apply everywhere within its interval.
+    """
+
+    PAYLOAD = struct.Struct(">qqq")  # token id, user id, expires at
+    SIGNATURE_SIZE = 24
+
+    def __init__(
+            self,
+            secret: bytes,
+            ttl: float,
+            denylist: TokenDenylist,
+            revocations: RevocationCrud | None = None,
+            offload: bool = False,
+            clock: Callable[[], float] = time.time,
+    ) -> None:
+        super().__init__(offload)
+        self.ttl = ttl
+        self.denylist = denylist
+        self.revocations = revocations
+        self.clock = clock
+        self._synced_up_to = 0
+
+        # Keyed once, copies skip hashing the padded key on every token
+        self._mac = hmac.new(secret, digestmod=hashlib.sha256)
+
+    async def create_token(self, user_id: int) -> str:
+        payload = self.PAYLOAD.pack(secrets.randbits(63), user_id, int(self.clock() + self.ttl))
+        return urlsafe_b64encode(payload + self._sign(payload)).decode()
+
+    async def validate_token(self, token: str) -> int:
+        token_id, user_id, _ = self._verify(token)
+
+        if token_id in self.denylist:
             raise AuthenticationError
-        return self.crud.get_user_id(token)
 
-    def expire_token(self, token: str) -> None:
-        self.crud.delete_session(token)
+        return user_id
+
+    async def expire_token(self, token: str) -> None:
+        try:
+            token_id, _, expires_at = self._verify(token)
+        except AuthenticationError:
+            return
+
+        self.denylist.revoke(token_id, expires_at)
+        if self.revocations is not None:
+            await self._call(self.revocations.add_revocation, token_id, expires_at)
+
+    async def sync_revocations(self) -> None:
+        """Adds the revocations recorded since the last sync to the denylist"""
+
+        if self.revocations is None:
+            return
+
+        for sequence, token_id, expires_at in await self._call(
+                self.revocations.get_revocations, self._synced_up_to,
+        ):
+            self.denylist.revoke(token_id, expires_at)
+            self._synced_up_to = sequence
+
+    def _verify(self, token: str) -> tuple[int, int, int]:
+        """Returns the token id, user id and expiry of a token signed by us that hasn't expired"""
+
+        try:
+            data = binascii.a2b_base64(token.replace("-", "+").replace("_", "/"), strict_mode=True)
+        except (binascii.Error, ValueError):
+            raise AuthenticationError
+
+        payload, signature = data[:self.PAYLOAD.size], data[self.PAYLOAD.size:]
+        if len(signature) != self.SIGNATURE_SIZE or not hmac.compare_digest(signature, self._sign(payload)):
+            raise AuthenticationError
+
+        token_id, user_id, expires_at = self.PAYLOAD.unpack(payload)
+        if expires_at <= self.clock():
+            raise AuthenticationError
+
+        return token_id, user_id, expires_at
+
+    def _sign(self, payload: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(payload)
+        return mac.digest()[:self.SIGNATURE_SIZE]
+
+
+class CachedUser(NamedTuple):
+    user: User
+    expires_at: float
+
+
+class AuthCache:
+    """
+    Users resolved from session tokens, kept for at most ttl seconds and evicted least recently used first.
+
+    The ttl bounds how long a token keeps working in a worker that didn't see its logout or its user's change,
+    as other workers of shared storage can't invalidate this cache. Only used from the event loop.
+    """
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._users: OrderedDict[str, CachedUser] = OrderedDict()
+        self._tokens: dict[int, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def get(self, token: str) -> User | None:
+        cached = self._users.get(token)
+
+        if cached is None:
+            return None
+
+        if cached.expires_at <= self.clock():
+            self.invalidate(token)
+            return None
+
+        self._users.move_to_end(token)
+        return cached.user
+
+    def put(self, token: str, user: User) -> None:
+        self.invalidate(token)
+        self._users[token] = CachedUser(user, self.clock() + self.ttl)
+        self._tokens.setdefault(user.id, set()).add(token)
+
+        while len(self._users) > self.max_size:
+            self.invalidate(next(iter(self._users)))
+
+    def invalidate(self, token: str) -> None:
+        cached = self._users.pop(token, None)
+
+        if cached is not None:
+            tokens = self._tokens[cached.user.id]
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[cached.user.id]
+
+    def invalidate_user(self, user_id: int) -> None:
+        for token in self._tokens.get(user_id, set()).copy():
+            self.invalidate(token)
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._tokens.clear()
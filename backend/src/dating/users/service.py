@@ -1,15 +1,43 @@
 from abc import ABC, abstractmethod
-from typing import Generator, Callable, Container
+from typing import AsyncGenerator, Callable, Container, Iterable
 
-# from sqlalchemy import Engine
-# from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from .schema import UserIn, User
-from .crud import RAMUserCrud
-from .exceptions import UserAlreadyExists
+from .crud import RAMUserCrud, UserCrud
 
 
 class UserServiceImp(ABC):
+    @abstractmethod
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_by_username(self, username: str) -> User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_users_by_ids(self, users_ids: Iterable[int]) -> list[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_random_user(self, except_: Container[int]) -> User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def register(self, user: UserIn) -> User:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_topics(self, user_id: int, topics: Iterable[str]) -> User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> User | None:
+        raise NotImplementedError
+
+
+class SyncUserServiceImp(ABC):
     @abstractmethod
     def get_user_by_id(self, user_id: int) -> User | None:
         raise NotImplementedError
@@ -18,6 +46,10 @@ class UserServiceImp(ABC):
     def get_user_by_username(self, username: str) -> User | None:
         raise NotImplementedError
 
+    @abstractmethod
+    def get_users_by_ids(self, users_ids: Iterable[int]) -> list[User]:
+        raise NotImplementedError
+
     @abstractmethod
     def get_random_user(self, except_: Container[int]) -> User | None:
         raise NotImplementedError
@@ -26,91 +58,151 @@ class UserServiceImp(ABC):
     def register(self, user: UserIn) -> User:
         raise NotImplementedError
 
+    @abstractmethod
+    def set_topics(self, user_id: int, topics: Iterable[str]) -> User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> User | None:
+        raise NotImplementedError
+
+
+class OffloadedUserServiceImp(UserServiceImp):
+    def __init__(self, implementation: SyncUserServiceImp) -> None:
+        self.imp = implementation
+
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        return await run_in_threadpool(self.imp.get_user_by_id, user_id)
+
+    async def get_user_by_username(self, username: str) -> User | None:
+        return await run_in_threadpool(self.imp.get_user_by_username, username)
+
+    async def get_users_by_ids(self, users_ids: Iterable[int]) -> list[User]:
+        return await run_in_threadpool(self.imp.get_users_by_ids, list(users_ids))
+
+    async def get_random_user(self, except_: Container[int]) -> User | None:
+        return await run_in_threadpool(self.imp.get_random_user, except_)
+
+    async def register(self, user: UserIn) -> User:
+        return await run_in_threadpool(self.imp.register, user)
+
+    async def set_topics(self, user_id: int, topics: Iterable[str]) -> User | None:
+        return await run_in_threadpool(self.imp.set_topics, user_id, list(topics))
+
+    async def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> User | None:
+        return await run_in_threadpool(self.imp.get_best_match, list(topics), except_)
+
 
 class RAMUserServiceImp(UserServiceImp):
     def __init__(self, crud: RAMUserCrud) -> None:
         self.db = crud
 
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        return self.db.get_user_by_id(user_id)
+
+    async def get_user_by_username(self, username: str) -> User | None:
+        return self.db.get_user_by_username(username)
+
+    async def get_users_by_ids(self, users_ids: Iterable[int]) -> list[User]:
+        return self.db.get_users_by_ids(users_ids)
+
+    async def get_random_user(self, except_: Container[int]) -> User | None:
+        return self.db.get_random_user(except_)
+
+    async def register(self, user: UserIn) -> User:
+        return self.db.create_user(user)
+
+    async def set_topics(self, user_id: int, topics: Iterable[str]) -> User | None:
+        return self.db.set_topics(user_id, topics)
+
+    async def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> User | None:
+        return self.db.get_best_match(topics, except_)
+
+
+class CrudUserServiceImp(SyncUserServiceImp):
+    def __init__(self, crud: UserCrud) -> None:
+        self.db = crud
+
     def get_user_by_id(self, user_id: int) -> User | None:
         return self.db.get_user_by_id(user_id)
 
     def get_user_by_username(self, username: str) -> User | None:
         return self.db.get_user_by_username(username)
 
+    def get_users_by_ids(self, users_ids: Iterable[int]) -> list[User]:
+        return self.db.get_users_by_ids(users_ids)
+
     def get_random_user(self, except_: Container[int]) -> User | None:
         return self.db.get_random_user(except_)
 
     def register(self, user: UserIn) -> User:
         return self.db.create_user(user)
 
+    def set_topics(self, user_id: int, topics: Iterable[str]) -> User | None:
+        return self.db.set_topics(user_id, topics)
 
-# class RDBMSUserServiceImp(UserServiceImp):
-#     def __init__(self, crud: UserCrud) -> None:
-#         self.crud = crud
-#
-#     def get_user_by_id(self, user_id: int) -> User | None:
-#         user_model = self.crud.get_user_by_id(user_id)
-#
-#         if not user_model:
-#             return None
-#
-#         return User.from_object(user_model)
-#
-#     def get_user_by_username(self, username: str) -> User | None:
-#         user_model = self.crud.get_user_by_username(username)
-#
-#         if not user_model:
-#             return None
-#
-#         return User.from_object(user_model)
-#
-#     def register(self, user: UserIn) -> User:
-#         user_model = self.crud.create_user(user)
-#         return User.from_object(user_model)
+    def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> User | None:
+        return self.db.get_best_match(topics, except_)
 
 
 class UserService:
     def __init__(self, implementation: UserServiceImp) -> None:
         self.imp = implementation
 
-    def get_user_by_id(self, user_id: int) -> User | None:
-        return self.imp.get_user_by_id(user_id)
+    async def get_user_by_id(self, user_id: int) -> User | None:
+        return await self.imp.get_user_by_id(user_id)
 
-    def get_user_by_username(self, username: str) -> User | None:
-        return self.imp.get_user_by_username(username)
+    async def get_user_by_username(self, username: str) -> User | None:
+        return await self.imp.get_user_by_username(username)
 
-    def get_random_user(self, except_: Container[int]) -> User | None:
-        return self.imp.get_random_user(except_)
+    async def get_users_by_ids(self, users_ids: Iterable[int]) -> list[User]:
+        return await self.imp.get_users_by_ids(users_ids)
 
-    def register(self, user: UserIn) -> User:
-        if not self.get_user_by_username(user.username):
-            return self.imp.register(user)
-        raise UserAlreadyExists("Username already occupied")
+    async def get_random_user(self, except_: Container[int]) -> User | None:
+        return await self.imp.get_random_user(except_)
+
+    async def register(self, user: UserIn) -> User:
+        return await self.imp.register(user)
+
+    async def set_topics(self, user_id: int, topics: Iterable[str]) -> User | None:
+        return await self.imp.set_topics(user_id, topics)
+
+    async def get_best_match(self, topics: Iterable[str], except_: Container[int]) -> User | None:
+        return await self.imp.get_best_match(topics, except_)
 
 
 class UserServiceFactory(ABC):
+    """
+    Services of app_scoped factories keep no per-request state, so create_app builds one for the whole app.
+    Factories whose services need a per-request resource, like a transaction, set app_scoped to False and
+    override create_user_service to acquire and release it.
+    """
+
+    app_scoped = True
+
     @abstractmethod
-    def create_user_service(self) -> Generator[UserService, None, None]:
+    def build_user_service(self) -> UserService:
         raise NotImplementedError
 
+    async def create_user_service(self) -> AsyncGenerator[UserService, None]:
+        yield self.build_user_service()
+
 
 class RAMUserServiceFactory(UserServiceFactory):
     def __init__(self, crud_factory: Callable[[], RAMUserCrud]) -> None:
         self.crud_factory = crud_factory
 
-    def create_user_service(self) -> Generator[UserService, None, None]:
+    def build_user_service(self) -> UserService:
         crud = self.crud_factory()
         imp = RAMUserServiceImp(crud)
-        yield UserService(imp)
-
-
-# class RDBMSUserServiceFactory(UserServiceFactory):
-#     def __init__(self, engine: Engine, crud_factory: Callable[[Session], UserCrud]) -> None:
-#         self.engine = engine
-#         self.crud_factory = crud_factory
-#
-#     def create_user_service(self) -> Generator[UserService, None, None]:
-#         with Session(self.engine) as session:
-#             crud = self.crud_factory(session)
-#             imp = RDBMSUserServiceImp(crud)
-#             yield UserService(imp)
+        return UserService(imp)
+
+
+class OffloadedUserServiceFactory(UserServiceFactory):
+    def __init__(self, crud_factory: Callable[[], UserCrud]) -> None:
+        self.crud_factory = crud_factory
+
+    def build_user_service(self) -> UserService:
+        crud = self.crud_factory()
+        imp = OffloadedUserServiceImp(CrudUserServiceImp(crud))
+        return UserService(imp)
@@ -0,0 +1,145 @@
+import random
+import threading
+from array import array
+from typing import Container, Iterable
+
+
+MAX_TOPICS = 16
+MAX_TOPIC_LENGTH = 64
+
+
+def normalize_topics(topics: Iterable[str]) -> tuple[str, ...]:
+    """Lowercased topics with whitespace collapsed, deduplicated in their original order"""
+
+    normalized: dict[str, None] = {}
+
+    for topic in topics:
+        if not isinstance(topic, str):
+            raise TypeError("Topic must be a string")
+
+        topic = " ".join(topic.lower().split())
+        if not topic or len(topic) > MAX_TOPIC_LENGTH:
+            raise ValueError(f"Topic must have 1 to {MAX_TOPIC_LENGTH} characters")
+
+        normalized[topic] = None
+
+    if len(normalized) > MAX_TOPICS:
+        raise ValueError(f"At most {MAX_TOPICS} topics allowed")
+
+    return tuple(normalized)
+
+
+class TopicIndex:
+    """
+    Inverted index from topic to the users having it, for finding the user sharing most topics with someone.
+
+    Posting lists are append-only arrays of user ids. Changing a user's topics only appends, and entries it makes
+    stale are skipped by checking the user's current topics, then dropped once they are half of their list.
+    A query samples at most sample_size entries per topic, rarest topic first, and scores every sampled user
+    by exact overlap, so it costs O(topics * sample_size) whatever the number of users.
+    """
+
+    def __init__(self, sample_size: int = 64, rng: random.Random | None = None) -> None:
+        self.sample_size = sample_size
+        self._rng = rng or random.Random()
+        self._postings: dict[str, array[int]] = {}
+        self._stale: dict[str, int] = {}
+        self._topics: dict[int, tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._topics)
+
+    def topics(self, user_id: int) -> tuple[str, ...]:
+        return self._topics.get(user_id, ())
+
+    def postings_count(self, topic: str) -> int:
+        return len(self._postings.get(topic, ())) - self._stale.get(topic, 0)
+
+    def update(self, user_id: int, topics: tuple[str, ...]) -> None:
+        with self._lock:
+            old = self._topics.get(user_id, ())
+
+            if topics:
+                self._topics[user_id] = topics
+            else:
+                self._topics.pop(user_id, None)
+
+            for topic in set(old).difference(topics):
+                self._stale[topic] = self._stale.get(topic, 0) + 1
+                self._compact(topic)
+
+            for topic in set(topics).difference(old):
+                self._postings.setdefault(topic, array("q")).append(user_id)
+
+    def remove(self, user_id: int) -> None:
+        self.update(user_id, ())
+
+    def load(self, users_topics: Iterable[tuple[int, tuple[str, ...]]]) -> None:
+        """Replaces the index with the users' topics, building posting lists without any stale entry"""
+
+        with self._lock:
+            self._postings.clear()
+            self._stale.clear()
+            self._topics.clear()
+
+            postings = self._postings
+            for user_id, topics in users_topics:
+                self._topics[user_id] = topics
+                for topic in topics:
+                    posting = postings.get(topic)
+                    if posting is None:
+                        posting = postings[topic] = array("q")
+                    posting.append(user_id)
+
+    def best_match(self, topics: Iterable[str], except_: Container[int]) -> int | None:
+        wanted = set(topics)
+        best_id, best_score = None, 0
+
+        with self._lock:
+            for topic in sorted(wanted, key=self.postings_count):
+                for user_id in self._sample(topic):
+                    if user_id in except_:
+                        continue
+
+                    score = len(wanted.intersection(self._topics.get(user_id, ())))
+                    if score > best_score:
+                        best_id, best_score = user_id, score
+                        if score == len(wanted):
+                            return best_id
+
+        return best_id
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._stale.clear()
+            self._topics.clear()
+
+    def _sample(self, topic: str) -> Iterable[int]:
+        posting = self._postings.get(topic)
+
+        if not posting:
+            return ()
+
+        if len(posting) <= self.sample_size:
+            return posting
+
+        start = self._rng.randrange(len(posting))
+        window = posting[start:start + self.sample_size]
+        if len(window) < self.sample_size:
+            window.extend(posting[:self.sample_size - len(window)])
+        return window
+
+    def _compact(self, topic: str) -> None:
+        posting = self._postings[topic]
+
+        if self._stale[topic] * 2 < len(posting):
+            return
+
+        alive = array("q", dict.fromkeys(user_id for user_id in posting if topic in self._topics.get(user_id, ())))
+        if alive:
+            self._postings[topic] = alive
+        else:
+            del self._postings[topic]
+        self._stale[topic] = 0
@@ -1,15 +1,39 @@
+import os
+from typing import Callable
+
 from pytest import fixture
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from dating.users.crud import USERS_DB
+os.environ.setdefault("DATING_RATE_LIMITS", "0")
+
+from dating.users.crud import USERS_DB, SESSIONS_DB
+from dating.chats.crud import CHATS_DB, MESSAGES_DB
 from dating.main.api import app
 
 
 @fixture(scope="function", autouse=True)
 def clear_db():
     USERS_DB.clear()
+    CHATS_DB.clear()
+    MESSAGES_DB.clear()
+    SESSIONS_DB.clear()
 
 
 @fixture()
 def client() -> TestClient:
     return TestClient(app)
+
+
+@fixture()
+def logged_in_client() -> Callable[..., TestClient]:
+    """Registers and logs in username on app, returning a client with their session cookie"""
+
+    def login(username: str, app: FastAPI = app) -> TestClient:
+        client = TestClient(app)
+        credentials = {"username": username, "password": "123456qwerty"}
+        client.post("/users", json=credentials)
+        client.post("/users/login", json=credentials)
+        return client
+
+    return login
@@ -0,0 +1,123 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+from dating.admission import AdmissionMiddleware, ConcurrencyLimit, TokenBuckets
+from dating.main.api import create_app
+from dating.main.config import Settings, HASHING_BURST_PER_IP, HASHING_BURST_PER_USERNAME
+
+
+PASSWORD = "123456qwerty"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_buckets_refill():
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=2, burst=3, max_size=10, clock=clock)
+
+    assert [buckets.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert buckets.acquire("a") == 0.5
+    assert buckets.acquire("b") == 0
+
+    clock.now += 0.5
+    assert buckets.acquire("a") == 0
+    assert buckets.acquire("a") == 0.5
+    assert buckets.rejected == 2
+
+
+def test_token_buckets_evict_least_recently_used():
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=1, burst=1, max_size=2, clock=clock)
+
+    buckets.acquire("a")
+    buckets.acquire("b")
+    buckets.acquire("a")
+    buckets.acquire("c")
+
+    assert len(buckets) == 2
+    assert buckets.acquire("b") == 0
+    assert buckets.acquire("c") == 1
+
+
+def test_token_buckets_sweep_full_buckets():
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=1, burst=2, max_size=10, clock=clock)
+
+    buckets.acquire("a")
+    clock.now += 1
+    buckets.acquire("b")
+    clock.now += 1
+
+    assert buckets.sweep(limit=10) == 1
+    assert len(buckets) == 1
+
+    clock.now += 1
+    assert buckets.sweep(limit=10) == 1
+    assert len(buckets) == 0
+
+
+def test_rate_limits_logins_by_ip_and_username():
+    app = create_app(Settings(metrics=False))
+
+    assert TestClient(app).post("/users/", json={"username": "alice", "password": PASSWORD}).status_code == 201
+
+    attacker = TestClient(app, client=("10.0.0.1", 1000))
+    statuses = [
+        attacker.post("/users/login", json={"username": "alice", "password": "wrong"}).status_code
+        for _ in range(HASHING_BURST_PER_USERNAME - 1)  # registering took a token of alice
+    ]
+    assert statuses == [400] * (HASHING_BURST_PER_USERNAME - 1)
+
+    response = attacker.post("/users/login", json={"username": "alice", "password": "wrong"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    other = TestClient(app, client=("10.0.0.2", 1000))
+    assert other.post("/users/login", json={"username": "alice", "password": PASSWORD}).status_code == 429
+    assert other.post("/users/login", json={"username": "bob", "password": PASSWORD}).status_code == 400
+
+    flooder = TestClient(app, client=("10.0.0.3", 1000))
+    statuses = [
+        flooder.post("/users/login", json={"username": f"user{i}", "password": PASSWORD}).status_code
+        for i in range(HASHING_BURST_PER_IP + 1)
+    ]
+    assert statuses == [400] * HASHING_BURST_PER_IP + [429]
+    assert flooder.post("/users/", json={"username": "carol", "password": PASSWORD}).status_code == 429
+    assert flooder.get("/users/1").status_code == 200
+
+
+def test_sheds_requests_over_concurrency():
+    released = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await receive()
+        await released.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(
+        slow_app,
+        paths=("/users/login",),
+        by_ip=TokenBuckets(rate=100, burst=100, max_size=10),
+        by_username=TokenBuckets(rate=100, burst=100, max_size=10),
+        concurrency=ConcurrencyLimit(1),
+    )
+
+    async def overload():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(middleware), base_url="http://testserver") as client:
+            first = asyncio.ensure_future(client.post("/users/login", json={"username": "a"}))
+            await asyncio.sleep(0.01)
+            second = await client.post("/users/login", json={"username": "b"})
+            cheap = asyncio.ensure_future(client.post("/users/", json={}))
+            released.set()
+            return (await first).status_code, second.status_code, second.headers["Retry-After"], (await cheap).text
+
+    assert asyncio.run(overload()) == (200, 429, "1", "ok")
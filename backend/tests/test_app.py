@@ -0,0 +1,18 @@
+import asyncio
+
+from dating.chats.service import ChatService
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.service import UserService
+
+
+def test_stateless_services_are_app_scoped():
+    app = create_app(Settings())
+    provide_user_service = app.dependency_overrides[UserService]
+    provide_chat_service = app.dependency_overrides[ChatService]
+
+    user_service = asyncio.run(provide_user_service())
+    chat_service = asyncio.run(provide_chat_service())
+
+    assert asyncio.run(provide_user_service()) is user_service
+    assert chat_service.user_service is user_service
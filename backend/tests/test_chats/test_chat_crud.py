@@ -0,0 +1,130 @@
+from dating.chats.crud import CHATS_DB, ChatRecord, RAMChatCrud
+from dating.chats.schema import Chat
+
+
+def test_get_user_chats():
+    crud = RAMChatCrud()
+    first = crud.create_chat([1, 2])
+    second = crud.create_chat([1, 3])
+    crud.create_chat([2, 3])
+
+    assert crud.get_user_chats(1) == [first, second]
+    assert crud.get_user_chats(4) == []
+
+
+def test_delete_chat_for_user_updates_user_index():
+    crud = RAMChatCrud()
+    chat = crud.create_chat([1, 2])
+
+    left = crud.delete_chat_for_user(chat.id, 1)
+
+    assert left == Chat(id=chat.id, users_ids=[2])
+    assert crud.get_by_id(chat.id) == left
+    assert crud.get_user_chats(1) == []
+    assert crud.get_user_chats(2) == [left]
+    assert crud.delete_chat_for_user(chat.id, 1) is None
+
+
+def test_delete_chat_updates_user_index():
+    crud = RAMChatCrud()
+    chat = crud.create_chat([1, 2])
+
+    assert crud.delete_chat(chat.id) == chat
+    assert crud.get_by_id(chat.id) is None
+    assert crud.get_user_chats(1) == []
+    assert crud.get_user_chats(2) == []
+    assert len(CHATS_DB) == 0
+
+
+def test_returned_chats_do_not_alias_storage():
+    crud = RAMChatCrud()
+    chat = crud.create_chat([1, 2])
+
+    chat.users_ids.append(3)
+
+    assert crud.get_by_id(chat.id).users_ids == [1, 2]
+
+
+def test_create_and_delete_chats():
+    crud = RAMChatCrud()
+    first, second = crud.create_chats([[1, 2], [2, 3]])
+
+    assert crud.get_user_chats(2) == [first, second]
+    assert crud.delete_chats([second.id, 100, second.id]) == [second]
+    assert crud.get_user_chats(3) == []
+    assert len(CHATS_DB) == 1
+
+
+def test_get_user_chats_pages():
+    crud = RAMChatCrud()
+    chats = [crud.create_chat([1, i]) for i in range(2, 8)]
+    CHATS_DB.add(ChatRecord(100, [1, 2]))
+    CHATS_DB.add(ChatRecord(50, [1, 3]))
+
+    assert crud.get_user_chats(1, after=None, limit=2) == chats[:2]
+    assert crud.get_user_chats(1, after=chats[1].id, limit=3) == chats[2:5]
+    assert [chat.id for chat in crud.get_user_chats(1, after=chats[5].id, limit=10)] == [50, 100]
+    assert crud.get_user_chats(1, after=100, limit=10) == []
+    assert crud.get_user_chats(40, after=None, limit=10) == []
+
+
+def test_chat_partners_follow_memberships():
+    crud = RAMChatCrud()
+    first = crud.create_chat([1, 2])
+    second = crud.create_chat([1, 2, 3, 3])
+
+    assert crud.get_chat_partners(1) == {2, 3}
+    assert crud.get_chat_partners(3) == {1, 2}
+
+    crud.delete_chat(first.id)
+    assert crud.get_chat_partners(1) == {2, 3}
+
+    crud.delete_chat_for_user(second.id, 3)
+    assert crud.get_chat_partners(1) == {2, 3}
+    crud.delete_chat_for_user(second.id, 3)
+    assert crud.get_chat_partners(1) == {2}
+    assert crud.get_chat_partners(3) == set()
+
+    crud.delete_chat(second.id)
+    assert crud.get_chat_partners(2) == set()
+    assert CHATS_DB.partners == {}
+
+
+def test_reclaim_chats_left_with_few_members():
+    crud = RAMChatCrud()
+    group = crud.create_chat([1, 2, 3])
+    pair = crud.create_chat([1, 2])
+    kept = crud.create_chat([1, 2])
+
+    crud.delete_chat_for_user(group.id, 1)
+    crud.delete_chat_for_user(pair.id, 1)
+    crud.delete_chat_for_user(pair.id, 2)
+
+    assert crud.reclaim_chats(min_members=1, limit=10) == (2, [pair.id])
+    assert crud.get_by_id(pair.id) is None
+    assert crud.get_user_chats(2) == [crud.get_by_id(group.id), kept]
+    assert CHATS_DB.shrunk == {}
+
+    crud.delete_chat_for_user(group.id, 2)
+    crud.delete_chat_for_user(kept.id, 2)
+    assert crud.reclaim_chats(min_members=2, limit=1) == (1, [group.id])
+    assert crud.reclaim_chats(min_members=2, limit=1) == (1, [kept.id])
+    assert crud.count_chats() == 0
+    assert CHATS_DB.partners == {}
+
+
+def test_load_queues_chats_that_lost_members():
+    CHATS_DB.load([ChatRecord(1, [1, 2]), ChatRecord(2, [3]), ChatRecord(3, [])], next_id=4)
+
+    assert list(CHATS_DB.shrunk) == [2, 3]
+    assert RAMChatCrud().reclaim_chats(min_members=1, limit=10) == (2, [3])
+
+
+def test_chats_created_with_fewer_than_two_members_are_queued():
+    crud = RAMChatCrud()
+    alone = crud.create_chat([1])
+    twice = crud.create_chat([2, 2])
+    crud.create_chat([1, 2])
+
+    assert list(CHATS_DB.shrunk) == [alone.id, twice.id]
+    assert crud.reclaim_chats(min_members=2, limit=10) == (2, [alone.id, twice.id])
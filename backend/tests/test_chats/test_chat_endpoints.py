@@ -0,0 +1,156 @@
+import pytest
+from starlette.testclient import WebSocketDenialResponse
+
+from dating.chats.crud import CHATS_DB, MESSAGES_DB
+
+
+def test_chat_messages(logged_in_client):
+    first = logged_in_client("first")
+    second = logged_in_client("second")
+    chat_id = first.post("/chats/", json=[2]).json()["id"]
+
+    with first.websocket_connect(f"/chats/{chat_id}/ws") as first_ws, \
+            second.websocket_connect(f"/chats/{chat_id}/ws") as second_ws:
+        first_ws.send_json({"text": "hello"})
+
+        for ws in (first_ws, second_ws):
+            message = ws.receive_json()
+            assert message["text"] == "hello"
+            assert message["author_id"] == 1
+            assert message["chat_id"] == chat_id
+
+
+def test_chat_messages_for_non_member(logged_in_client):
+    first = logged_in_client("first")
+    logged_in_client("second")
+    third = logged_in_client("third")
+    chat_id = first.post("/chats/", json=[2]).json()["id"]
+
+    with pytest.raises(WebSocketDenialResponse) as err:
+        with third.websocket_connect(f"/chats/{chat_id}/ws"):
+            pass
+
+    assert err.value.status_code == 403
+
+
+def test_get_messages(logged_in_client):
+    first = logged_in_client("first")
+    second = logged_in_client("second")
+    chat_id = first.post("/chats/", json=[2]).json()["id"]
+
+    for text in ("first", "second", "third"):
+        response = first.post(f"/chats/{chat_id}/messages", json={"text": text})
+        assert response.status_code == 201
+
+    response = second.get(f"/chats/{chat_id}/messages", params={"before": 3, "limit": 1})
+
+    assert response.status_code == 200
+    assert [message["text"] for message in response.json()] == ["second"]
+
+
+def test_start_chat_with_user_sharing_most_topics(logged_in_client):
+    clients = {name: logged_in_client(name) for name in ("me", "music", "both", "none")}
+    clients["me"].put("/users/me/topics", json={"topics": ["music", "chess"]})
+    clients["music"].put("/users/me/topics", json={"topics": ["music"]})
+    both_id = clients["both"].put("/users/me/topics", json={"topics": ["chess", "music", "hiking"]}).json()["id"]
+    music_id = clients["music"].get("/users/me").json()["id"]
+
+    first = clients["me"].post("/chats/start").json()
+    second = clients["me"].post("/chats/start").json()
+
+    assert first["users_ids"][1] == both_id
+    assert second["users_ids"][1] == music_id
+
+
+def test_get_user_chats_with_users(logged_in_client):
+    first = logged_in_client("first")
+    logged_in_client("second")
+    logged_in_client("third")
+    first.post("/chats/", json=[2])
+    first.post("/chats/", json=[2, 3])
+
+    response = first.get("/chats/user/2/with-users")
+
+    assert response.status_code == 200
+    assert [[user["username"] for user in chat["users"]] for chat in response.json()] == [
+        ["first", "second"], ["first", "second", "third"],
+    ]
+    assert response.json()[0] == {
+        "users_ids": [1, 2],
+        "id": 1,
+        "users": [{"username": "first", "id": 1, "topics": []}, {"username": "second", "id": 2, "topics": []}],
+    }
+
+
+def test_create_and_delete_chats_in_batch(logged_in_client):
+    first = logged_in_client("first")
+    logged_in_client("second")
+    logged_in_client("third")
+
+    response = first.post("/chats/batch", json=[[2], [3], [2, 3]])
+
+    assert response.status_code == 201
+    assert [chat["users_ids"] for chat in response.json()] == [[1, 2], [1, 3], [1, 2, 3]]
+    assert first.post("/chats/batch", json=[[2], [4]]).status_code == 404
+    assert len(first.get("/chats/user/1").json()) == 3
+
+    response = first.post("/chats/batch/delete", json=[1, 3, 10])
+
+    assert response.status_code == 200
+    assert [chat["id"] for chat in response.json()] == [1, 3]
+    assert [chat["id"] for chat in first.get("/chats/user/1").json()] == [2]
+
+
+def test_get_user_chats_by_pages(logged_in_client):
+    first = logged_in_client("first")
+    logged_in_client("second")
+    chats_ids = [first.post("/chats/", json=[2]).json()["id"] for _ in range(5)]
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        response = first.get("/chats/user/2", params=params)
+        assert response.status_code == 200
+        pages.append([chat["id"] for chat in response.json()])
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    assert pages == [chats_ids[:2], chats_ids[2:4], chats_ids[4:]]
+
+    response = first.get("/chats/user/2/with-users", params={"limit": 4})
+    assert [chat["id"] for chat in response.json()] == chats_ids[:4]
+    response = first.get("/chats/user/2/with-users", params={"cursor": response.headers["X-Next-Cursor"]})
+    assert [chat["id"] for chat in response.json()] == chats_ids[4:]
+    assert "X-Next-Cursor" not in response.headers
+
+    assert first.get("/chats/user/2", params={"cursor": "not a cursor"}).status_code == 400
+    assert first.get("/chats/user/2", params={"limit": 0}).status_code == 422
+
+
+def test_chat_messages_refuse_binary_frames(logged_in_client):
+    first = logged_in_client("first")
+    logged_in_client("second")
+    chat_id = first.post("/chats/", json=[2]).json()["id"]
+
+    with first.websocket_connect(f"/chats/{chat_id}/ws") as ws:
+        ws.send_bytes(b"hello")
+        assert ws.receive() == {"type": "websocket.close", "code": 1003, "reason": ""}
+
+
+def test_chat_messages_stop_when_user_leaves(logged_in_client):
+    first = logged_in_client("first")
+    second = logged_in_client("second")
+    chat_id = first.post("/chats/", json=[2]).json()["id"]
+
+    with second.websocket_connect(f"/chats/{chat_id}/ws") as ws:
+        assert second.delete(f"/chats/my/{chat_id}").status_code == 200
+        assert ws.receive() == {"type": "websocket.close", "code": 1008, "reason": ""}
+
+    with first.websocket_connect(f"/chats/{chat_id}/ws") as ws:
+        # Left through another worker, whose hub this one doesn't hear from
+        CHATS_DB.remove_member(chat_id, 1)
+        ws.send_json({"text": "hello"})
+        assert ws.receive() == {"type": "websocket.close", "code": 1008, "reason": ""}
+
+    assert MESSAGES_DB == {}
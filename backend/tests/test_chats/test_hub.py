@@ -0,0 +1,100 @@
+import asyncio
+
+from dating.chats.hub import ChatHub, MessageFeed, RelayedChatHub
+from dating.chats.schema import Message
+
+
+def message(chat_id, text):
+    return Message(id=1, chat_id=chat_id, author_id=1, text=text, created_at=0)
+
+
+def test_publish_fans_out_to_chat_subscribers():
+    async def publish():
+        hub = ChatHub(max_queue=8)
+        first = hub.subscribe(1, 1)
+        second = hub.subscribe(1, 1)
+        other_chat = hub.subscribe(2, 1)
+
+        hub.publish(message(1, "hello"))
+
+        return first.queue.qsize(), second.queue.qsize(), other_chat.queue.qsize()
+
+    assert asyncio.run(publish()) == (1, 1, 0)
+
+
+def test_slow_subscriber_is_dropped():
+    async def publish():
+        hub = ChatHub(max_queue=2)
+        slow = hub.subscribe(1, 1)
+        fast = hub.subscribe(1, 1)
+
+        for i in range(3):
+            hub.publish(message(1, str(i)))
+            if i < 2:
+                await fast.queue.get()
+
+        return hub, slow, fast
+
+    hub, slow, fast = asyncio.run(publish())
+
+    assert slow.dropped
+    assert slow.queue.get_nowait() is None
+    assert not fast.dropped
+    assert hub.subscribers_count(1) == 1
+    assert hub.dropped == 1
+
+
+def test_relayed_hubs_share_messages():
+    async def relay():
+        feed = MessageFeed(size=8)
+        first, second = RelayedChatHub(8, feed, timeout=0.05), RelayedChatHub(8, feed, timeout=0.05)
+        first.start()
+        second.start()
+        await asyncio.sleep(0.1)
+
+        local, remote = first.subscribe(1, 1), second.subscribe(1, 2)
+        first.publish(message(1, "hello"))
+        try:
+            return await asyncio.wait_for(remote.queue.get(), 1), local.queue.qsize(), remote.queue.qsize()
+        finally:
+            first.stop()
+            second.stop()
+
+    received, local_count, remote_left = asyncio.run(relay())
+
+    assert '"hello"' in received
+    assert (local_count, remote_left) == (1, 0)
+
+
+def test_feed_keeps_the_last_messages():
+    feed = MessageFeed(size=2)
+    for i in range(3):
+        feed.publish("origin", message(1, str(i)))
+
+    sequence, messages = feed.read(after=0, timeout=0)
+    assert sequence == 3
+    assert [message.text for _, message in messages] == ["1", "2"]
+    assert feed.read(after=2, timeout=0)[1] == messages[1:]
+    assert feed.read(after=3, timeout=0) == (3, [])
+
+
+def test_departures_close_subscriptions_in_every_hub():
+    async def relay():
+        feed = MessageFeed(size=8)
+        first, second = RelayedChatHub(8, feed, timeout=0.05), RelayedChatHub(8, feed, timeout=0.05)
+        first.start()
+        second.start()
+        await asyncio.sleep(0.1)
+
+        leaving, staying = first.subscribe(1, 2), first.subscribe(1, 3)
+        second.leave(1, 2)
+        try:
+            return await asyncio.wait_for(leaving.queue.get(), 1), leaving.left, first.subscribers_count(1), staying
+        finally:
+            first.stop()
+            second.stop()
+
+    closed, left, count, staying = asyncio.run(relay())
+
+    assert (closed, left, count) == (None, True, 1)
+    assert not staying.left
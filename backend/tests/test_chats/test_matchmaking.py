@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+
+from dating.chats.crud import RAMChatCrud, RAMMessageCrud
+from dating.chats.matchmaking import Matchmaker, MatchQueue, MatchQueueFull
+from dating.chats.service import ChatService, RAMChatServiceImp
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.main.state_server import start_state_server
+from dating.users.crud import RAMUserCrud
+from dating.users.presence import PresenceTracker
+from dating.users.schema import User
+from dating.users.service import UserService, RAMUserServiceImp
+
+
+def test_queue_is_fifo():
+    async def match():
+        queue = MatchQueue(max_size=10)
+        for user_id in (3, 1, 2):
+            queue.put(user_id, ())
+
+        return [queue.pop_match((), except_={4})[0] for _ in range(3)], queue.pop_match((), except_={4})
+
+    assert asyncio.run(match()) == ([3, 1, 2], None)
+
+
+def test_queue_prefers_shared_topics_and_skips_excluded():
+    async def match():
+        queue = MatchQueue(max_size=10, window=3)
+        queue.put(1, ("chess",))
+        queue.put(2, ("music",))
+        queue.put(3, ("music", "chess"))
+        queue.put(4, ("music", "chess"))
+        queue.put(5, ("music", "chess"))
+
+        first, _ = queue.pop_match(("music", "chess"), except_={3})
+        second, _ = queue.pop_match(("music",), except_=set())
+        return first, second
+
+    assert asyncio.run(match()) == (4, 2)
+
+
+def test_queue_rejoin_and_discard():
+    async def wait():
+        queue = MatchQueue(max_size=1)
+        future = queue.put(1, ())
+
+        assert queue.put(1, ()) is future
+        with pytest.raises(MatchQueueFull):
+            queue.put(2, ())
+
+        queue.discard(1, future)
+        return 1 in queue, await future
+
+    assert asyncio.run(wait()) == (False, None)
+
+
+def test_cancelled_wait_leaves_the_queue():
+    async def start():
+        queue = MatchQueue(max_size=10)
+        matchmaker = Matchmaker(queue, PresenceTracker(ttl=60))
+        chat_service = ChatService(
+            RAMChatServiceImp(RAMChatCrud(), RAMMessageCrud(segment_size=16)),
+            UserService(RAMUserServiceImp(RAMUserCrud())),
+        )
+        user = User(id=1, username="waiting", hashed_password="hashed")
+
+        waiting = asyncio.create_task(matchmaker.start_chat(chat_service, user, wait=5))
+        await asyncio.sleep(0.01)
+        queued = 1 in queue
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+        return queued, len(queue), waiting.cancelled()
+
+    assert asyncio.run(start()) == (True, 0, True)
+
+
+def test_waiting_users_are_matched(logged_in_client):
+    app = create_app(Settings(metrics=False))
+    first, second = (
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver", cookies=client.cookies)
+        for client in (logged_in_client("first", app), logged_in_client("second", app))
+    )
+
+    async def start():
+        waiting = asyncio.create_task(first.post("/chats/start", params={"wait": 5}))
+        await asyncio.sleep(0.1)
+        started = await second.post("/chats/start", params={"wait": 5})
+        return (await waiting).json(), started.json()
+
+    waited, started = asyncio.run(start())
+
+    assert waited == started
+    assert waited["users_ids"] == [1, 2]
+
+
+def test_wait_times_out(logged_in_client):
+    client = logged_in_client("alone", create_app(Settings(metrics=False)))
+
+    response = client.post("/chats/start", params={"wait": 0.1})
+
+    assert response.status_code == 201
+    assert response.json() is None
+
+
+def test_online_users_are_preferred(logged_in_client):
+    app = create_app(Settings(metrics=False))
+    logged_in_client("offline", app)
+    online = logged_in_client("online", app)
+    me = logged_in_client("me", app)
+    online.get("/users/me")
+
+    assert [me.post("/chats/start").json()["users_ids"] for _ in range(2)] == [[3, 2], [3, 1]]
+
+
+def test_shared_storage_matches_without_waiting(tmp_path, logged_in_client):
+    settings = Settings(
+        storage="shared",
+        state_server_address=str(tmp_path / "state.sock"),
+        state_server_authkey="test",
+        metrics=False,
+    )
+    server = start_state_server(settings)
+
+    try:
+        app = create_app(settings)
+        logged_in_client("other", app)
+        chat = logged_in_client("me", app).post("/chats/start", params={"wait": 5}).json()
+    finally:
+        server.terminate()
+
+    assert chat["users_ids"] == [2, 1]
@@ -0,0 +1,49 @@
+import asyncio
+
+from dating.chats.crud import MESSAGES_DB, RAMChatCrud, RAMMessageCrud
+from dating.chats.reclaim import ChatReclaimer
+from dating.chats.service import ChatService, RAMChatServiceImp
+from dating.users.crud import RAMUserCrud
+from dating.users.service import UserService, RAMUserServiceImp
+
+
+def test_reclaims_by_slices_with_messages():
+    chats = RAMChatCrud()
+    messages = RAMMessageCrud(segment_size=16)
+    service = ChatService(RAMChatServiceImp(chats, messages), UserService(RAMUserServiceImp(RAMUserCrud())))
+    reclaimer = ChatReclaimer(service, min_members=1, batch=2, max_slices=2)
+
+    created = [chats.create_chat([1, 2]) for _ in range(6)]
+    for chat in created[:5]:
+        messages.add_message(chat.id, 1, "hello")
+        chats.delete_chat_for_user(chat.id, 1)
+        chats.delete_chat_for_user(chat.id, 2)
+
+    asyncio.run(reclaimer.run())
+
+    assert (reclaimer.reclaimed, reclaimer.live) == (4, 2)
+    assert list(MESSAGES_DB) == [created[4].id]
+
+    asyncio.run(reclaimer.run())
+
+    assert (reclaimer.reclaimed, reclaimer.live) == (5, 1)
+    assert MESSAGES_DB == {}
+    assert chats.get_user_chats(1) == [created[5]]
+
+
+def test_goes_on_past_slices_of_chats_that_keep_their_members():
+    chats = RAMChatCrud()
+    messages = RAMMessageCrud(segment_size=16)
+    service = ChatService(RAMChatServiceImp(chats, messages), UserService(RAMUserServiceImp(RAMUserCrud())))
+    reclaimer = ChatReclaimer(service, min_members=1, batch=2, max_slices=2)
+
+    kept = [chats.create_chat([1, 2, 3]) for _ in range(2)]
+    abandoned = chats.create_chat([1, 2])
+    for chat in kept:
+        chats.delete_chat_for_user(chat.id, 3)
+    chats.delete_chat_for_user(abandoned.id, 1)
+    chats.delete_chat_for_user(abandoned.id, 2)
+
+    asyncio.run(reclaimer.run())
+
+    assert (reclaimer.reclaimed, reclaimer.live) == (1, 2)
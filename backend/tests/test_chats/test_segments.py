@@ -0,0 +1,116 @@
+import pytest
+
+from dating.chats.crud import RAMMessageCrud
+from dating.chats.segments import MessageLog, SegmentError
+
+
+@pytest.fixture(params=["memory", "mapped"])
+def log(request, tmp_path):
+    directory = tmp_path if request.param == "mapped" else None
+    log = MessageLog(chat_id=1, segment_size=4, directory=directory)
+    for i in range(1, 11):
+        log.append(author_id=1, text=f"message {i}", created_at=float(i))
+    return log
+
+
+def ids(messages):
+    return [message.id for message in messages]
+
+
+def test_read_latest(log):
+    assert ids(log.read(limit=3)) == [8, 9, 10]
+    assert ids(log.read(limit=50)) == list(range(1, 11))
+
+
+def test_read_before(log):
+    assert ids(log.read(before=6, limit=3)) == [3, 4, 5]
+    assert ids(log.read(before=3, limit=5)) == [1, 2]
+    assert ids(log.read(before=1, limit=5)) == []
+
+
+def test_read_after(log):
+    assert ids(log.read(after=3, limit=4)) == [4, 5, 6, 7]
+    assert ids(log.read(after=8, limit=5)) == [9, 10]
+    assert ids(log.read(after=3, before=6, limit=5)) == [4, 5]
+
+
+def test_messages_survive_sealing(log):
+    message = log.read(after=4, limit=1)[0]
+
+    assert message.text == "message 5"
+    assert message.chat_id == 1
+    assert message.created_at == 5.0
+
+
+def test_sealed_segments_are_written_to_disk(tmp_path):
+    log = MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+    for i in range(9):
+        log.append(author_id=1, text="привет", created_at=0)
+
+    assert len(list((tmp_path / "1").iterdir())) == 2
+    assert log.read(after=0, limit=1)[0].text == "привет"
+
+    log.delete()
+    assert not (tmp_path / "1").exists()
+
+
+def test_sealed_segments_are_reopened(tmp_path):
+    log = MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+    for i in range(1, 10):
+        log.append(author_id=1, text=f"message {i}", created_at=float(i))
+
+    reopened = MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+    assert len(reopened) == 8
+    assert [message.text for message in reopened.read(after=2, limit=3)] == ["message 3", "message 4", "message 5"]
+
+    for i in range(9, 13):
+        reopened.append(author_id=1, text=f"new {i}", created_at=float(i))
+
+    assert ids(reopened.read(limit=50)) == list(range(1, 13))
+    assert reopened.read(after=0, limit=1)[0].text == "message 1"
+    assert len(list((tmp_path / "1").iterdir())) == 3
+
+
+def test_gaps_in_sealed_segments_are_refused(tmp_path):
+    log = MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+    for i in range(12):
+        log.append(author_id=1, text="message", created_at=0)
+    (tmp_path / "1" / "000000000005.seg").unlink()
+
+    with pytest.raises(SegmentError):
+        MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+
+    with pytest.raises(SegmentError):
+        MessageLog(chat_id=1, segment_size=8, directory=tmp_path)
+
+
+def test_recover_moves_unknown_chats_aside(tmp_path):
+    for chat_id in (1, 2):
+        log = MessageLog(chat_id=chat_id, segment_size=4, directory=tmp_path)
+        for i in range(4):
+            log.append(author_id=1, text="message", created_at=0)
+
+    crud = RAMMessageCrud(segment_size=4, directory=tmp_path)
+    assert crud.recover({1}) == 1
+
+    assert ids(crud.get_messages(1, before=None, after=None, limit=10)) == [1, 2, 3, 4]
+    assert not (tmp_path / "2").exists()
+    assert crud.add_message(2, author_id=1, text="new").id == 1
+    assert crud.add_message(1, author_id=1, text="new").id == 5
+
+
+def test_broken_last_segment_is_set_aside(tmp_path):
+    log = MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+    for i in range(8):
+        log.append(author_id=1, text="message", created_at=0)
+    last = tmp_path / "1" / "000000000005.seg"
+    last.write_bytes(last.read_bytes()[:10])
+
+    reopened = MessageLog(chat_id=1, segment_size=4, directory=tmp_path)
+
+    assert len(reopened) == 4
+    assert [path.name.split(".broken-")[0] for path in (tmp_path / "1").glob("*.broken-*")] == [last.name]
+    for i in range(4):
+        reopened.append(author_id=1, text="again", created_at=0)
+    assert [message.text for message in reopened.read(after=4, limit=4)] == ["again"] * 4
+    assert not list((tmp_path / "1").glob("*.tmp"))
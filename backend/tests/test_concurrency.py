@@ -0,0 +1,118 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import pytest
+
+from dating.chats.crud import CHATS_DB, MESSAGES_DB, RAMChatCrud, RAMMessageCrud
+from dating.users.crud import USERS_DB, SESSIONS_DB, RAMUserCrud, RAMSessionCrud
+from dating.users.exceptions import UserAlreadyExists
+from dating.users.schema import UserIn
+
+THREADS = 16
+
+
+@pytest.fixture(autouse=True)
+def frequent_switches():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def hammer(func: Callable[[int], object], count: int) -> list[object]:
+    barrier = threading.Barrier(THREADS)
+
+    def run(thread: int) -> list[object]:
+        barrier.wait()
+        return [func(thread * count + i) for i in range(count)]
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        return [result for results in executor.map(run, range(THREADS)) for result in results]
+
+
+def test_concurrent_registrations_get_unique_ids():
+    crud = RAMUserCrud()
+
+    users = hammer(lambda i: crud.create_user(UserIn(username=f"user{i}", hashed_password="hash")), 200)
+
+    assert sorted(user.id for user in users) == list(range(1, THREADS * 200 + 1))
+    assert sorted(USERS_DB.ids) == sorted(USERS_DB.by_id)
+    assert all(USERS_DB.by_username[record.username] is record for record in USERS_DB)
+
+
+def test_concurrent_registrations_of_one_username():
+    crud = RAMUserCrud()
+
+    def register(_: int) -> bool:
+        try:
+            crud.create_user(UserIn(username="same", hashed_password="hash"))
+        except UserAlreadyExists:
+            return False
+        return True
+
+    assert hammer(register, 20).count(True) == 1
+    assert len(USERS_DB) == len(USERS_DB.ids) == 1
+
+
+def test_concurrent_chat_membership_changes_keep_index():
+    crud = RAMChatCrud()
+    chats = [crud.create_chat([i % 10, (i + 1) % 10, (i + 2) % 10]) for i in range(500)]
+
+    def churn(i: int) -> object:
+        chat = chats[i % len(chats)]
+        if i % 3 == 0:
+            return crud.delete_chat(chat.id)
+        if i % 3 == 1:
+            return crud.delete_chat_for_user(chat.id, chat.users_ids[i % 3])
+        return crud.get_user_chats(i % 10)
+
+    hammer(churn, 300)
+
+    indexed = {(user_id, chat_id) for user_id, chats_ids in CHATS_DB.by_user.items() for chat_id in chats_ids}
+    stored = {(user_id, chat.id) for chat in CHATS_DB for user_id in chat.users_ids}
+    assert indexed == stored
+    assert all(CHATS_DB.by_user.values())
+    assert all(list(chats_ids) == sorted(chats_ids) for chats_ids in CHATS_DB.by_user.values())
+
+    partners: dict[int, dict[int, int]] = {}
+    for chat in CHATS_DB:
+        members = set(chat.users_ids)
+        for user_id in members:
+            for partner_id in members - {user_id}:
+                partners.setdefault(user_id, {})[partner_id] = partners.get(user_id, {}).get(partner_id, 0) + 1
+    assert CHATS_DB.partners == partners
+
+
+def test_concurrent_messages_get_sequential_ids(tmp_path):
+    crud = RAMMessageCrud(segment_size=16, directory=tmp_path)
+
+    def write_or_read(i: int) -> object:
+        if i % 2:
+            return crud.add_message(1, i, "text")
+        ids = [message.id for message in crud.get_messages(1, before=None, after=None, limit=20)]
+        if ids:
+            assert ids == list(range(ids[0], ids[0] + len(ids)))
+        return None
+
+    hammer(write_or_read, 100)
+
+    messages = crud.get_messages(1, before=None, after=0, limit=THREADS * 100)
+    assert [message.id for message in messages] == list(range(1, THREADS * 50 + 1))
+    assert len(MESSAGES_DB[1]) == THREADS * 50
+
+
+def test_concurrent_sessions_stay_bounded():
+    crud = RAMSessionCrud(ttl=0.001, max_sessions=100)
+
+    def churn(i: int) -> object:
+        crud.add_session(f"token{i}", i)
+        crud.get_user_id(f"token{i - 1}")
+        if i % 5 == 0:
+            crud.delete_session(f"token{i - 2}")
+        return crud.sweep(10)
+
+    hammer(churn, 200)
+
+    assert len(SESSIONS_DB) <= 100
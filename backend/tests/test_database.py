@@ -0,0 +1,171 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from dating.chats.crud import SQLiteChatCrud, SQLiteMessageCrud
+from dating.database import SQLiteConnectionPool
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.crud import SQLiteUserCrud, SQLiteSessionCrud
+from dating.users.exceptions import UserAlreadyExists
+from dating.users.schema import UserIn
+
+
+@pytest.fixture()
+def pool(tmp_path):
+    pool = SQLiteConnectionPool(str(tmp_path / "dating.sqlite3"), size=2)
+    pool.create_tables()
+    yield pool
+    pool.close()
+
+
+def test_users(pool):
+    crud = SQLiteUserCrud(pool)
+    user = crud.create_user(UserIn(username="testusername", hashed_password="hash"))
+
+    assert crud.get_user_by_id(user.id) == user
+    assert crud.get_user_by_username("testusername") == user
+    assert crud.get_random_user(except_={user.id}) is None
+
+    with pytest.raises(UserAlreadyExists):
+        crud.create_user(UserIn(username="testusername", hashed_password="hash"))
+
+
+def test_user_topics(pool):
+    crud = SQLiteUserCrud(pool)
+    users = [crud.create_user(UserIn(username=f"user{i}", hashed_password="hash")) for i in range(4)]
+    crud.set_topics(users[1].id, ["knitting"])
+    crud.set_topics(users[2].id, ["music", "chess", "hiking"])
+    crud.set_topics(users[3].id, ["hiking", "chess"])
+
+    assert crud.set_topics(users[0].id, ["music", "chess"]).topics == ["music", "chess"]
+    assert crud.get_user_by_username("user0").topics == ["music", "chess"]
+    assert crud.get_best_match(["music", "chess"], except_={users[0].id}).id == users[2].id
+    assert crud.get_best_match(["music", "chess"], except_={users[0].id, users[2].id}).id == users[3].id
+    assert crud.get_best_match(["cooking"], except_=set()) is None
+    assert crud.set_topics(100, ["music"]) is None
+
+
+def test_chats(pool):
+    crud = SQLiteChatCrud(pool)
+    first = crud.create_chat([1, 2])
+    second = crud.create_chat([1, 3])
+
+    assert crud.get_user_chats(1) == [first, second]
+    assert crud.get_user_chats(1, after=None, limit=1) == [first]
+    assert crud.get_user_chats(1, after=first.id, limit=5) == [second]
+    assert crud.get_chat_partners(1) == {2, 3}
+    assert crud.delete_chat_for_user(first.id, 1).users_ids == [2]
+    assert crud.get_chat_partners(1) == {3}
+    assert crud.get_user_chats(1) == [second]
+    assert crud.delete_chat(second.id) == second
+    assert crud.get_by_id(second.id) is None
+
+
+def test_batches(pool):
+    users = SQLiteUserCrud(pool)
+    chats = SQLiteChatCrud(pool)
+    first, second, third = (users.create_user(UserIn(username=f"user{i}", hashed_password="hash")) for i in range(3))
+    users.set_topics(second.id, ["music"])
+    deleted = chats.create_chat([first.id, second.id])
+    chats.delete_chat(deleted.id)
+
+    assert users.get_users_by_ids([third.id, 100, second.id, third.id]) == [third, users.get_user_by_id(second.id)]
+    assert users.get_users_by_ids([]) == []
+
+    created = chats.create_chats([[first.id, second.id], [second.id, third.id], [third.id]])
+    emptied = created[2]
+    chats.delete_chat_for_user(emptied.id, third.id)
+
+    assert [chat.id for chat in created] == [deleted.id + 1, deleted.id + 2, deleted.id + 3]
+    assert [chats.get_by_id(chat.id) for chat in created[:2]] == created[:2]
+    assert chats.create_chats([]) == []
+
+    removed = chats.delete_chats([created[1].id, 100, emptied.id, created[1].id])
+
+    assert [(chat.id, chat.users_ids) for chat in removed] == [(created[1].id, [second.id, third.id]), (emptied.id, [])]
+    assert chats.get_by_id(created[1].id) is None
+    assert chats.get_user_chats(third.id) == []
+
+
+def test_random_user_past_the_probes(pool):
+    crud = SQLiteUserCrud(pool)
+    users = [crud.create_user(UserIn(username=f"user{i}", hashed_password="hash")) for i in range(50)]
+    kept = users[20]
+    except_ = {user.id for user in users} - {kept.id}
+
+    assert all(crud.get_random_user(except_=except_) == kept for _ in range(20))
+
+
+def test_reclaim_chats_by_slices(pool):
+    crud = SQLiteChatCrud(pool)
+    chats = [crud.create_chat([1, 2]) for _ in range(5)]
+    crud.delete_chat_for_user(chats[0].id, 1)
+    for chat in chats[1::2]:
+        crud.delete_chat_for_user(chat.id, 1)
+        crud.delete_chat_for_user(chat.id, 2)
+
+    assert crud.reclaim_chats(min_members=1, limit=2) == (2, [chats[1].id])
+    assert crud.reclaim_chats(min_members=1, limit=2) == (1, [chats[3].id])
+    assert crud.reclaim_chats(min_members=1, limit=2) == (0, [])
+    assert crud.reclaim_chats(min_members=2, limit=10) == (0, [])
+    assert crud.count_chats() == 3
+    assert [chat.id for chat in crud.get_user_chats(2)] == [chats[0].id, chats[2].id, chats[4].id]
+
+    with pool.connection() as connection:
+        assert connection.execute("SELECT count(*) FROM shrunk_chats").fetchone() == (0,)
+
+
+def test_chats_created_with_fewer_than_two_members_are_reclaimed(pool):
+    crud = SQLiteChatCrud(pool)
+    alone = crud.create_chat([1])
+    pair, twice = crud.create_chats([[1, 2], [2, 2]])
+
+    assert crud.count_chats() == 3
+    assert crud.reclaim_chats(min_members=2, limit=10) == (2, [alone.id, twice.id])
+
+    crud.delete_chats([pair.id])
+    assert crud.count_chats() == 0
+
+    crud.create_chat([1, 2])
+    with pool.connection() as connection, connection:
+        connection.execute("DELETE FROM chats_count")
+    pool.create_tables()
+    assert crud.count_chats() == 1
+
+
+def test_messages(pool):
+    chat = SQLiteChatCrud(pool).create_chat([1, 2])
+    crud = SQLiteMessageCrud(pool)
+    for i in range(5):
+        crud.add_message(chat.id, 1, f"message {i}")
+
+    assert [message.id for message in crud.get_messages(chat.id, before=None, after=None, limit=2)] == [4, 5]
+    assert [message.id for message in crud.get_messages(chat.id, before=4, after=None, limit=2)] == [2, 3]
+    assert [message.id for message in crud.get_messages(chat.id, before=None, after=1, limit=2)] == [2, 3]
+
+
+def test_sessions(pool):
+    now = [0.0]
+    crud = SQLiteSessionCrud(pool, ttl=10, clock=lambda: now[0])
+    crud.add_session("first", 1)
+    now[0] = 5
+    crud.add_session("second", 2)
+
+    now[0] = 12
+    assert crud.get_user_id("second") == 2
+    assert crud.sweep(limit=100) == 1
+    assert crud.get_user_id("first") is None
+
+
+def test_app_with_sqlite_storage(tmp_path):
+    client = TestClient(create_app(Settings(storage="sqlite", sqlite_path=str(tmp_path / "dating.sqlite3"))))
+    input_data = {
+        "username": "testusername",
+        "password": "123456qwerty"
+    }
+
+    client.post("/users", json=input_data)
+    client.post("/users/login", json=input_data)
+
+    response = client.get("/users/me")
+    assert response.json() == {"id": 1, "username": "testusername", "topics": []}
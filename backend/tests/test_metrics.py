@@ -0,0 +1,60 @@
+import threading
+
+from fastapi.testclient import TestClient
+
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.metrics import Gauge, Histogram
+
+
+def test_histogram_merges_thread_shards():
+    histogram = Histogram("latency", "Latency", ("route",), buckets=(0.1, 1.0))
+
+    def observe():
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(("/a",), value)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert list(histogram.samples()) == [
+        'latency_bucket{route="/a",le="0.1"} 8',
+        'latency_bucket{route="/a",le="1.0"} 12',
+        'latency_bucket{route="/a",le="+Inf"} 16',
+        'latency_sum{route="/a"} 22.6',
+        'latency_count{route="/a"} 16',
+    ]
+
+
+def test_gauge_escapes_labels():
+    gauge = Gauge("in_flight", "In flight", ("name",))
+    gauge.add(('say "hi"\n',), 2)
+    gauge.add(('say "hi"\n',), -1)
+
+    assert list(gauge.samples()) == ['in_flight{name="say \\"hi\\"\\n"} 1']
+
+
+def test_metrics_endpoint():
+    client = TestClient(create_app(Settings()))
+    client.post("/users", json={"username": "user", "password": "password"})
+    client.post("/users/login", json={"username": "user", "password": "password"})
+    client.get("/users/me")
+    client.get("/users/100")
+
+    text = client.get("/metrics").text
+
+    assert 'dating_http_request_duration_seconds_count{method="GET",route="/users/{user_id}",status="404"} 1' in text
+    assert 'dating_dependency_duration_seconds_count{dependency="get_current_user"} 1' in text
+    assert 'dating_crud_duration_seconds_count{crud="users",method="create_user"} 1' in text
+    assert 'dating_password_hashing_duration_seconds_count{method="verify"} 1' in text
+    assert "dating_password_hash_seconds_count 2" in text
+    assert "# TYPE dating_password_hash_max_seconds gauge" in text
+
+
+def test_metrics_disabled():
+    client = TestClient(create_app(Settings(metrics=False)))
+
+    assert client.get("/metrics").status_code == 404
@@ -0,0 +1,23 @@
+import random
+from collections import Counter
+
+from dating.sampling import sample_excluding
+
+
+def test_sample_excluding_is_uniform():
+    rng = random.Random(0)
+    population = list(range(10))
+    except_ = {0, 3, 4, 7}
+    draws = 60_000
+
+    counts = Counter(sample_excluding(population, except_, rng) for _ in range(draws))
+
+    assert set(counts) == set(population) - except_
+    expected = draws / len(counts)
+    chi_square = sum((count - expected) ** 2 / expected for count in counts.values())
+    assert chi_square < 20.5  # p = 0.001 for 5 degrees of freedom
+
+
+def test_sample_excluding_everything_excluded():
+    assert sample_excluding([1, 2, 3], {1, 2, 3}) is None
+    assert sample_excluding([], set()) is None
@@ -0,0 +1,54 @@
+import json
+from dataclasses import asdict
+
+import pytest
+
+from dating.serialization import encoder_for, json_list_response
+from dating.users.schema import User, UserOut
+from dating.chats.schema import Chat, ChatOut, ChatWithUsers, ChatWithUsersOut, Message, MessageOut
+
+
+def test_encoder_skips_fields_missing_in_schema():
+    user = User(id=1, username='a"б\\', hashed_password="secret")
+
+    encoded = encoder_for(UserOut)(user)
+
+    assert json.loads(encoded) == {"id": 1, "username": 'a"б\\', "topics": []}
+    assert "secret" not in encoded
+
+
+def test_encoder_matches_json_dumps():
+    chat = Chat(id=3, users_ids=[1, 2])
+    message = Message(id=1, chat_id=3, author_id=2, text="line\nbreak", created_at=0.1)
+
+    assert json.loads(encoder_for(ChatOut)(chat)) == asdict(chat)
+    assert json.loads(encoder_for(MessageOut)(message)) == asdict(message)
+
+
+def test_json_list_response():
+    response = json_list_response(ChatOut, [Chat(id=1, users_ids=[]), Chat(id=2, users_ids=[3])])
+
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == [{"id": 1, "users_ids": []}, {"id": 2, "users_ids": [3]}]
+
+
+def test_encoder_writes_nested_schemas():
+    user = User(id=1, username="first", hashed_password="secret", topics=["music"])
+    chat = ChatWithUsers(id=3, users_ids=[1, 4], users=[user])
+
+    encoded = encoder_for(ChatWithUsersOut)(chat)
+
+    assert json.loads(encoded) == {
+        "users_ids": [1, 4], "id": 3, "users": [{"username": "first", "id": 1, "topics": ["music"]}],
+    }
+    assert "secret" not in encoded
+
+
+def test_encoder_rejects_floats_json_cannot_hold():
+    encode = encoder_for(MessageOut)
+
+    for created_at in (float("inf"), float("-inf"), float("nan")):
+        with pytest.raises(ValueError):
+            encode(Message(id=1, chat_id=1, author_id=1, text="", created_at=created_at))
+
+    assert json.loads(encode(Message(id=1, chat_id=1, author_id=1, text="", created_at=1e300)))["created_at"] == 1e300
@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.main.state_server import start_state_server
+
+
+PASSWORD = "123456qwerty"
+
+
+@pytest.fixture()
+def settings(tmp_path):
+    settings = Settings(
+        storage="shared",
+        state_server_address=str(tmp_path / "state.sock"),
+        state_server_authkey="test",
+    )
+    server = start_state_server(settings)
+    yield settings
+    server.terminate()
+
+
+@pytest.fixture()
+def workers():
+    context = multiprocessing.get_context("spawn")
+    executors = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(3)]
+    yield executors
+    for executor in executors:
+        executor.shutdown()
+
+
+def client_for(settings, cookie=None):
+    client = TestClient(create_app(settings))
+    if cookie:
+        client.cookies.set("Authorization", cookie)
+    return client
+
+
+def register(settings, username):
+    client = client_for(settings)
+    user_id = client.post("/users", json={"username": username, "password": PASSWORD}).json()["id"]
+    client.post("/users/login", json={"username": username, "password": PASSWORD})
+    return os.getpid(), user_id, client.cookies["Authorization"]
+
+
+def get_me(settings, cookie):
+    response = client_for(settings, cookie).get("/users/me")
+    return response.status_code, response.json()
+
+
+def create_chats(settings, cookie, users_ids):
+    client = client_for(settings, cookie)
+    return [client.post("/chats/", json=[user_id]).json()["id"] for user_id in users_ids]
+
+
+def logout(settings, cookie):
+    return client_for(settings, cookie).post("/users/logout").status_code
+
+
+def test_workers_share_state(settings, workers):
+    registrations = [
+        worker.submit(register, settings, f"user{i}")
+        for i, worker in enumerate(workers)
+    ]
+    pids, users_ids, cookies = zip(*(registration.result() for registration in registrations))
+
+    assert len(set(pids)) == len(workers)
+    assert sorted(users_ids) == [1, 2, 3]
+
+    for i, cookie in enumerate(cookies):
+        other_worker = workers[(i + 1) % len(workers)]
+        assert other_worker.submit(get_me, settings, cookie).result() == (
+            200, {"id": users_ids[i], "username": f"user{i}", "topics": []}
+        )
+
+    chats = [
+        worker.submit(create_chats, settings, cookie, [user_id for user_id in users_ids if user_id != own_id] * 5)
+        for worker, cookie, own_id in zip(workers, cookies, users_ids)
+    ]
+    chats_ids = [chat_id for created in chats for chat_id in created.result()]
+    assert sorted(chats_ids) == list(range(1, 31))
+
+    assert workers[2].submit(logout, settings, cookies[0]).result() == 200
+    assert workers[1].submit(get_me, settings, cookies[0]).result()[0] == 401
+
+
+def test_batches_through_state_server(settings):
+    _, first_id, cookie = register(settings, "first")
+    _, second_id, _ = register(settings, "second")
+    client = client_for(settings, cookie)
+
+    created = client.post("/chats/batch", json=[[second_id], [second_id]]).json()
+    chats = client.get(f"/chats/user/{second_id}/with-users").json()
+    deleted = client.post("/chats/batch/delete", json=[created[0]["id"]]).json()
+
+    assert [chat["users_ids"] for chat in created] == [[first_id, second_id]] * 2
+    assert [user["username"] for user in chats[0]["users"]] == ["first", "second"]
+    assert [chat["id"] for chat in deleted] == [created[0]["id"]]
+    assert [user["id"] for user in client.get("/users/", params={"ids": [second_id]}).json()] == [second_id]
+
+    response = client.get(f"/chats/user/{first_id}", params={"limit": 1})
+    assert [chat["id"] for chat in response.json()] == [created[1]["id"]]
+    assert "X-Next-Cursor" not in response.headers
+    assert client.post("/chats/start").status_code == 201
+
+
+def test_messages_reach_subscribers_of_other_workers(settings):
+    _, first_id, first_cookie = register(settings, "first")
+    _, second_id, second_cookie = register(settings, "second")
+
+    with client_for(settings, first_cookie) as first, client_for(settings, second_cookie) as second:
+        chat_id = first.post("/chats/", json=[second_id]).json()["id"]
+
+        with first.websocket_connect(f"/chats/{chat_id}/ws") as websocket:
+            response = second.post(f"/chats/{chat_id}/messages", json={"text": "hello"})
+            assert response.status_code == 201
+            assert websocket.receive_json()["text"] == "hello"
@@ -0,0 +1,172 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from dating.chats.crud import CHATS_DB, MESSAGES_DB, RAMChatCrud, RAMMessageCrud
+from dating.chats.segments import MessageLog
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.snapshots import SnapshotError, Snapshotter, load_snapshot, snapshot_stores, write_snapshot
+from dating.users.crud import USERS_DB, SESSIONS_DB, RAMSessionCrud, RAMUserCrud, Session
+from dating.users.schema import UserIn
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fill_stores(clock):
+    users, chats = RAMUserCrud(), RAMChatCrud()
+    sessions = RAMSessionCrud(ttl=100, max_sessions=10, clock=clock)
+
+    first = users.create_user(UserIn(username="first", hashed_password="hash"))
+    second = users.create_user(UserIn(username="nul\0name ✓", hashed_password="other hash"))
+    users.set_topics(second.id, ["music", "chess"])
+    chats.create_chat([first.id, second.id])
+    emptied = chats.create_chat([first.id])
+    chats.delete_chat_for_user(emptied.id, first.id)
+    chats.delete_chat(chats.create_chat([second.id]).id)
+    chats.create_chat([second.id, second.id])
+
+    sessions.add_session("fresh", second.id)
+    SESSIONS_DB["expired"] = Session(first.id, clock.now)
+    return users, chats
+
+
+def new_log(chat_id):
+    return MessageLog(chat_id, segment_size=4)
+
+
+def snapshot_state():
+    return (
+        dict(USERS_DB.by_id),
+        dict(USERS_DB.by_username),
+        USERS_DB.ids.tolist(),
+        {chat.id: chat.users_ids.tolist() for chat in CHATS_DB},
+        {user_id: list(chats) for user_id, chats in CHATS_DB.by_user.items()},
+        {user_id: dict(partners) for user_id, partners in CHATS_DB.partners.items()},
+    )
+
+
+def test_snapshot_round_trip(tmp_path):
+    clock = Clock()
+    users, chats = fill_stores(clock)
+    expected = snapshot_state()
+    path = tmp_path / "dating.snapshot"
+
+    stats = write_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, clock)
+    USERS_DB.clear()
+    CHATS_DB.clear()
+    SESSIONS_DB.clear()
+    clock.now += 60
+    restored = load_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, new_log, clock)
+
+    assert tuple(stats) == (2, 3, 2, 0)
+    assert tuple(restored) == (2, 3, 1, 0)
+    assert snapshot_state() == expected
+    assert [chat.id for chat in chats.get_user_chats(2)] == [1, 4]
+
+    chats.delete_chat(4)
+    assert list(CHATS_DB.by_user[2]) == [1]
+    assert list(SESSIONS_DB) == ["fresh"]
+    assert SESSIONS_DB["fresh"].expires_at == pytest.approx(clock.now + 100, abs=1)
+    assert USERS_DB.topics.best_match(["chess"], except_=set()) == 2
+    assert users.create_user(UserIn(username="third", hashed_password="hash")).id == 3
+    assert chats.create_chat([1]).id == 5
+
+
+def test_snapshot_in_forked_child(tmp_path):
+    fill_stores(Clock())
+    path = tmp_path / "dating.snapshot"
+    snapshotter = Snapshotter(path, snapshot_stores)
+
+    snapshotter.take()
+
+    assert (snapshotter.taken, snapshotter.failed) == (1, 0)
+    assert not snapshotter.running
+    assert load_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, new_log).users == 2
+    assert RAMUserCrud().create_user(UserIn(username="third", hashed_password="hash")).id == 3
+
+
+def test_invalid_snapshot(tmp_path):
+    fill_stores(Clock())
+    path = tmp_path / "dating.snapshot"
+    write_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB)
+    data = path.read_bytes()
+
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(SnapshotError):
+        load_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, new_log)
+
+    path.write_bytes(b"x" * len(data))
+    with pytest.raises(SnapshotError):
+        load_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, new_log)
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_snapshot_round_trip_of_messages(tmp_path, on_disk):
+    directory = tmp_path / "messages" if on_disk else None
+    crud = RAMMessageCrud(segment_size=4, directory=directory)
+    for i in range(1, 11):
+        crud.add_message(1, author_id=i, text=f"message {i}")
+    crud.add_message(2, author_id=1, text="другой\0чат")
+    expected = {chat_id: log.read(limit=50) for chat_id, log in MESSAGES_DB.items()}
+    path = tmp_path / "dating.snapshot"
+
+    stats = write_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB)
+    MESSAGES_DB.clear()
+    load_snapshot(
+        path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, lambda chat_id: MessageLog(chat_id, 4, directory),
+    )
+
+    assert stats.messages == (3 if on_disk else 11)
+    assert {chat_id: log.read(limit=50) for chat_id, log in MESSAGES_DB.items()} == expected
+    assert crud.add_message(1, author_id=1, text="next").id == 11
+    assert crud.get_messages(1, before=None, after=None, limit=50)[:10] == expected[1]
+
+
+def test_snapshot_refuses_lost_segments(tmp_path):
+    directory = tmp_path / "messages"
+    crud = RAMMessageCrud(segment_size=4, directory=directory)
+    for i in range(6):
+        crud.add_message(1, author_id=1, text="message")
+    path = tmp_path / "dating.snapshot"
+    write_snapshot(path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB)
+
+    (directory / "1" / "000000000001.seg").unlink()
+    with pytest.raises(SnapshotError):
+        load_snapshot(
+            path, USERS_DB, CHATS_DB, SESSIONS_DB, MESSAGES_DB, lambda chat_id: MessageLog(chat_id, 4, directory),
+        )
+
+
+def test_app_restores_its_stores(tmp_path):
+    settings = Settings(
+        snapshot_path=tmp_path / "dating.snapshot", messages_directory=tmp_path / "messages", metrics=False,
+    )
+    credentials = {"username": "testusername", "password": "123456qwerty"}
+
+    with TestClient(create_app(settings)) as client:
+        client.post("/users/", json=credentials)
+        client.post("/users/login", json=credentials)
+        cookie = client.cookies["Authorization"]
+        chat_id = client.post("/chats/", json=[1]).json()["id"]
+        for i in range(5):
+            client.post(f"/chats/{chat_id}/messages", json={"text": f"message {i}"})
+
+    USERS_DB.clear()
+    CHATS_DB.clear()
+    MESSAGES_DB.clear()
+    SESSIONS_DB.clear()
+
+    with TestClient(create_app(settings)) as client:
+        client.cookies.set("Authorization", cookie)
+        response = client.get("/users/me")
+        messages = client.get(f"/chats/{chat_id}/messages").json()
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "testusername"
+    assert [message["text"] for message in messages] == [f"message {i}" for i in range(5)]
@@ -10,6 +10,7 @@ def test_get_me(client):
     expected_result = {
         "id": 1,
         "username": "testusername",
+        "topics": [],
     }
 
     response = client.get(f"/users/me")
@@ -28,6 +29,7 @@ def test_get_user(client):
     expected_result = {
         "id": 1,
         "username": "testusername",
+        "topics": [],
     }
 
     response = client.get(f"/users/{user_id}")
@@ -73,9 +75,39 @@ def test_register(client):
     expected_result = {
         "id": 1,
         "username": "testusername",
+        "topics": [],
     }
 
     response = client.post("/users", json=input_data)
 
     assert response.json() == expected_result
     assert response.status_code == 201
+
+
+def test_set_my_topics(client):
+    input_data = {
+        "username": "testusername",
+        "password": "123456qwerty"
+    }
+
+    client.post("/users", json=input_data)
+    client.post("/users/login", json=input_data)
+    client.get("/users/me")
+
+    response = client.put("/users/me/topics", json={"topics": ["  Board   Games", "music", "board games"]})
+
+    assert response.status_code == 200
+    assert response.json()["topics"] == ["board games", "music"]
+    assert client.get("/users/me").json()["topics"] == ["board games", "music"]
+    assert client.put("/users/me/topics", json={"topics": [""]}).status_code == 422
+
+
+def test_get_users(client):
+    for username in ("first", "second"):
+        client.post("/users", json={"username": username, "password": "123456qwerty"})
+
+    response = client.get("/users/", params={"ids": [2, 3, 1]})
+
+    assert response.status_code == 200
+    assert [user["username"] for user in response.json()] == ["second", "first"]
+    assert client.get("/users/", params={"ids": list(range(1001))}).status_code == 422
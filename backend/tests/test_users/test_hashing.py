@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import pytest
+from passlib.hash import argon2
+
+from dating.users.hashing import PasswordHasherPool, HasherOverloaded
+
+
+class BlockingHasher:
+    released = threading.Event()
+
+    @classmethod
+    def hash(cls, secret):
+        cls.released.wait()
+        return secret
+
+
+def test_hash_and_verify():
+    pool = PasswordHasherPool(argon2, max_workers=2, max_pending=4)
+
+    async def hash_and_verify():
+        hashed = await pool.hash("123456qwerty")
+        return await pool.verify("123456qwerty", hashed), await pool.verify("wrong", hashed)
+
+    assert asyncio.run(hash_and_verify()) == (True, False)
+
+    stats = pool.stats()
+    assert stats.calls == 3
+    assert stats.in_flight == 0
+    assert stats.max_seconds > 0
+    pool.shutdown()
+
+
+def test_rejects_calls_over_max_pending():
+    pool = PasswordHasherPool(BlockingHasher, max_workers=1, max_pending=2)
+
+    async def overload():
+        first = asyncio.ensure_future(pool.hash("first"))
+        second = asyncio.ensure_future(pool.hash("second"))
+        await asyncio.sleep(0)
+        assert pool.stats().queued == 1
+
+        with pytest.raises(HasherOverloaded):
+            await pool.hash("third")
+
+        BlockingHasher.released.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(overload()) == ["first", "second"]
+    assert pool.stats().rejected == 1
+    pool.shutdown()
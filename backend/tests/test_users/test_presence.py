@@ -0,0 +1,78 @@
+from dating.users.presence import PresenceTracker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_user_goes_offline_after_ttl():
+    clock = Clock()
+    presence = PresenceTracker(ttl=10, clock=clock)
+    presence.touch(1)
+    presence.touch(2)
+
+    clock.now = 5
+    presence.touch(1)
+    clock.now = 10
+    presence.sweep(100)
+
+    assert 1 in presence
+    assert 2 not in presence
+    assert len(presence) == 1
+
+
+def test_sweep_is_bounded():
+    clock = Clock()
+    presence = PresenceTracker(ttl=1, clock=clock)
+    for user_id in range(10):
+        presence.touch(user_id)
+
+    clock.now = 1
+
+    assert presence.sweep(3) == 3
+    assert len(presence) == 7
+
+
+def test_connected_user_stays_online():
+    clock = Clock()
+    presence = PresenceTracker(ttl=10, clock=clock)
+    presence.connect(1)
+    presence.connect(1)
+    presence.disconnect(1)
+
+    clock.now = 100
+    presence.sweep(100)
+    assert 1 in presence
+
+    presence.disconnect(1)
+    clock.now = 110
+    presence.sweep(100)
+    assert 1 not in presence
+
+
+def test_random_online_skips_excluded_users():
+    presence = PresenceTracker(ttl=10)
+    for user_id in range(1, 6):
+        presence.touch(user_id)
+
+    picked = {presence.random_online(except_={1, 2, 3}) for _ in range(50)}
+
+    assert picked == {4, 5}
+    assert presence.random_online(except_={1, 2, 3, 4, 5}) is None
+
+
+def test_random_online_after_sweep():
+    clock = Clock()
+    presence = PresenceTracker(ttl=10, clock=clock)
+    for user_id in range(20):
+        clock.now = user_id
+        presence.touch(user_id)
+
+    clock.now = 25
+    presence.sweep(100)
+
+    assert {presence.random_online(except_=set()) for _ in range(200)} == {16, 17, 18, 19}
@@ -0,0 +1,98 @@
+from fastapi.testclient import TestClient
+
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.crud import SESSIONS_DB, RAMSessionCrud
+from dating.users.schema import User
+from dating.users.security import AuthCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_session_expires():
+    clock = Clock()
+    crud = RAMSessionCrud(ttl=10, max_sessions=100, clock=clock)
+    crud.add_session("token", 1)
+
+    clock.now = 9
+    assert crud.get_user_id("token") == 1
+
+    clock.now = 10
+    assert crud.get_user_id("token") is None
+    assert "token" not in SESSIONS_DB
+
+
+def test_sweep_removes_only_expired_sessions():
+    clock = Clock()
+    crud = RAMSessionCrud(ttl=10, max_sessions=100, clock=clock)
+    crud.add_session("first", 1)
+    crud.add_session("second", 2)
+    clock.now = 5
+    crud.add_session("third", 3)
+
+    clock.now = 12
+    assert crud.sweep(limit=100) == 2
+    assert list(SESSIONS_DB) == ["third"]
+
+
+def test_oldest_sessions_are_evicted_over_limit():
+    crud = RAMSessionCrud(ttl=10, max_sessions=2, clock=Clock())
+    crud.add_session("first", 1)
+    crud.add_session("second", 2)
+    crud.add_session("third", 3)
+
+    assert crud.get_user_id("first") is None
+    assert crud.get_user_id("second") == 2
+    assert crud.get_user_id("third") == 3
+
+
+def test_auth_cache_expires_and_evicts():
+    clock = Clock()
+    cache = AuthCache(max_size=2, ttl=5, clock=clock)
+    first = User(id=1, username="first", hashed_password="hash")
+    second = User(id=2, username="second", hashed_password="hash")
+
+    cache.put("a", first)
+    cache.put("b", second)
+    assert cache.get("a") is first
+    cache.put("c", second)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is first
+
+    clock.now = 5
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_auth_cache_invalidate_user():
+    cache = AuthCache(max_size=10, ttl=5)
+    user = User(id=1, username="user", hashed_password="hash")
+    cache.put("a", user)
+    cache.put("b", user)
+
+    cache.invalidate_user(user.id)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+
+
+def test_cached_user_skips_session_lookup_until_logout():
+    client = TestClient(create_app(Settings()))
+    client.post("/users", json={"username": "user", "password": "password"})
+    client.post("/users/login", json={"username": "user", "password": "password"})
+    assert client.get("/users/me").status_code == 200
+
+    SESSIONS_DB.clear()
+    assert client.get("/users/me").status_code == 200
+
+    cookie = client.cookies["Authorization"]
+    client.post("/users/logout")
+    client.cookies["Authorization"] = cookie
+    assert client.get("/users/me").status_code == 401
@@ -0,0 +1,131 @@
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from dating.database import SQLiteConnectionPool
+from dating.main.api import create_app
+from dating.main.config import Settings
+from dating.users.crud import SQLiteRevocationCrud
+from dating.users.security import AuthenticationError, SignedSessionProvider, TokenDenylist
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def provider(clock, secret=b"secret", revocations=None):
+    return SignedSessionProvider(secret, ttl=10, denylist=TokenDenylist(clock), revocations=revocations, clock=clock)
+
+
+def test_signed_token_round_trip_and_expiry():
+    clock = Clock()
+    sessions = provider(clock)
+    token = asyncio.run(sessions.create_token(42))
+
+    clock.now += 9
+    assert asyncio.run(sessions.validate_token(token)) == 42
+
+    clock.now += 1
+    with pytest.raises(AuthenticationError):
+        asyncio.run(sessions.validate_token(token))
+
+
+def test_forged_tokens_are_rejected():
+    clock = Clock()
+    token = asyncio.run(provider(clock).create_token(1))
+    other = asyncio.run(provider(clock, secret=b"other").create_token(1))
+    tampered = ("B" if token[10] == "A" else "A").join((token[:10], token[11:]))
+
+    for invalid in ("", "not a token", "ü" * 64, token[:-4], token + "AAAA", tampered, other, f"{token[:-1]}="):
+        with pytest.raises(AuthenticationError):
+            asyncio.run(provider(clock).validate_token(invalid))
+
+
+def test_denylist_keeps_revoked_tokens_until_they_expire():
+    clock = Clock()
+    sessions = provider(clock)
+    token = asyncio.run(sessions.create_token(1))
+    other = asyncio.run(sessions.create_token(2))
+
+    asyncio.run(sessions.expire_token(token))
+    asyncio.run(sessions.expire_token("garbage"))
+
+    with pytest.raises(AuthenticationError):
+        asyncio.run(sessions.validate_token(token))
+    assert asyncio.run(sessions.validate_token(other)) == 2
+    assert len(sessions.denylist) == 1
+
+    assert sessions.denylist.sweep(limit=10) == 0
+    clock.now += 10
+    assert sessions.denylist.sweep(limit=10) == 1
+
+
+def test_revocations_reach_other_workers(tmp_path):
+    clock = Clock()
+    pool = SQLiteConnectionPool(str(tmp_path / "dating.sqlite3"), size=2)
+    pool.create_tables()
+    revocations = SQLiteRevocationCrud(pool, clock)
+
+    first, second = provider(clock, revocations=revocations), provider(clock, revocations=revocations)
+    tokens = [asyncio.run(first.create_token(user_id)) for user_id in range(3)]
+
+    asyncio.run(first.expire_token(tokens[0]))
+    asyncio.run(second.sync_revocations())
+    asyncio.run(first.expire_token(tokens[1]))
+    asyncio.run(second.sync_revocations())
+
+    for token in tokens[:2]:
+        with pytest.raises(AuthenticationError):
+            asyncio.run(second.validate_token(token))
+    assert asyncio.run(second.validate_token(tokens[2])) == 2
+
+    clock.now += 10
+    assert revocations.sweep(limit=10) == 2
+    assert revocations.get_revocations(after=0) == []
+
+    asyncio.run(first.expire_token(asyncio.run(first.create_token(3))))
+    assert [revocation.sequence for revocation in revocations.get_revocations(after=2)] == [3]
+
+
+def test_signed_tokens_need_a_secret():
+    with pytest.raises(ValueError):
+        Settings(session_tokens="signed")
+
+    with pytest.raises(ValueError):
+        Settings(session_tokens="jwt", session_secret="secret")
+
+    for storage in ("ram", "shared"):
+        with pytest.raises(ValueError):
+            Settings(storage=storage, state_server_authkey="key", session_tokens="signed", session_secret="secret")
+
+
+def test_app_with_signed_tokens(tmp_path):
+    settings = Settings(
+        storage="sqlite",
+        sqlite_path=str(tmp_path / "dating.sqlite3"),
+        session_tokens="signed",
+        session_secret="secret",
+        metrics=False,
+    )
+    client = TestClient(create_app(settings))
+    client.post("/users", json={"username": "user", "password": "password"})
+    client.post("/users/login", json={"username": "user", "password": "password"})
+    cookie = client.cookies["Authorization"]
+
+    with sqlite3.connect(settings.sqlite_path) as connection:
+        assert connection.execute("SELECT count(*) FROM sessions").fetchone() == (0,)
+    assert client.get("/users/me").json()["username"] == "user"
+
+    client.post("/users/logout")
+    client.cookies["Authorization"] = cookie
+    assert client.get("/users/me").status_code == 401
+
+    with TestClient(create_app(settings)) as restarted:
+        restarted.cookies["Authorization"] = cookie
+        assert restarted.get("/users/me").status_code == 401
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from dating.users.topics import TopicIndex, normalize_topics
+
+
+def test_normalize_topics():
+    assert normalize_topics([" Board\tGames ", "MUSIC", "board games"]) == ("board games", "music")
+
+    with pytest.raises(ValueError):
+        normalize_topics([" "])
+    with pytest.raises(ValueError):
+        normalize_topics([str(i) for i in range(17)])
+    with pytest.raises(TypeError):
+        normalize_topics([1])  # type: ignore[list-item]
+
+
+def test_best_match_prefers_largest_overlap():
+    index = TopicIndex()
+    index.update(1, ("music", "chess", "hiking"))
+    index.update(2, ("music",))
+    index.update(3, ("music", "chess"))
+    index.update(4, ("knitting",))
+
+    assert index.best_match(["music", "chess", "hiking"], except_={1}) == 3
+    assert index.best_match(["music", "chess", "hiking"], except_={1, 3}) == 2
+    assert index.best_match(["cooking"], except_=set()) is None
+
+
+def test_changed_topics_are_not_matched():
+    index = TopicIndex()
+    index.update(1, ("music",))
+    index.update(2, ("music",))
+
+    index.update(1, ("chess",))
+    index.remove(2)
+
+    assert index.best_match(["music"], except_=set()) is None
+    assert index.best_match(["chess"], except_=set()) == 1
+    assert index.postings_count("music") == 0
+
+
+def test_stale_postings_are_compacted():
+    index = TopicIndex()
+    for user_id in range(100):
+        index.update(user_id, ("music",))
+    for user_id in range(60):
+        index.update(user_id, ("chess",))
+
+    assert index.postings_count("music") == 40
+    assert len(index._postings["music"]) < 100
+    assert index.best_match(["music"], except_=set()) >= 60
+
+
+def test_best_match_samples_large_topics():
+    index = TopicIndex(sample_size=8, rng=random.Random(0))
+    for user_id in range(1, 10_001):
+        index.update(user_id, ("music",))
+    index.update(10_001, ("music", "rare"))
+
+    assert index.best_match(["music", "rare"], except_=set()) == 10_001
+    assert index.best_match(["music"], except_=set()) is not None
@@ -0,0 +1,31 @@
+from dating.users.crud import USERS_DB, RAMUserCrud
+from dating.users.schema import UserIn
+
+
+def test_create_user_allocates_sequential_ids():
+    crud = RAMUserCrud()
+
+    first = crud.create_user(UserIn(username="first", hashed_password="hash"))
+    second = crud.create_user(UserIn(username="second", hashed_password="hash"))
+
+    assert (first.id, second.id) == (1, 2)
+    assert len(USERS_DB) == 2
+
+
+def test_get_user_by_id_and_username():
+    crud = RAMUserCrud()
+    user = crud.create_user(UserIn(username="testusername", hashed_password="hash"))
+
+    assert crud.get_user_by_id(user.id) == user
+    assert crud.get_user_by_username("testusername") == user
+    assert crud.get_user_by_id(user.id + 1) is None
+    assert crud.get_user_by_username("unknown") is None
+
+
+def test_get_users_by_ids():
+    crud = RAMUserCrud()
+    first = crud.create_user(UserIn(username="first", hashed_password="hash"))
+    second = crud.create_user(UserIn(username="second", hashed_password="hash"))
+
+    assert crud.get_users_by_ids([second.id, 100, first.id, second.id]) == [second, first]
+    assert crud.get_users_by_ids([]) == []